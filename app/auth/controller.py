@@ -6,14 +6,13 @@ from . import service
 from . import model
 from ..database.core import DbSession
 
-
 router = APIRouter()
 
 
 # create account
 @router.post("/sign-up/", status_code=status.HTTP_201_CREATED)
 async def sign_up(db: DbSession, user_request: model.RegisterUserRequest):
-    service.register_user(db, user_request)
+    await service.register_user(db, user_request)
 
 
 # login route
@@ -39,4 +38,4 @@ async def log_in(
     - Content-Type: application/x-www-form-urlencoded
     - username=test@example.com&password=string&grant_type=password
     """
-    return service.get_access_token(db, user_request)
+    return await service.get_access_token(db, user_request)
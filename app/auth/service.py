@@ -1,6 +1,12 @@
 import os
 import jwt
+import time
+import anyio
+import redis
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from fastapi import Depends
 from typing import Annotated
 from uuid import uuid4, UUID
@@ -13,7 +19,8 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 from . import model
 from ..entities.user import User
-from ..database.cache import redis_client
+from ..database.memory_cache import TTLCache
+from ..database.cache import redis_client, subscribe, PASSWORD_CHANGED_CHANNEL
 from ..exceptions import (
     UserEmailConflictError,
     UserUserNameConflictError,
@@ -27,6 +34,14 @@ ALGORITHM = "HS256"
 SECRET_KEY = os.getenv("SECRET_KEY")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
+TOKEN_CACHE_MAX_SIZE = int(os.getenv("TOKEN_CACHE_MAX_SIZE", 10000))
+
+# bcrypt calls running at once per worker, the rest wait without blocking
+# empty means unset, default half the cores
+PASSWORD_HASH_CONCURRENCY = int(
+    os.getenv("PASSWORD_HASH_CONCURRENCY") or max(1, (os.cpu_count() or 1) // 2)
+)
+
 """ 
 OAuth 2.0 protocol for authentication
 
@@ -42,19 +57,34 @@ oauth2_bearer = OAuth2PasswordBearer(tokenUrl="auth/log-in")
 # password hashing
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+"""
+bcrypt costs 100-250 ms of CPU per call, too long for the event loop.
+It releases the GIL, so worker threads hash in parallel while the loop
+keeps serving redirects. The limiter keeps a login burst from taking
+every core, its own pool so it never starves the default thread pool.
+"""
+password_limiter = anyio.CapacityLimiter(PASSWORD_HASH_CONCURRENCY)
+
 
 # hash a pasword
 def get_pass_hash(password: str) -> str:
     return bcrypt_context.hash(password)
 
 
+# hash a password off the event loop
+async def get_pass_hash_async(password: str) -> str:
+    return await anyio.to_thread.run_sync(
+        get_pass_hash, password, limiter=password_limiter
+    )
+
+
 # save a user in databse
-def register_user(db: Session, user_request: model.RegisterUserRequest) -> None:
+async def register_user(db: Session, user_request: model.RegisterUserRequest) -> None:
     create_user = User(
         id=uuid4(),
         username=user_request.username,
         email=user_request.email,
-        password=get_pass_hash(user_request.password),
+        password=await get_pass_hash_async(user_request.password),
     )
 
     try:
@@ -64,7 +94,9 @@ def register_user(db: Session, user_request: model.RegisterUserRequest) -> None:
         db.rollback()
         error_message = str(e)
         logging.warning(
-            f"IntegrityError during registration for email: {user_request.email}, username: {user_request.username}"
+            "IntegrityError during registration for email: %s, username: %s",
+            user_request.email,
+            user_request.username,
         )
 
         """
@@ -81,7 +113,7 @@ def register_user(db: Session, user_request: model.RegisterUserRequest) -> None:
 
     except Exception as e:
         db.rollback()
-        logging.error(f"Failed to create user: {user_request.email}. Error: {str(e)}")
+        logging.error("Failed to create user: %s. Error: %s", user_request.email, e)
         raise InternalServerError()
 
 
@@ -90,11 +122,18 @@ def verify_password(plain_pass: str, hashed_pass: str) -> bool:
     return bcrypt_context.verify(plain_pass, hashed_pass)
 
 
+# verify a password off the event loop
+async def verify_password_async(plain_pass: str, hashed_pass: str) -> bool:
+    return await anyio.to_thread.run_sync(
+        verify_password, plain_pass, hashed_pass, limiter=password_limiter
+    )
+
+
 # authenticate a user
-def authenticate_user(email: str, password: str, db: Session) -> User | bool:
+async def authenticate_user(email: str, password: str, db: Session) -> User | bool:
     user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.password):
-        logging.warning(f"Failed authentication attempt for email: {email}")
+    if not user or not await verify_password_async(password, user.password):
+        logging.warning("Failed authentication attempt for email: %s", email)
         return False
     return user
 
@@ -111,16 +150,17 @@ def create_access_token(email: str, user_id: UUID, expires_delta: timedelta) ->
 
 
 # login to get a access token
-def get_access_token(
+async def get_access_token(
     db: Session, user_request: Annotated[OAuth2PasswordRequestForm, Depends()]
 ) -> model.Token:
     # authenticate_user takes email and password
     # user_request.username is a email address
-    user = authenticate_user(user_request.username, user_request.password, db)
+    user = await authenticate_user(user_request.username, user_request.password, db)
 
     if not user:
         logging.warning(
-            f"User not found for email: {user_request.username}! Request for JWT token."
+            "User not found for email: %s! Request for JWT token.",
+            user_request.username,
         )
         raise AuthenticationError()
 
@@ -131,24 +171,101 @@ def get_access_token(
     return model.Token(access_token=token, token_type="bearer")
 
 
+"""
+Verified tokens, one per worker
+
+- sha256(token) -> (TokenData, iat), kept until the token's exp
+- a hit costs no jwt.decode and no Redis round trip
+- password_changed holds user_id -> last password change seen by this
+  worker, filled by store_password_changed_in_cache here and by pub/sub
+  from other workers, a cached token issued before it is rejected
+- changes older than a token lifetime are dropped, every token issued
+  before them has expired
+"""
+token_cache = TTLCache(
+    maxsize=TOKEN_CACHE_MAX_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60
+)
+password_changed: OrderedDict[str, int] = OrderedDict()
+_password_changed_lock = threading.Lock()
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def record_password_change(user_id: str, timestamp: int) -> None:
+    """tokens of user_id issued at or before timestamp are invalid"""
+    horizon = time.time() - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    with _password_changed_lock:
+        password_changed[user_id] = max(timestamp, password_changed.get(user_id, 0))
+        password_changed.move_to_end(user_id)
+        while password_changed and next(iter(password_changed.values())) < horizon:
+            password_changed.popitem(last=False)
+
+
+def last_password_change(user_id: str) -> int | None:
+    with _password_changed_lock:
+        return password_changed.get(user_id)
+
+
+def on_password_changed(message: str) -> None:
+    user_id, _, timestamp = message.rpartition(":")
+    record_password_change(user_id, int(timestamp))
+
+
+# a change published while disconnected is lost, verify every token again
+subscribe(PASSWORD_CHANGED_CHANNEL, on_password_changed, on_reset=token_cache.clear)
+
+
+def revoked(user_id: str, iat: int, last_changed: int | None) -> bool:
+    if last_changed is not None and last_changed >= iat:
+        logging.warning("Token invalidated for user %s due to password change", user_id)
+        return True
+    return False
+
+
 # verify a token
 def verify_token(token: str) -> model.TokenData:
+    digest = token_digest(token)
+    cached = token_cache.get(digest)
+    if cached is not None:
+        token_data, iat = cached
+        if not revoked(
+            token_data.user_id, iat, last_password_change(token_data.user_id)
+        ):
+            return token_data
+        token_cache.delete(digest)
+        raise AuthenticationError("Token invalid due to password change")
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("id")
+        token_iat_ts = int(payload.get("iat", 0))
 
         # Redis: track last user:password_changed:user_id
-        last_changed = redis_client.get(f"user:password_changed:{user_id}")
+        # Redis down: the changes this worker heard of still apply, the
+        # token isn't cached so Redis checks it again once it is back
+        checked = True
+        try:
+            last_changed = redis_client.get(f"user:password_changed:{user_id}")
+        except redis.RedisError as e:
+            logging.warning(
+                "Redis unavailable, token of user %s checked in process. Error: %s",
+                user_id,
+                e,
+            )
+            last_changed, checked = None, False
         if last_changed:
-            token_iat_ts = int(payload.get("iat", 0))
-            last_changed_ts = int(last_changed)
-            if last_changed_ts >= token_iat_ts:
-                logging.warning(
-                    f"Token invalidated for user {user_id} due to password change"
-                )
-                raise AuthenticationError("Token invalid due to password change")
-
-        return model.TokenData(user_id=user_id)
+            record_password_change(user_id, int(last_changed))
+        if revoked(user_id, token_iat_ts, last_password_change(user_id)):
+            raise AuthenticationError("Token invalid due to password change")
+
+        token_data = model.TokenData(user_id=user_id)
+        if checked:
+            token_cache.set(
+                digest, (token_data, token_iat_ts), ttl=payload["exp"] - time.time()
+            )
+        return token_data
     except AuthenticationError:
         raise
     except jwt.ExpiredSignatureError:
@@ -158,7 +275,7 @@ def verify_token(token: str) -> model.TokenData:
         logging.warning("Invalid token")
         raise AuthenticationError("Invalid token")
     except Exception as e:
-        logging.error(f"Unexpected error while verifying token. Error: {str(e)}")
+        logging.error("Unexpected error while verifying token. Error: %s", e)
         raise AuthenticationError("Token validation failed")
 
 
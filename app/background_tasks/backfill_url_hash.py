@@ -0,0 +1,59 @@
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from ..entities.url import URL
+from ..urls.utils import hash_url
+from ..database.core import SessionLocal
+
+load_dotenv()
+
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", 1000))
+
+
+def backfill_url_hash(db: Session, chunk_size: int = BACKFILL_CHUNK_SIZE) -> int:
+    """
+    url_hash for rows created before the column existed
+    keyset by id, one short transaction per chunk, safe to rerun
+    """
+    urls = URL.__table__
+    last_id = 0
+    updated = 0
+    while True:
+        rows = db.execute(
+            select(URL.id, URL.long_url)
+            .where(URL.id > last_id, URL.url_hash.is_(None))
+            .order_by(URL.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return updated
+
+        db.execute(
+            update(urls)
+            .where(urls.c.id == bindparam("b_id"))
+            .values(url_hash=bindparam("b_hash")),
+            [{"b_id": row.id, "b_hash": hash_url(row.long_url)} for row in rows],
+        )
+        db.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+
+
+def main():
+    db: Session = SessionLocal()
+
+    try:
+        updated = backfill_url_hash(db)
+        print(f"{updated} url hashes backfilled at {datetime.now()}")
+    except Exception as e:
+        db.rollback()
+        print(f"Failed to backfill url hashes at {datetime.now()}. Error: {str(e)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
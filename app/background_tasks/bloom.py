@@ -0,0 +1,98 @@
+"""
+Bloom filter of every short code, rebuilt from urls.short_code
+
+    python -m app.background_tasks.bloom
+
+- the app builds it at startup when Redis has none (first deploy, lost data,
+  new BLOOM_CAPACITY), the first worker does it, the others skip
+- a code missing from it is added back by its first miss, run it by hand
+  after many urls were inserted outside the app
+"""
+
+import os
+import logging
+from datetime import datetime
+from dotenv import load_dotenv
+from redis.exceptions import LockNotOwnedError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..entities.url import URL
+from ..database.core import SessionLocal
+from ..database.cache import (
+    redis_client,
+    bloom_ready,
+    new_bloom_bitmap,
+    set_bloom_bits,
+    start_bloom_build,
+    finish_bloom_build,
+    BLOOM_BITS,
+)
+
+load_dotenv()
+
+BLOOM_CHUNK_SIZE = int(os.getenv("BLOOM_CHUNK_SIZE") or 10000)
+
+
+def rebuild_bloom(db: Session, chunk_size: int = BLOOM_CHUNK_SIZE) -> int:
+    """
+    bits set in memory while streaming the codes, one upload at the end,
+    codes created meanwhile are merged in, returns the codes added
+    """
+    start_bloom_build()
+    bitmap = new_bloom_bitmap()
+    added = 0
+    short_codes = db.scalars(
+        select(URL.short_code)
+        .where(URL.short_code.is_not(None))
+        .execution_options(yield_per=chunk_size)
+    )
+    for short_code in short_codes:
+        set_bloom_bits(bitmap, short_code)
+        added += 1
+    finish_bloom_build(bitmap)
+    return added
+
+
+def ensure_bloom() -> None:
+    """startup, build the filter unless it is ready or being built"""
+    if not BLOOM_BITS:
+        return
+    try:
+        if bloom_ready():
+            return
+        lock = redis_client.lock("urls:bloom:lock", timeout=3600)
+        if not lock.acquire(blocking=False):
+            logging.info("Bloom filter built by another worker, skipped")
+            return
+        db = SessionLocal()
+        try:
+            added = rebuild_bloom(db)
+            logging.info("Bloom filter built with %s short codes", added)
+        finally:
+            db.close()
+            try:
+                lock.release()
+            except LockNotOwnedError:
+                pass
+    except Exception as e:
+        # unknown codes go to the database until a rebuild succeeds
+        logging.warning("Failed to build the Bloom filter. Error: %s", e)
+
+
+def main():
+    db: Session = SessionLocal()
+
+    try:
+        added = rebuild_bloom(db)
+        print(f"Bloom filter rebuilt with {added} short codes at {datetime.now()}")
+    except Exception as e:
+        print(
+            f"Failed to rebuild the Bloom filter at {datetime.now()}. Error: {str(e)}"
+        )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
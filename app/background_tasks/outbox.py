@@ -0,0 +1,100 @@
+"""
+Redis outbox replay, writes that failed while Redis was unavailable
+
+- every web worker replays it every REDIS_RETRY_SECONDS unless the Redis
+  circuit is open, oldest first, OUTBOX_CHUNK_SIZE rows per transaction
+- a row is deleted once its write went through, a replay that fails keeps
+  it for the next one, a restart loses nothing
+- replays are idempotent, two workers replaying one row is harmless, a
+  url dropped meanwhile is not cached again (warm_urls skips deleted codes)
+"""
+
+import os
+import asyncio
+import logging
+from itertools import groupby
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from ..entities.redis_outbox import RedisOutbox
+from ..database.core import SessionLocal
+from ..database.cache import (
+    redis_breaker,
+    warm_urls,
+    drop_url,
+    publish,
+    URL_INVALIDATION_CHANNEL,
+)
+from ..urls.service import SHORTCODE_EXPIRE_SECONDS
+from ..users.service import publish_password_change
+
+load_dotenv()
+
+REDIS_RETRY_SECONDS = float(os.getenv("REDIS_RETRY_SECONDS") or 5)
+OUTBOX_CHUNK_SIZE = int(os.getenv("OUTBOX_CHUNK_SIZE") or 1000)
+
+
+def replay_remember(rows: list[RedisOutbox]) -> None:
+    warm_urls({row.key: row.value for row in rows}, SHORTCODE_EXPIRE_SECONDS)
+
+
+def replay_drop(rows: list[RedisOutbox]) -> None:
+    for row in rows:
+        drop_url(row.key)
+        publish(URL_INVALIDATION_CHANNEL, row.key)
+
+
+def replay_password_changed(rows: list[RedisOutbox]) -> None:
+    for row in rows:
+        publish_password_change(row.key, int(row.value))
+
+
+# op -> replay of a run of its rows
+REPLAYS = {
+    "remember": replay_remember,
+    "drop": replay_drop,
+    "password_changed": replay_password_changed,
+}
+
+
+def replay_outbox(db: Session, chunk_size: int = OUTBOX_CHUNK_SIZE) -> int:
+    """the outbox until it is empty or a write fails, returns the rows replayed"""
+    replayed = 0
+    while True:
+        rows = db.scalars(
+            select(RedisOutbox).order_by(RedisOutbox.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return replayed
+
+        # runs of one op keep the order of a create and a delete
+        for op, run in groupby(rows, key=lambda row: row.op):
+            REPLAYS[op](list(run))
+        db.execute(
+            delete(RedisOutbox).where(RedisOutbox.id.in_([row.id for row in rows]))
+        )
+        db.commit()
+        replayed += len(rows)
+
+
+def replay_outbox_now() -> int:
+    db = SessionLocal()
+    try:
+        return replay_outbox(db)
+    finally:
+        db.close()
+
+
+async def run_outbox(interval: float = REDIS_RETRY_SECONDS) -> None:
+    """replay_outbox every interval seconds until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        if redis_breaker.state == "open":
+            continue
+        try:
+            replayed = await asyncio.to_thread(replay_outbox_now)
+            if replayed:
+                logging.info("Redis outbox: %s writes replayed", replayed)
+        except Exception as e:
+            logging.warning("Failed to replay the Redis outbox. Error: %s", e)
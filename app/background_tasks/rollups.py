@@ -0,0 +1,187 @@
+"""
+Click events -> hourly and daily rollups, a consumer of the click stream
+
+- consumer group ROLLUP_GROUP on CLICK_EVENTS_STREAM, every worker
+  reads its own share of the events
+- a batch is counted per (short_code, bucket, referrer, ua_class, country)
+  and added to both tables with one multi-row upsert each
+- XACK once committed, a batch that failed stays pending and is read again
+- events pending for ROLLUP_CLAIM_SECONDS on a consumer that died are
+  claimed by the next one
+- a consumer is named after its process, a worker removes its own on
+  shutdown, and consumers idle for ROLLUP_CONSUMER_IDLE_SECONDS with
+  nothing pending (a crash, their events claimed) are pruned
+
+No event is lost unless the stream trimmed it before it was read, and none
+is counted twice unless the process dies between the commit and the XACK.
+"""
+
+import os
+import socket
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from redis.exceptions import ResponseError
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+
+from ..entities.click_rollup import ClickRollupHourly, ClickRollupDaily
+from ..database.cache import redis_client, CLICK_EVENTS_STREAM
+from ..monitoring.metrics import click_rollup_events
+
+load_dotenv()
+
+ROLLUP_GROUP = "rollups"
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", 10000))
+ROLLUP_CLAIM_SECONDS = int(os.getenv("ROLLUP_CLAIM_SECONDS", 60))
+ROLLUP_CONSUMER = f"{socket.gethostname()}-{os.getpid()}"
+ROLLUP_CONSUMER_IDLE_SECONDS = int(os.getenv("ROLLUP_CONSUMER_IDLE_SECONDS", 3600))
+
+# table -> seconds per bucket
+ROLLUP_TABLES = {ClickRollupHourly: 3600, ClickRollupDaily: 86400}
+
+DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def ensure_group() -> None:
+    """the group reads the stream from its start, created once"""
+    try:
+        redis_client.xgroup_create(
+            CLICK_EVENTS_STREAM, ROLLUP_GROUP, "0", mkstream=True
+        )
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def remove_consumer(consumer: str = ROLLUP_CONSUMER) -> bool:
+    """
+    drop a consumer from the group, kept while it has pending events,
+    XGROUP DELCONSUMER would forget them and no one would claim them
+    """
+    for info in redis_client.xinfo_consumers(CLICK_EVENTS_STREAM, ROLLUP_GROUP):
+        if info["name"] == consumer:
+            if info["pending"]:
+                return False
+            break
+    else:
+        return False
+    redis_client.xgroup_delconsumer(CLICK_EVENTS_STREAM, ROLLUP_GROUP, consumer)
+    return True
+
+
+def prune_consumers(idle_seconds: int = ROLLUP_CONSUMER_IDLE_SECONDS) -> int:
+    """
+    remove the consumers idle for idle_seconds with nothing pending,
+    returns how many, a live one removed by mistake is made again by
+    its next XREADGROUP
+    """
+    pruned = 0
+    for info in redis_client.xinfo_consumers(CLICK_EVENTS_STREAM, ROLLUP_GROUP):
+        if info["pending"] or info["idle"] < idle_seconds * 1000:
+            continue
+        redis_client.xgroup_delconsumer(CLICK_EVENTS_STREAM, ROLLUP_GROUP, info["name"])
+        pruned += 1
+    if pruned:
+        logging.info("Pruned %s idle rollup consumers", pruned)
+    return pruned
+
+
+def read_events(consumer: str, count: int) -> list[tuple[str, dict]]:
+    """
+    this consumer's pending events first (a failed batch), then the ones
+    left pending by a dead consumer, then new ones
+    """
+    pending = redis_client.xreadgroup(
+        ROLLUP_GROUP, consumer, {CLICK_EVENTS_STREAM: "0"}, count=count
+    )
+    events = pending[0][1] if pending else []
+    if events:
+        return events
+
+    claimed = redis_client.xautoclaim(
+        CLICK_EVENTS_STREAM,
+        ROLLUP_GROUP,
+        consumer,
+        ROLLUP_CLAIM_SECONDS * 1000,
+        count=count,
+    )
+    # [next start id, [(id, fields), ...], ids trimmed meanwhile]
+    if claimed[1]:
+        return claimed[1]
+
+    new = redis_client.xreadgroup(
+        ROLLUP_GROUP, consumer, {CLICK_EVENTS_STREAM: ">"}, count=count
+    )
+    return new[0][1] if new else []
+
+
+def count_events(events: list[dict], seconds: int) -> Counter:
+    """
+    (short_code, bucket, referrer, ua_class, country) -> clicks
+    a malformed event is skipped, it would fail its batch for ever
+    """
+    counts = Counter()
+    for event in events:
+        try:
+            short_code, timestamp = event["c"], int(event["t"])
+            dimensions = (event["r"], event["u"], event["g"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        bucket = datetime.fromtimestamp(timestamp - timestamp % seconds, timezone.utc)
+        counts[(short_code, bucket, *dimensions)] += 1
+    return counts
+
+
+def upsert_rollups(db: Session, table, counts: Counter) -> None:
+    """clicks = clicks + the batch count, one multi-row INSERT ... ON CONFLICT"""
+    if not counts:
+        return
+    rows = [
+        {
+            "short_code": short_code,
+            "bucket": bucket,
+            "referrer": referrer,
+            "ua_class": ua_class,
+            "country": country,
+            "clicks": clicks,
+        }
+        for (short_code, bucket, referrer, ua_class, country), clicks in counts.items()
+    ]
+    insert = DIALECT_INSERTS[db.get_bind().dialect.name](table)
+    db.execute(
+        insert.on_conflict_do_update(
+            index_elements=["short_code", "bucket", "referrer", "ua_class", "country"],
+            set_={"clicks": table.clicks + insert.excluded.clicks},
+        ),
+        rows,
+    )
+
+
+def rollup_click_events(
+    db: Session, consumer: str = ROLLUP_CONSUMER, batch_size: int = ROLLUP_BATCH_SIZE
+) -> int:
+    """roll up the events waiting for this consumer, returns how many"""
+    rolled_up = 0
+    while True:
+        events = read_events(consumer, batch_size)
+        if not events:
+            return rolled_up
+
+        fields = [event for _, event in events]
+        try:
+            for table, seconds in ROLLUP_TABLES.items():
+                upsert_rollups(db, table, count_events(fields, seconds))
+            db.commit()
+        except Exception:
+            # pending in the group, read again by the next run
+            db.rollback()
+            raise
+
+        redis_client.xack(CLICK_EVENTS_STREAM, ROLLUP_GROUP, *(id for id, _ in events))
+        rolled_up += len(events)
+        click_rollup_events.inc(amount=len(events))
+        if len(events) < batch_size:
+            return rolled_up
+        logging.info("Rolled up %s click events so far", rolled_up)
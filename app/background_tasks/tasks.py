@@ -1,19 +1,222 @@
+import os
+import logging
+from datetime import datetime, timezone
+from dotenv import load_dotenv
 from sqlalchemy.orm import Session
+from sqlalchemy import Integer, String, bindparam, column, func, update, values
+from redis.exceptions import LockNotOwnedError
+from redis.lock import Lock
 
+from .rollups import DIALECT_INSERTS
 from ..entities.url import URL
-from ..database.cache import redis_client
+from ..entities.click_rollup import ClickUniquesDaily
+from ..database.cache import redis_client, take_clicks, visitors_key, DIRTY_UNIQUES
 
+load_dotenv()
 
-def sync_clicks_to_db(db: Session) -> None:
-    """Redis: clicks:short_code -> database"""
+SYNC_CHUNK_SIZE = int(os.getenv("SYNC_CHUNK_SIZE", 10000))
 
-    needs_sync = redis_client.smembers("dirty_clicks")
+# seconds the sync lock lives without progress, extended after every chunk
+SYNC_LOCK_TIMEOUT = int(os.getenv("SYNC_LOCK_TIMEOUT", 60))
 
-    for short_code in needs_sync:
-        clicks = int(redis_client.get(f"clicks:{short_code}"))
-        url = db.query(URL).filter(URL.short_code == short_code).first()
-        url.clicks = clicks
+# clicks taken out of Redis but not committed to the database yet
+PENDING_CLICKS = "clicks:pending"
 
-        # after syncing, remove from dirty set
-        redis_client.srem("dirty_clicks", short_code)
-    db.commit()
+
+def apply_clicks(db: Session, rows: list[dict]) -> None:
+    """
+    clicks = clicks + delta for a whole chunk of {"code": short_code, "delta": delta}
+
+    - Postgres: UPDATE urls SET clicks = clicks + v.delta FROM (VALUES ...) AS v
+    - others: executemany of the same UPDATE
+    """
+    if not rows:
+        return
+
+    urls = URL.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        deltas = values(
+            column("code", String), column("delta", Integer), name="v"
+        ).data([(row["code"], row["delta"]) for row in rows])
+        db.execute(
+            update(urls)
+            .where(urls.c.short_code == deltas.c.code)
+            .values(clicks=func.coalesce(urls.c.clicks, 0) + deltas.c.delta)
+        )
+        return
+
+    db.execute(
+        update(urls)
+        .where(urls.c.short_code == bindparam("code"))
+        .values(clicks=func.coalesce(urls.c.clicks, 0) + bindparam("delta")),
+        rows,
+    )
+
+
+def apply_unique_clicks(db: Session, totals: dict[str, int]) -> None:
+    """unique_clicks = the PFCOUNT snapshot, a snapshot is safe to apply twice"""
+    if not totals:
+        return
+
+    urls = URL.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        counts = values(
+            column("code", String), column("visitors", Integer), name="v"
+        ).data(list(totals.items()))
+        db.execute(
+            update(urls)
+            .where(urls.c.short_code == counts.c.code)
+            .values(unique_clicks=counts.c.visitors)
+        )
+        return
+
+    db.execute(
+        update(urls)
+        .where(urls.c.short_code == bindparam("code"))
+        .values(unique_clicks=bindparam("visitors")),
+        [{"code": code, "visitors": visitors} for code, visitors in totals.items()],
+    )
+
+
+def sync_unique_clicks(db: Session, chunk_size: int = SYNC_CHUNK_SIZE) -> int:
+    """
+    Redis: visitor HyperLogLogs -> database, chunk by chunk
+
+    - dirty_uniques holds short_code:YYYYMMDD of the days that got visitors
+    - PFCOUNT of uv:short_code -> urls.unique_clicks
+    - PFCOUNT of uv:short_code:YYYYMMDD -> click_uniques_daily
+    - a failed chunk goes back to dirty_uniques, a key that expired
+      meanwhile counts 0 and keeps the last snapshot
+
+    returns the number of days synced
+    """
+    synced = 0
+    while True:
+        members = redis_client.spop(DIRTY_UNIQUES, chunk_size)
+        if not members:
+            return synced
+
+        days = [member.split(":") for member in members]
+        codes = list({short_code for short_code, _ in days})
+        pipe = redis_client.pipeline(transaction=False)
+        for short_code in codes:
+            pipe.pfcount(visitors_key(short_code))
+        for short_code, day in days:
+            pipe.pfcount(visitors_key(short_code, day))
+        counts = pipe.execute()
+
+        totals = {code: total for code, total in zip(codes, counts) if total}
+        rows = [
+            {
+                "short_code": short_code,
+                "bucket": datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc),
+                "visitors": visitors,
+            }
+            for (short_code, day), visitors in zip(days, counts[len(codes) :])
+            if visitors
+        ]
+        try:
+            apply_unique_clicks(db, totals)
+            if rows:
+                insert = DIALECT_INSERTS[db.get_bind().dialect.name](ClickUniquesDaily)
+                db.execute(
+                    insert.on_conflict_do_update(
+                        index_elements=["short_code", "bucket"],
+                        set_={"visitors": insert.excluded.visitors},
+                    ),
+                    rows,
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            redis_client.sadd(DIRTY_UNIQUES, *members)
+            raise
+
+        synced += len(members)
+        if len(members) < chunk_size:
+            return synced
+
+
+def commit_pending(db: Session, rows: list[dict]) -> None:
+    """database first, then the pending deltas are forgotten"""
+    if not rows:
+        return
+
+    try:
+        apply_clicks(db, rows)
+        db.commit()
+    except Exception:
+        # the deltas stay in clicks:pending for the next run
+        db.rollback()
+        raise
+
+    redis_client.hdel(PENDING_CLICKS, *(row["code"] for row in rows))
+
+
+def extend_lock(lock: Lock) -> bool:
+    """
+    reset the lock timeout after a chunk
+    False if it expired, another run may be applying clicks:pending now
+    """
+    try:
+        lock.reacquire()
+        return True
+    except LockNotOwnedError:
+        logging.error("Click sync lock expired, stopping this run")
+        return False
+
+
+def sync_clicks_to_db(db: Session, chunk_size: int = SYNC_CHUNK_SIZE) -> int:
+    """
+    Redis: click deltas -> database, chunk by chunk
+
+    - redirects only ever INCR the click delta of a code since the last sync,
+      clicks:short_code or its c:<bucket> field, see REDIS_URL_LAYOUT
+    - a chunk of deltas moves atomically into clicks:pending
+    - the database adds them, clicks = clicks + delta, then they are dropped
+    - deltas left in clicks:pending by a failed run are applied first
+
+    No click is lost, and none is counted twice unless the process dies
+    between the database commit and the HDEL of that chunk.
+    Runs never overlap, a second concurrent run returns 0 right away.
+    The unique clicks of the same codes are synced after them.
+
+    returns the number of urls synced
+    """
+    lock = redis_client.lock("clicks:sync_lock", timeout=SYNC_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        logging.warning("Click sync already running, skipped")
+        return 0
+
+    try:
+        # leftovers of a failed run
+        pending = redis_client.hgetall(PENDING_CLICKS)
+        rows = [{"code": code, "delta": int(delta)} for code, delta in pending.items()]
+        commit_pending(db, rows)
+        synced = len(rows)
+        if not extend_lock(lock):
+            return synced
+
+        # codes marked dirty while syncing wait for the next run
+        remaining = redis_client.scard("dirty_clicks")
+        while remaining > 0:
+            taken = take_clicks(PENDING_CLICKS, min(chunk_size, remaining))
+            remaining -= chunk_size
+
+            rows = [
+                {"code": code, "delta": int(delta)}
+                for code, delta in zip(taken[::2], taken[1::2])
+            ]
+            commit_pending(db, rows)
+            synced += len(rows)
+            if not extend_lock(lock):
+                return synced
+
+        sync_unique_clicks(db, chunk_size)
+        return synced
+    finally:
+        try:
+            lock.release()
+        except LockNotOwnedError:
+            # expired, keep the result or error of the run itself
+            logging.warning("Click sync lock expired before release")
@@ -0,0 +1,160 @@
+"""
+Cache warm-up, the top links from the database into Redis
+
+    python -m app.background_tasks.warm_up --size 100000 --order clicks
+
+- after a Redis restart or failover every url key is gone, every redirect
+  would read the database until the hot links are cached again
+- the web workers check for WARM_UP_MARKER every WARM_UP_CHECK_SECONDS,
+  at startup too, one of them warms Redis up when it is gone
+- urls stream from a server-side cursor, ordered by clicks or by id (most
+  recent first), WARM_UP_CHUNK_SIZE per pipelined round trip
+- at most WARM_UP_RATE urls per second, the database and Redis keep
+  serving the redirects meanwhile
+- a url cached already or deleted meanwhile is left alone, a warm-up can
+  run at any time
+"""
+
+import os
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from redis.exceptions import LockNotOwnedError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..entities.url import URL
+from ..database.core import SessionLocal
+from ..database.cache import redis_client, redis_memory, warm_urls
+from ..urls.service import SHORTCODE_EXPIRE_SECONDS
+from ..logging import configure_logging, LogLevels
+
+load_dotenv()
+
+# urls warmed up (0 disables the automatic warm-up), "clicks" or "recent"
+WARM_UP_SIZE = int(os.getenv("WARM_UP_SIZE") or 100000)
+WARM_UP_ORDER = os.getenv("WARM_UP_ORDER") or "clicks"
+WARM_UP_CHUNK_SIZE = int(os.getenv("WARM_UP_CHUNK_SIZE") or 1000)
+# urls per second (0 for no cap)
+WARM_UP_RATE = float(os.getenv("WARM_UP_RATE") or 20000)
+WARM_UP_CHECK_SECONDS = float(os.getenv("WARM_UP_CHECK_SECONDS") or 30)
+WARM_UP_PROGRESS_SECONDS = 5
+
+# set once Redis was warmed up, gone with the rest of its data
+WARM_UP_MARKER = "urls:warm"
+
+ORDERS = {
+    "clicks": (URL.clicks.desc().nulls_last(), URL.id.desc()),
+    "recent": (URL.id.desc(),),
+}
+
+
+def warm_up(
+    db: Session,
+    size: int = WARM_UP_SIZE,
+    order: str = WARM_UP_ORDER,
+    rate: float = WARM_UP_RATE,
+    chunk_size: int = WARM_UP_CHUNK_SIZE,
+) -> int:
+    """
+    the first size urls by clicks or recency into Redis, returns how many
+    were cached, the others were cached already
+    "clicks" sorts the table once, "recent" walks the primary key
+    """
+    rows = db.execute(
+        select(URL.short_code, URL.long_url)
+        .where(URL.short_code.is_not(None))
+        .order_by(*ORDERS[order])
+        .limit(size)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    start = last_report = time.monotonic()
+    read = cached = 0
+    for chunk in rows.partitions():
+        if redis_memory.over_budget:
+            logging.warning("Cache warm-up stopped, Redis is over its memory budget")
+            break
+        cached += warm_urls(
+            {row.short_code: row.long_url for row in chunk}, SHORTCODE_EXPIRE_SECONDS
+        )
+        read += len(chunk)
+
+        now = time.monotonic()
+        if rate and read / rate > now - start:
+            time.sleep(read / rate - (now - start))
+        if now - last_report >= WARM_UP_PROGRESS_SECONDS:
+            last_report = now
+            logging.info(
+                "Cache warm-up: %s/%s urls read, %s cached, %.0f urls/s",
+                read,
+                size,
+                cached,
+                read / (now - start),
+            )
+
+    redis_client.set(WARM_UP_MARKER, int(time.time()))
+    logging.info(
+        "Cache warm-up done: %s urls read, %s cached in %.1fs",
+        read,
+        cached,
+        time.monotonic() - start,
+    )
+    return cached
+
+
+def ensure_warm() -> None:
+    """warm Redis up unless it was already, one worker at a time"""
+    if not WARM_UP_SIZE:
+        return
+    try:
+        if redis_client.exists(WARM_UP_MARKER):
+            return
+        lock = redis_client.lock("urls:warm:lock", timeout=3600)
+        if not lock.acquire(blocking=False):
+            return
+        db = SessionLocal()
+        try:
+            warm_up(db)
+        finally:
+            db.close()
+            try:
+                lock.release()
+            except LockNotOwnedError:
+                pass
+    except Exception as e:
+        # redirects read the database meanwhile, the next check retries
+        logging.warning("Cache warm-up failed. Error: %s", e)
+
+
+async def watch_warm_up(interval: float = WARM_UP_CHECK_SECONDS) -> None:
+    """ensure_warm now and every interval seconds until cancelled"""
+    while True:
+        await asyncio.to_thread(ensure_warm)
+        await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=WARM_UP_SIZE)
+    parser.add_argument("--order", choices=tuple(ORDERS), default=WARM_UP_ORDER)
+    parser.add_argument("--rate", type=float, default=WARM_UP_RATE)
+    parser.add_argument("--chunk-size", type=int, default=WARM_UP_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    configure_logging(LogLevels.info)
+    db: Session = SessionLocal()
+    try:
+        cached = warm_up(db, args.size, args.order, args.rate, args.chunk_size)
+        print(f"Cache warmed up with {cached} urls at {datetime.now()}")
+    except Exception as e:
+        print(f"Failed to warm up the cache at {datetime.now()}. Error: {str(e)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Resident click sync worker, replaces the one shot cron
+
+    python -m app.background_tasks.worker
+
+- syncs every SYNC_INTERVAL_SECONDS
+- syncs early once dirty_clicks holds SYNC_DIRTY_THRESHOLD codes
+- rolls the click events up into the hourly and daily tables every poll,
+  run several workers to share the events, see rollups.py
+- SIGTERM / SIGINT: finishes the current cycle, syncs and rolls up what
+  is left, leaves the consumer group and exits
+- one process, one connection pool for its whole life
+"""
+
+import os
+import time
+import signal
+import logging
+import threading
+from dotenv import load_dotenv
+
+from .tasks import sync_clicks_to_db
+from .rollups import (
+    ensure_group,
+    rollup_click_events,
+    prune_consumers,
+    remove_consumer,
+    ROLLUP_CONSUMER_IDLE_SECONDS,
+)
+from ..database.core import SessionLocal, engine
+from ..database.cache import redis_client
+from ..monitoring.metrics import click_sync_seconds, click_sync_codes, dump
+from ..logging import configure_logging, LogLevels
+
+load_dotenv()
+
+SYNC_INTERVAL_SECONDS = float(os.getenv("SYNC_INTERVAL_SECONDS", 10))
+SYNC_DIRTY_THRESHOLD = int(os.getenv("SYNC_DIRTY_THRESHOLD", 50000))
+SYNC_POLL_SECONDS = float(os.getenv("SYNC_POLL_SECONDS", 1))
+
+
+class ClickSyncWorker:
+    def __init__(
+        self,
+        interval: float = SYNC_INTERVAL_SECONDS,
+        dirty_threshold: int = SYNC_DIRTY_THRESHOLD,
+        poll_seconds: float = SYNC_POLL_SECONDS,
+    ):
+        self.interval = interval
+        self.dirty_threshold = dirty_threshold
+        self.poll_seconds = poll_seconds
+        self.stop_event = threading.Event()
+
+        # metrics of the last cycle and totals
+        self.last_sync = time.monotonic()
+        self.last_cycle: dict = {}
+        self.cycles = 0
+        self.synced_total = 0
+        self.rolled_up_total = 0
+        self.group_ready = False
+        self.last_prune = float("-inf")
+
+    def stop(self, *_) -> None:
+        self.stop_event.set()
+
+    def sync(self, trigger: str) -> dict:
+        """one sync cycle, returns its metrics"""
+        start = time.monotonic()
+        db = SessionLocal()
+        try:
+            synced = sync_clicks_to_db(db)
+        finally:
+            db.close()
+        end = time.monotonic()
+
+        self.last_cycle = {
+            "trigger": trigger,
+            "synced": synced,
+            "duration": end - start,
+            # how stale database clicks were before this cycle
+            "lag": end - self.last_sync,
+        }
+        self.last_sync = end
+        self.cycles += 1
+        self.synced_total += synced
+
+        # picked up by /metrics of the web workers through METRICS_DIR
+        click_sync_seconds.observe(self.last_cycle["duration"])
+        click_sync_codes.inc(amount=synced)
+        dump()
+
+        logging.info(
+            "Click sync (%s): %s codes in %.3fs, lag %.1fs",
+            trigger,
+            synced,
+            self.last_cycle["duration"],
+            self.last_cycle["lag"],
+        )
+        return self.last_cycle
+
+    def rollup(self) -> int:
+        """the click events waiting for this worker into the rollup tables"""
+        if not self.group_ready:
+            ensure_group()
+            self.group_ready = True
+        if time.monotonic() - self.last_prune >= ROLLUP_CONSUMER_IDLE_SECONDS:
+            self.last_prune = time.monotonic()
+            prune_consumers()
+
+        db = SessionLocal()
+        try:
+            rolled_up = rollup_click_events(db)
+        finally:
+            db.close()
+        self.rolled_up_total += rolled_up
+        return rolled_up
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                if redis_client.scard("dirty_clicks") >= self.dirty_threshold:
+                    self.sync("backlog")
+                elif time.monotonic() - self.last_sync >= self.interval:
+                    self.sync("interval")
+            except Exception as e:
+                logging.error("Click sync failed. Error: %s", e)
+
+            try:
+                self.rollup()
+            except Exception as e:
+                logging.error("Click rollup failed. Error: %s", e)
+
+            self.stop_event.wait(self.poll_seconds)
+
+        # flush pending deltas before exiting
+        try:
+            self.sync("shutdown")
+        except Exception as e:
+            logging.error("Final click sync failed. Error: %s", e)
+        try:
+            self.rollup()
+            if self.group_ready:
+                remove_consumer()
+        except Exception as e:
+            logging.error("Final click rollup failed. Error: %s", e)
+
+
+def main():
+    configure_logging(LogLevels.info)
+
+    worker = ClickSyncWorker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+
+    logging.info(
+        "Click sync worker started, every %ss or %s dirty codes",
+        worker.interval,
+        worker.dirty_threshold,
+    )
+    try:
+        worker.run()
+    finally:
+        engine.dispose()
+    logging.info("Click sync worker stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,974 @@
 import os
+import math
+import time
 import redis
+import random
+import hashlib
+import asyncio
+import logging
+import redis.asyncio
+from typing import Callable
+from collections import defaultdict
 from dotenv import load_dotenv
 
+from .pool import (
+    TimedBlockingConnectionPool,
+    TimedAsyncBlockingConnectionPool,
+    CircuitBreaker,
+    BreakerConnection,
+    AsyncBreakerConnection,
+)
+from ..urls.utils import decode_base62
+
 load_dotenv()
 
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
 
-redis_client = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=REDIS_DB,
-    decode_responses=True,  # store strings not bytes
+# per client, a full pool waits REDIS_POOL_TIMEOUT before failing
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 1))
+REDIS_POOL_MIN_SIZE = int(os.getenv("REDIS_POOL_MIN_SIZE", 5))
+# a Redis reply takes well under a millisecond, a slow one is an incident
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.5))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", 0.5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+# connection errors or timeouts in a row that open the circuit (0 disables),
+# seconds it stays open before one call tries Redis again
+REDIS_BREAKER_FAILURES = int(os.getenv("REDIS_BREAKER_FAILURES", 5))
+REDIS_BREAKER_RESET_SECONDS = float(os.getenv("REDIS_BREAKER_RESET_SECONDS", 5))
+
+REDIS_OPTIONS = {
+    "host": REDIS_HOST,
+    "port": REDIS_PORT,
+    "db": REDIS_DB,
+    "decode_responses": True,  # store strings not bytes
+}
+
+REDIS_POOL_OPTIONS = {
+    **REDIS_OPTIONS,
+    "max_connections": REDIS_MAX_CONNECTIONS,
+    "timeout": REDIS_POOL_TIMEOUT,
+    "socket_timeout": REDIS_SOCKET_TIMEOUT,
+    "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+    "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+}
+
+"""
+Both request clients share one circuit breaker, while it is open every
+call raises redis.ConnectionError at once, callers fall back as if Redis
+had failed, see CircuitBreaker
+"""
+redis_breaker = CircuitBreaker(REDIS_BREAKER_FAILURES, REDIS_BREAKER_RESET_SECONDS)
+
+redis_client = redis.Redis.from_pool(
+    TimedBlockingConnectionPool(
+        **REDIS_POOL_OPTIONS, connection_class=BreakerConnection, breaker=redis_breaker
+    )
+)
+
+# same server, non blocking client for async routes
+async_redis_client = redis.asyncio.Redis.from_pool(
+    TimedAsyncBlockingConnectionPool(
+        **REDIS_POOL_OPTIONS,
+        connection_class=AsyncBreakerConnection,
+        breaker=redis_breaker,
+    )
+)
+
+# one long lived subscriber connection, idle for minutes between messages,
+# outside the request pools and without their socket timeout
+pubsub_client = redis.asyncio.Redis(
+    **REDIS_OPTIONS,
+    socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+)
+
+"""
+Pub/sub between workers
+
+- URL_INVALIDATION_CHANNEL carries a short_code whose url changed or was deleted
+- PASSWORD_CHANGED_CHANNEL carries "user_id:timestamp" of a password change
+- handlers receive the message data
+- on_reset callbacks run after (re)subscribing, because
+  anything published while disconnected was never delivered
+"""
+URL_INVALIDATION_CHANNEL = "urls:invalidate"
+PASSWORD_CHANGED_CHANNEL = "users:password_changed"
+
+_handlers: dict[str, list[Callable[[str], None]]] = defaultdict(list)
+_reset_callbacks: list[Callable[[], None]] = []
+
+
+def subscribe(
+    channel: str,
+    handler: Callable[[str], None],
+    on_reset: Callable[[], None] | None = None,
+) -> None:
+    _handlers[channel].append(handler)
+    if on_reset:
+        _reset_callbacks.append(on_reset)
+
+
+def publish(channel: str, message: str) -> None:
+    redis_client.publish(channel, message)
+
+
+async def listen(retry_seconds: float = 1.0) -> None:
+    """dispatch pub/sub messages to the subscribed handlers until cancelled"""
+    if not _handlers:
+        return
+
+    while True:
+        pubsub = pubsub_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(*_handlers)
+            for reset in _reset_callbacks:
+                reset()
+
+            async for message in pubsub.listen():
+                for handler in _handlers.get(message["channel"], ()):
+                    try:
+                        handler(message["data"])
+                    except Exception as e:
+                        logging.error(
+                            "Pub/sub handler failed on %s. Error: %s",
+                            message["channel"],
+                            e,
+                        )
+        except redis.RedisError as e:
+            logging.warning("Pub/sub connection lost, retrying. Error: %s", e)
+            await asyncio.sleep(retry_seconds)
+        finally:
+            await pubsub.aclose()
+
+
+"""
+Bloom filter of every short code, one Redis bitmap shared by the workers
+
+- sized for BLOOM_CAPACITY codes at BLOOM_ERROR_RATE false positives,
+  BLOOM_CAPACITY=0 disables it
+- a code is added when its url is created, cached by a miss or warmed
+  up, a deleted code stays in it
+- a negative is a hint, a code missing from it (Redis write failed, bits
+  lost in a failover) is confirmed by the database and added back
+- bit BLOOM_BITS is the ready bit, set once a rebuild finished, it goes
+  away with the bitmap, so a lost or half built filter is never trusted
+- the key names its size, a new size starts a new filter
+"""
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY") or 1_000_000)
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE") or 0.01)
+BLOOM_BITS = (
+    int(-BLOOM_CAPACITY * math.log(BLOOM_ERROR_RATE) / math.log(2) ** 2)
+    if BLOOM_CAPACITY
+    else 0
+)
+BLOOM_HASHES = (
+    max(1, round(BLOOM_BITS / BLOOM_CAPACITY * math.log(2))) if BLOOM_CAPACITY else 0
+)
+BLOOM_KEY = f"urls:bloom:{BLOOM_BITS}:{BLOOM_HASHES}"
+# bits of codes created while a rebuild runs, merged when it finishes
+BLOOM_BUILD_KEY = f"{BLOOM_KEY}:build"
+BLOOM_UPLOAD_KEY = f"{BLOOM_KEY}:upload"
+
+# missing:short_code, a code the database doesn't have, 0 disables
+NEGATIVE_CACHE_SECONDS = int(os.getenv("NEGATIVE_CACHE_SECONDS") or 60)
+
+URL_MISSING = 1
+URL_NOT_IN_BLOOM = 2
+
+
+def bloom_positions(short_code: str) -> list[int]:
+    """BLOOM_HASHES bit positions, double hashing of one blake2b digest"""
+    if not BLOOM_BITS:
+        return []
+    digest = hashlib.blake2b(short_code.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % BLOOM_BITS for i in range(BLOOM_HASHES)]
+
+
+def set_bloom_bits(bitmap: bytearray, short_code: str) -> None:
+    """Redis bit order, bit 0 is the high bit of byte 0"""
+    for position in bloom_positions(short_code):
+        bitmap[position >> 3] |= 0x80 >> (position & 7)
+
+
+def new_bloom_bitmap() -> bytearray:
+    # BLOOM_BITS + 1 bits, the last one is the ready bit
+    return bytearray(BLOOM_BITS // 8 + 1)
+
+
+_finish_bloom_script = redis_client.register_script(
+    """
+    redis.call('BITOP', 'OR', KEYS[1], KEYS[1], KEYS[2])
+    redis.call('SETBIT', KEYS[1], ARGV[1], 1)
+    redis.call('RENAME', KEYS[1], KEYS[3])
+    redis.call('DEL', KEYS[2])
+    """
+)
+
+
+def start_bloom_build() -> None:
+    """from now on created codes also go to BLOOM_BUILD_KEY"""
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.setbit(BLOOM_BUILD_KEY, BLOOM_BITS, 0)
+    # a rebuild that died doesn't leave it behind for ever
+    pipe.expire(BLOOM_BUILD_KEY, 3600)
+    pipe.execute()
+
+
+def finish_bloom_build(bitmap: bytearray) -> None:
+    """upload, merge the codes created meanwhile, mark ready and swap in"""
+    redis_client.set(BLOOM_UPLOAD_KEY, bytes(bitmap))
+    _finish_bloom_script(
+        keys=[BLOOM_UPLOAD_KEY, BLOOM_BUILD_KEY, BLOOM_KEY], args=[BLOOM_BITS]
+    )
+
+
+def bloom_ready() -> bool:
+    return bool(BLOOM_BITS) and redis_client.getbit(BLOOM_KEY, BLOOM_BITS) == 1
+
+
+async def bloom_stats() -> dict[str, float]:
+    """size and, from the share of bits set, the false positive rate now"""
+    if not BLOOM_BITS:
+        return {}
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.strlen(BLOOM_KEY)
+    pipe.bitcount(BLOOM_KEY)
+    pipe.getbit(BLOOM_KEY, BLOOM_BITS)
+    memory, bits_set, ready = await pipe.execute()
+    fill = max(0, bits_set - ready) / BLOOM_BITS
+    return {
+        "ready": ready,
+        "bits": BLOOM_BITS,
+        "hashes": BLOOM_HASHES,
+        "memory_bytes": memory,
+        "fill_ratio": fill,
+        "false_positive_rate": fill**BLOOM_HASHES,
+    }
+
+
+"""
+Key layout of a url and its click delta, REDIS_URL_LAYOUT
+
+- "keys": short_code -> long_url and clicks:short_code -> delta,
+  two top level keys a link
+- "hash": links bucketed by id, u:<bucket> and c:<bucket> hashes with
+  field short_code, bucket = decode_base62(short_code) // URL_HASH_BUCKET_SIZE.
+  Redis keeps a small hash as a listpack, no per-key overhead, as long as
+  hash-max-listpack-entries >= URL_HASH_BUCKET_SIZE and
+  hash-max-listpack-value >= the long urls
+- in the hash layout a TTL (SHORTCODE_EXPIRE_SECONDS, adaptive, XFetch)
+  is the one of the bucket, a hit keeps its whole bucket
+- field '' is the keys layout, the scripts take (key, field) pairs
+- the click sync drains both layouts, switching loses no clicks
+"""
+REDIS_URL_LAYOUT = os.getenv("REDIS_URL_LAYOUT", "keys").lower()
+URL_HASH_BUCKET_SIZE = int(os.getenv("URL_HASH_BUCKET_SIZE") or 1024)
+
+
+def url_bucket(short_code: str) -> int:
+    return decode_base62(short_code) // URL_HASH_BUCKET_SIZE
+
+
+def url_key(short_code: str) -> tuple[str, str]:
+    """(key, field) of a url"""
+    if REDIS_URL_LAYOUT != "hash":
+        return short_code, ""
+    return f"u:{url_bucket(short_code)}", short_code
+
+
+def clicks_key(short_code: str) -> tuple[str, str]:
+    """(key, field) of a click delta"""
+    if REDIS_URL_LAYOUT != "hash":
+        return f"clicks:{short_code}", ""
+    return f"c:{url_bucket(short_code)}", short_code
+
+
+# a hash field gets the TTL of its bucket, raised, never shortened,
+# add_to_bloom sets the bits of a code known to exist
+_LAYOUT_LUA = """
+    local function get_field(key, field)
+        if field == '' then
+            return redis.call('GET', key)
+        end
+        return redis.call('HGET', key, field)
+    end
+
+    local function set_field(key, field, value, ttl)
+        if field == '' then
+            if ttl ~= '' then
+                redis.call('SET', key, value, 'EX', ttl)
+            else
+                redis.call('SET', key, value)
+            end
+            return
+        end
+        redis.call('HSET', key, field, value)
+        if ttl ~= '' and redis.call('PTTL', key) < tonumber(ttl) * 1000 then
+            redis.call('EXPIRE', key, ttl)
+        end
+    end
+
+    local function incr_field(key, field, amount)
+        if field == '' then
+            return redis.call('INCRBY', key, amount)
+        end
+        return redis.call('HINCRBY', key, field, amount)
+    end
+
+    -- ARGV[first..] bit positions, into the filter and the one being built
+    local function add_to_bloom(key, build_key, argv, first)
+        local building = redis.call('EXISTS', build_key) == 1
+        for i = first, #argv do
+            redis.call('SETBIT', key, argv[i], 1)
+            if building then
+                redis.call('SETBIT', build_key, argv[i], 1)
+            end
+        end
+    end
+"""
+
+
+"""
+A new url: SET short_code, DEL missing:short_code, add it to the Bloom
+filter (and to the one being built), in one script
+"""
+_remember_url_script = redis_client.register_script(
+    _LAYOUT_LUA
+    + """
+    set_field(KEYS[1], ARGV[3], ARGV[1], ARGV[2])
+    redis.call('DEL', KEYS[2])
+    add_to_bloom(KEYS[3], KEYS[4], ARGV, 4)
+    """
+)
+
+
+def remember_urls(urls: dict[str, str], url_expire: int | str | None) -> None:
+    """Redis: short_code -> long_url for new urls, one pipelined round trip"""
+    url_expire = url_ttl(url_expire) or ""
+    pipe = redis_client.pipeline(transaction=False)
+    for short_code, long_url in urls.items():
+        key, field = url_key(short_code)
+        _remember_url_script(
+            keys=[
+                key,
+                f"missing:{short_code}",
+                BLOOM_KEY,
+                BLOOM_BUILD_KEY,
+            ],
+            args=[long_url, url_expire, field, *bloom_positions(short_code)],
+            client=pipe,
+        )
+    pipe.execute()
+
+
+"""
+Warm-up: short_code -> long_url unless it is cached already or the url was
+deleted since it was read, its Bloom bits set again (a failover may have
+lost them and kept the ready bit), clicks are left alone
+"""
+_warm_url_script = redis_client.register_script(
+    _LAYOUT_LUA
+    + """
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        return 0
+    end
+    add_to_bloom(KEYS[3], KEYS[4], ARGV, 4)
+    if get_field(KEYS[1], ARGV[3]) then
+        return 0
+    end
+    set_field(KEYS[1], ARGV[3], ARGV[1], ARGV[2])
+    return 1
+    """
 )
+
+
+def warm_urls(urls: dict[str, str], url_expire: int | str | None) -> int:
+    """Redis: the urls not cached yet, one pipelined round trip, returns how many"""
+    url_expire = url_ttl(url_expire) or ""
+    pipe = redis_client.pipeline(transaction=False)
+    for short_code, long_url in urls.items():
+        key, field = url_key(short_code)
+        _warm_url_script(
+            keys=[key, f"deleted:{short_code}", BLOOM_KEY, BLOOM_BUILD_KEY],
+            args=[long_url, url_expire, field, *bloom_positions(short_code)],
+            client=pipe,
+        )
+    return sum(pipe.execute())
+
+
+async def cache_missing(short_code: str) -> None:
+    """Redis: missing:short_code for NEGATIVE_CACHE_SECONDS, lease released"""
+    pipe = async_redis_client.pipeline(transaction=False)
+    if NEGATIVE_CACHE_SECONDS:
+        pipe.set(f"missing:{short_code}", 1, ex=NEGATIVE_CACHE_SECONDS)
+    pipe.delete(f"lease:{short_code}")
+    await pipe.execute()
+
+
+"""
+Stampede protection, one database read per missed code across workers
+
+- lease:short_code, taken by the worker that reads the database, dropped
+  once it cached the result, expires after URL_LEASE_SECONDS if it died
+- the other workers poll Redis for the result meanwhile
+"""
+URL_LEASE_SECONDS = float(os.getenv("URL_LEASE_SECONDS") or 2)
+
+
+async def take_url_lease(short_code: str) -> bool:
+    return bool(
+        await async_redis_client.set(
+            f"lease:{short_code}", 1, nx=True, px=int(URL_LEASE_SECONDS * 1000)
+        )
+    )
+
+
+async def peek_url(short_code: str) -> str | int | None:
+    """long_url, URL_MISSING, or None while nobody cached an answer"""
+    key, field = url_key(short_code)
+    pipe = async_redis_client.pipeline(transaction=False)
+    if field:
+        pipe.hget(key, field)
+    else:
+        pipe.get(key)
+    pipe.get(f"missing:{short_code}")
+    long_url, missing = await pipe.execute()
+    if long_url is not None:
+        return long_url
+    return URL_MISSING if missing is not None else None
+
+
+"""
+XFetch, probabilistic early refresh of hot links
+
+a hit refreshes the TTL of short_code once
+    -XFETCH_DELTA_SECONDS * XFETCH_BETA * ln(random()) >= TTL left
+the closer to expiring and the more hits, the likelier one refreshes it,
+so a hot link never expires under load, a cold one still does.
+The mapping never changes, only a delete drops it, a refresh is a PEXPIRE.
+XFETCH_BETA=0 disables it.
+"""
+XFETCH_DELTA_SECONDS = float(os.getenv("XFETCH_DELTA_SECONDS") or 1)
+XFETCH_BETA = float(os.getenv("XFETCH_BETA") or 1)
+
+
+def xfetch_gap_ms() -> float:
+    return -XFETCH_DELTA_SECONDS * XFETCH_BETA * math.log(1 - random.random()) * 1000
+
+
+"""
+Adaptive TTL of short_code keys, hot links stay, dead ones go
+
+- a url is cached for the url_expire it is given (SHORTCODE_EXPIRE_SECONDS),
+  a link nobody opens expires after it
+- a hit adds URL_TTL_EXTEND_SECONDS to the TTL left, up to
+  URL_TTL_MAX_SECONDS, a link opened more often than once per
+  URL_TTL_EXTEND_SECONDS keeps growing its TTL, a rarely opened one runs down
+- an extension under a second is skipped, a key at the cap is written
+  at most once a second however hot it is
+- REDIS_MEMORY_BUDGET_BYTES, 0 disables: while Redis uses more, hits stop
+  extending and new keys get at most URL_TTL_PRESSURE_SECONDS, the cold
+  keys expire first and the memory comes back
+"""
+URL_TTL_EXTEND_SECONDS = int(os.getenv("URL_TTL_EXTEND_SECONDS") or 3600)
+URL_TTL_MAX_SECONDS = int(os.getenv("URL_TTL_MAX_SECONDS") or 604800)
+URL_TTL_PRESSURE_SECONDS = int(os.getenv("URL_TTL_PRESSURE_SECONDS") or 3600)
+REDIS_MEMORY_BUDGET_BYTES = int(os.getenv("REDIS_MEMORY_BUDGET_BYTES") or 0)
+REDIS_MEMORY_CHECK_SECONDS = float(os.getenv("REDIS_MEMORY_CHECK_SECONDS") or 10)
+
+
+class RedisMemory:
+    """used_memory of Redis against the budget, polled by watch()"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used = 0
+
+    @property
+    def over_budget(self) -> bool:
+        return bool(self.budget) and self.used > self.budget
+
+    async def read(self) -> int:
+        self.used = (await async_redis_client.info("memory"))["used_memory"]
+        return self.used
+
+    async def watch(self, interval: float = REDIS_MEMORY_CHECK_SECONDS) -> None:
+        """until cancelled, a failed read keeps the last value"""
+        if not self.budget:
+            return
+        while True:
+            try:
+                await self.read()
+            except redis.RedisError as e:
+                logging.warning("Failed to read Redis memory. Error: %s", e)
+            await asyncio.sleep(interval)
+
+
+redis_memory = RedisMemory(REDIS_MEMORY_BUDGET_BYTES)
+
+
+def url_ttl(url_expire: int | str | None) -> int | str | None:
+    """TTL of a url cached now, shorter while Redis is over its budget"""
+    if not redis_memory.over_budget:
+        return url_expire
+    if url_expire:
+        return min(int(url_expire), URL_TTL_PRESSURE_SECONDS)
+    return URL_TTL_PRESSURE_SECONDS
+
+
+def is_url_key(key: str | None) -> bool:
+    """
+    matched on what a url key is, a bucket u:<n> or a bare base62 short
+    code, sets like dirty_clicks or dirty_uniques are never counted
+    """
+    if not key:
+        return False
+    if REDIS_URL_LAYOUT == "hash":
+        prefix, _, bucket = key.partition(":")
+        return prefix == "u" and bucket.isdigit()
+    return key.isascii() and key.isalnum()
+
+
+async def url_key_stats(sample: int = 100) -> dict[str, float]:
+    """
+    memory and TTL per cached url, averaged over up to sample random keys
+    RANDOMKEY picks from every key, the url keys (or buckets) are kept
+    """
+    pipe = async_redis_client.pipeline(transaction=False)
+    for _ in range(sample):
+        pipe.randomkey()
+    keys = {key for key in await pipe.execute() if is_url_key(key)}
+    if not keys:
+        return {"sampled": 0}
+
+    hashed = REDIS_URL_LAYOUT == "hash"
+    pipe = async_redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.memory_usage(key, samples=0)
+        pipe.pttl(key)
+        if hashed:
+            pipe.hlen(key)
+    results = iter(await pipe.execute())
+    memory, urls, ttls = 0, 0, []
+    for _ in keys:
+        memory += next(results) or 0
+        ttls.append(next(results))
+        urls += next(results) if hashed else 1
+    expiring = [ttl / 1000 for ttl in ttls if ttl > 0]
+    return {
+        "sampled": urls,
+        "memory_bytes": memory / urls if urls else 0,
+        "ttl_seconds": sum(expiring) / len(expiring) if expiring else 0,
+        "without_ttl": sum(ttl == -1 for ttl in ttls),
+    }
+
+
+"""
+Redirect hot path, one round trip each
+
+- hit: GET short_code, INCR clicks:short_code, SADD dirty_clicks,
+  adaptive TTL and XFetch refresh, run server side in one script call
+- unknown: missing:short_code answers URL_MISSING in the same call, no
+  database, a zero bit in a ready Bloom filter answers URL_NOT_IN_BLOOM,
+  a hint only, the database confirms it
+- miss: SET short_code, INCR clicks:short_code, SADD dirty_clicks
+  run server side in one script call, see cache_url_and_count
+
+clicks:short_code only holds the clicks since the last sync (a delta),
+it never expires and is never seeded from the database
+"""
+_get_url_and_count_script = async_redis_client.register_script(
+    _LAYOUT_LUA
+    + """
+    local long_url = get_field(KEYS[1], ARGV[7])
+    if long_url then
+        incr_field(KEYS[2], ARGV[8], 1)
+        redis.call('SADD', KEYS[3], ARGV[1])
+        if ARGV[4] ~= '' then
+            local ttl = redis.call('PTTL', KEYS[1])
+            if ttl > 0 then
+                local new = math.min(ttl + tonumber(ARGV[5]), tonumber(ARGV[6]))
+                if tonumber(ARGV[3]) >= ttl then
+                    new = math.max(new, tonumber(ARGV[4]))
+                end
+                if new - ttl >= 1000 then
+                    redis.call('PEXPIRE', KEYS[1], new)
+                end
+            end
+        end
+        return long_url
+    end
+    if redis.call('EXISTS', KEYS[4]) == 1 then
+        return 1
+    end
+    if ARGV[2] ~= '' and redis.call('GETBIT', KEYS[5], ARGV[2]) == 1 then
+        for i = 9, #ARGV do
+            if redis.call('GETBIT', KEYS[5], ARGV[i]) == 0 then
+                return 2
+            end
+        end
+    end
+    return false
+    """
+)
+
+
+async def get_url_and_count(
+    short_code: str, url_expire: int | str | None = None
+) -> str | int | None:
+    """
+    Redis: short_code -> long_url, counting the click on a hit
+    URL_MISSING for a code known not to exist, URL_NOT_IN_BLOOM for one
+    most likely unknown, None when only the database can tell
+    url_expire: TTL an XFetch refresh sets, None for keys without one
+    """
+    url_expire = url_ttl(url_expire)
+    refresh = int(url_expire) * 1000 if url_expire else ""
+    extend = 0 if redis_memory.over_budget else URL_TTL_EXTEND_SECONDS * 1000
+    key, field = url_key(short_code)
+    clicks, clicks_field = clicks_key(short_code)
+    return await _get_url_and_count_script(
+        keys=[
+            key,
+            clicks,
+            "dirty_clicks",
+            f"missing:{short_code}",
+            BLOOM_KEY,
+        ],
+        args=[
+            short_code,
+            BLOOM_BITS or "",
+            xfetch_gap_ms() if refresh and XFETCH_BETA else 0,
+            refresh,
+            extend,
+            URL_TTL_MAX_SECONDS * 1000,
+            field,
+            clicks_field,
+            *bloom_positions(short_code),
+        ],
+    )
+
+
+"""
+miss: SET short_code, INCR clicks:short_code, SADD dirty_clicks, DEL
+lease:short_code in one script, skipped when deleted:short_code exists. delete_url sets it before
+dropping the keys, so a miss that read the row just before the delete
+can't write the link back.
+The code is in the database, its Bloom bits are set again, a code whose
+remember_urls failed or was lost in a failover is repaired by its first miss.
+"""
+URL_TOMBSTONE_SECONDS = 300
+
+_cache_url_and_count_script = async_redis_client.register_script(
+    _LAYOUT_LUA
+    + """
+    if redis.call('EXISTS', KEYS[4]) == 1 then
+        redis.call('DEL', KEYS[5])
+        return 0
+    end
+    set_field(KEYS[1], ARGV[4], ARGV[1], ARGV[2])
+    incr_field(KEYS[2], ARGV[5], 1)
+    redis.call('SADD', KEYS[3], ARGV[3])
+    redis.call('DEL', KEYS[5])
+    add_to_bloom(KEYS[6], KEYS[7], ARGV, 6)
+    return 1
+    """
+)
+
+
+async def cache_url_and_count(
+    short_code: str, long_url: str, url_expire: int | str | None
+) -> bool:
+    """
+    Redis: short_code -> long_url, clicks:short_code += 1, mark dirty
+    False if the url was deleted meanwhile, nothing written
+    """
+    key, field = url_key(short_code)
+    clicks, clicks_field = clicks_key(short_code)
+    cached = await _cache_url_and_count_script(
+        keys=[
+            key,
+            clicks,
+            "dirty_clicks",
+            f"deleted:{short_code}",
+            f"lease:{short_code}",
+            BLOOM_KEY,
+            BLOOM_BUILD_KEY,
+        ],
+        args=[
+            long_url,
+            url_ttl(url_expire) or "",
+            short_code,
+            field,
+            clicks_field,
+            *bloom_positions(short_code),
+        ],
+    )
+    return bool(cached)
+
+
+def drop_url(short_code: str) -> None:
+    """
+    tombstone first, then every Redis key of a deleted url, one pipeline
+    in both layouts, a worker may still read the other one
+    """
+    bucket = url_bucket(short_code)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(f"deleted:{short_code}", 1, ex=URL_TOMBSTONE_SECONDS)
+    pipe.delete(short_code, f"clicks:{short_code}", visitors_key(short_code))
+    pipe.hdel(f"u:{bucket}", short_code)
+    pipe.hdel(f"c:{bucket}", short_code)
+    pipe.srem("dirty_clicks", short_code)
+    for window in TRENDING_WINDOWS:
+        pipe.zrem(trending_key(window), short_code)
+    pipe.execute()
+
+
+"""
+Click events, one Redis Stream entry per served redirect
+
+- {c: short_code, t: unix time, r: referrer host, u: user agent class,
+  g: country}, sent with the buffered clicks, never on the redirect path
+- capped at about CLICK_EVENTS_MAX_LENGTH entries, entries trimmed before
+  the rollup consumers read them are lost, 0 disables the events
+"""
+CLICK_EVENTS_STREAM = "clicks:events"
+CLICK_EVENTS_MAX_LENGTH = int(os.getenv("CLICK_EVENTS_MAX_LENGTH") or 1_000_000)
+
+"""
+Unique visitors, HyperLogLogs of visitor fingerprints, sent with the clicks
+
+- uv:short_code, every visitor of a link, dropped with the link
+- uv:short_code:YYYYMMDD, the visitors of a UTC day, expire
+  UNIQUE_DAY_GRACE_SECONDS after the day, the sync persisted them by then
+- at most 12 KB per key, sparse and far smaller for a few visitors
+- dirty_uniques holds short_code:YYYYMMDD of the keys the sync counts next
+"""
+UNIQUE_CLICKS = os.getenv("UNIQUE_CLICKS", "true").lower() == "true"
+UNIQUE_DAY_GRACE_SECONDS = int(os.getenv("UNIQUE_DAY_GRACE_SECONDS") or 86400)
+DIRTY_UNIQUES = "dirty_uniques"
+
+
+def unique_day(day: int) -> str:
+    """unix time of a UTC midnight -> YYYYMMDD"""
+    return time.strftime("%Y%m%d", time.gmtime(day))
+
+
+def visitors_key(short_code: str, day: str | None = None) -> str:
+    return f"uv:{short_code}:{day}" if day else f"uv:{short_code}"
+
+
+"""
+Trending links, one sorted set per window, forward decay
+
+- a click at time t adds 2 ^ ((t - landmark) / window) to its code, a
+  score at time now / 2 ^ ((now - landmark) / window) is the clicks of
+  the code, each one halved for every window since it happened
+- the order of the set is the order of the decayed counts, the top N is
+  one ZREVRANGE, O(log n + N), nothing is decayed per read
+- the weights grow with time, past TRENDING_RESCALE windows the set is
+  scaled back once, the landmark moves to now and what decayed to nothing
+  is dropped
+- the lowest scores are trimmed past TRENDING_MAX_SIZE codes, memory is
+  bounded, a heavy hitter outscores the trimmed ones by far
+"""
+TRENDING_WINDOWS = {"5m": 300, "1h": 3600, "24h": 86400}
+TRENDING_MAX_SIZE = int(os.getenv("TRENDING_MAX_SIZE") or 10000)
+TRENDING_RESCALE = 32
+
+
+def trending_key(window: str) -> str:
+    return f"trending:{window}"
+
+
+_trending_script = async_redis_client.register_script(
+    """
+    local now = tonumber(ARGV[1])
+    local window = tonumber(ARGV[2])
+    local rescale = tonumber(ARGV[4])
+
+    local landmark = tonumber(redis.call('GET', KEYS[2]))
+    if not landmark then
+        landmark = now
+        redis.call('SET', KEYS[2], now)
+    end
+
+    local exponent = (now - landmark) / window
+    if exponent > rescale then
+        local scale = 2 ^ -exponent
+        local scores = redis.call('ZRANGE', KEYS[1], 0, -1, 'WITHSCORES')
+        for i = 1, #scores, 2 do
+            local score = tonumber(scores[i + 1]) * scale
+            if score < 2 ^ -rescale then
+                redis.call('ZREM', KEYS[1], scores[i])
+            else
+                redis.call('ZADD', KEYS[1], score, scores[i])
+            end
+        end
+        redis.call('SET', KEYS[2], now)
+        exponent = 0
+    end
+
+    local weight = 2 ^ exponent
+    for i = 5, #ARGV, 2 do
+        redis.call('ZINCRBY', KEYS[1], tonumber(ARGV[i + 1]) * weight, ARGV[i])
+    end
+
+    local extra = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[3])
+    if extra > 0 then
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 0, extra - 1)
+    end
+    """
+)
+
+
+async def trending_urls(window: str, count: int) -> list[tuple[str, float]]:
+    """top count codes of window, [(short_code, decayed clicks), ...]"""
+    key = trending_key(window)
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.get(f"{key}:landmark")
+    pipe.zrevrange(key, 0, count - 1, withscores=True)
+    landmark, scores = await pipe.execute()
+    if landmark is None:
+        return []
+    scale = 2 ** -((time.time() - float(landmark)) / TRENDING_WINDOWS[window])
+    return [(short_code, score * scale) for short_code, score in scores]
+
+
+async def peek_urls(short_codes: list[str]) -> dict[str, str]:
+    """short_code -> long_url of the codes cached in Redis, one pipeline"""
+    pipe = async_redis_client.pipeline(transaction=False)
+    for short_code in short_codes:
+        key, field = url_key(short_code)
+        if field:
+            pipe.hget(key, field)
+        else:
+            pipe.get(key)
+    long_urls = await pipe.execute()
+    return {
+        short_code: long_url
+        for short_code, long_url in zip(short_codes, long_urls)
+        if long_url is not None
+    }
+
+
+async def incr_clicks(
+    counts: dict[str, int],
+    events: list[dict] = (),
+    visitors: dict[tuple[str, int], set[bytes]] | None = None,
+    trending: dict[str, int] | None = None,
+) -> None:
+    """
+    Redis: clicks:short_code += count, mark short_code dirty,
+    XADD the click events, PFADD the visitors, ZINCRBY the trending
+    windows, one pipeline
+    visitors: (short_code, UTC midnight) -> visitor fingerprints
+    trending: short_code -> redirects since the last flush
+    """
+    visitors = visitors or {}
+    trending = trending or {}
+    if not counts and not events and not visitors and not trending:
+        return
+    pipe = async_redis_client.pipeline(transaction=False)
+    for short_code, count in counts.items():
+        key, field = clicks_key(short_code)
+        if field:
+            pipe.hincrby(key, field, count)
+        else:
+            pipe.incrby(key, count)
+    if counts:
+        pipe.sadd("dirty_clicks", *counts)
+    for event in events:
+        pipe.xadd(
+            CLICK_EVENTS_STREAM,
+            event,
+            maxlen=CLICK_EVENTS_MAX_LENGTH,
+            approximate=True,
+        )
+    for (short_code, day), fingerprints in visitors.items():
+        key = visitors_key(short_code, unique_day(day))
+        pipe.pfadd(visitors_key(short_code), *fingerprints)
+        pipe.pfadd(key, *fingerprints)
+        pipe.expireat(key, day + 86400 + UNIQUE_DAY_GRACE_SECONDS)
+    if visitors:
+        pipe.sadd(
+            DIRTY_UNIQUES,
+            *(f"{short_code}:{unique_day(day)}" for short_code, day in visitors),
+        )
+    if trending:
+        args = [arg for item in trending.items() for arg in item]
+        for window, seconds in TRENDING_WINDOWS.items():
+            key = trending_key(window)
+            await _trending_script(
+                keys=[key, f"{key}:landmark"],
+                args=[time.time(), seconds, TRENDING_MAX_SIZE, TRENDING_RESCALE]
+                + args,
+                client=pipe,
+            )
+    await pipe.execute()
+
+
+"""
+Click sync, move a chunk of dirty codes into the pending hash, atomically
+
+- SPOP a chunk of dirty_clicks
+- the delta of each code is read and deleted in both layouts,
+  redirects start a new delta
+- HINCRBY pending short_code delta
+- returns [short_code, pending delta, ...]
+"""
+_take_clicks_script = redis_client.register_script(
+    """
+    local digits = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    local bucket_size = tonumber(ARGV[2])
+
+    local function bucket(code)
+        local id = 0
+        for i = 1, #code do
+            local digit = string.find(digits, string.sub(code, i, i), 1, true)
+            if not digit then
+                return nil
+            end
+            id = id * 62 + digit - 1
+        end
+        return math.floor(id / bucket_size)
+    end
+
+    local taken = {}
+    local codes = redis.call('SPOP', KEYS[1], ARGV[1])
+    for _, code in ipairs(codes) do
+        local key = 'clicks:' .. code
+        local delta = tonumber(redis.call('GET', key) or 0)
+        if delta ~= 0 then
+            redis.call('DEL', key)
+        end
+        local number = bucket(code)
+        if number then
+            local hash = 'c:' .. number
+            local field_delta = tonumber(redis.call('HGET', hash, code) or 0)
+            if field_delta ~= 0 then
+                redis.call('HDEL', hash, code)
+                delta = delta + field_delta
+            end
+        end
+        if delta ~= 0 then
+            local pending = redis.call('HINCRBY', KEYS[2], code, delta)
+            table.insert(taken, code)
+            table.insert(taken, pending)
+        end
+    end
+    return taken
+    """
+)
+
+
+def take_clicks(pending_key: str, count: int) -> list:
+    """up to count dirty codes moved to pending_key, [code, pending delta, ...]"""
+    return _take_clicks_script(
+        keys=["dirty_clicks", pending_key], args=[count, URL_HASH_BUCKET_SIZE]
+    )
@@ -1,18 +1,82 @@
 import os
 from typing import Annotated
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url, event
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from fastapi import Depends
 
+from .pool import TimedQueuePool, TimedAsyncQueuePool
+from ..monitoring.metrics import count_database_call
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+"""
+asyncio drivers for the same database
+postgresql:// -> postgresql+asyncpg://
+sqlite:// -> sqlite+aiosqlite://
+"""
+ASYNC_DRIVERS = {
+	"postgresql": "postgresql+asyncpg",
+	"postgresql+psycopg2": "postgresql+asyncpg",
+	"sqlite": "sqlite+aiosqlite",
+	"sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+	scheme, sep, rest = database_url.partition("://")
+	return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(DATABASE_URL)
+
+"""
+connection pools, per engine and per worker process
+DB_POOL_SIZE connections stay open, up to DB_MAX_OVERFLOW more under load,
+a request waits DB_POOL_TIMEOUT seconds for one before failing
+"""
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+def get_pool_options(database_url: str, poolclass: type) -> dict:
+	# in-memory sqlite lives in one connection, keep its default pool
+	url = make_url(database_url)
+	if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+		return {}
+	return {
+		"poolclass": poolclass,
+		"pool_size": DB_POOL_SIZE,
+		"max_overflow": DB_MAX_OVERFLOW,
+		"pool_timeout": DB_POOL_TIMEOUT,
+		"pool_recycle": DB_POOL_RECYCLE,
+		"pool_pre_ping": DB_POOL_PRE_PING,
+	}
+
+
+engine = create_engine(DATABASE_URL, **get_pool_options(DATABASE_URL, TimedQueuePool))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# non blocking engine for the hot path (redirects)
+async_engine = create_async_engine(
+	ASYNC_DATABASE_URL, **get_pool_options(ASYNC_DATABASE_URL, TimedAsyncQueuePool)
+)
+
+# statements per request for /metrics
+event.listen(engine, "before_cursor_execute", count_database_call)
+event.listen(async_engine.sync_engine, "before_cursor_execute", count_database_call)
+
+AsyncSessionLocal = async_sessionmaker(
+	bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
 
 def get_db():
@@ -22,6 +86,11 @@ def get_db():
 	finally:
 		db.close()
 
+async def get_async_db():
+	async with AsyncSessionLocal() as db:
+		yield db
+
 # a new type hint
 # Pass the active database session where it will use as the db parameter.
-DbSession = Annotated[Session, Depends(get_db)]
\ No newline at end of file
+DbSession = Annotated[Session, Depends(get_db)]
+AsyncDbSession = Annotated[AsyncSession, Depends(get_async_db)]
@@ -0,0 +1,183 @@
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable
+from collections import OrderedDict
+
+
+def hit_ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+class TTLCache:
+    """
+    Bounded in-process cache, one per worker.
+
+    - least recently used entry is evicted once maxsize is reached
+    - every entry expires ttl seconds after it was stored
+    - maxsize = 0 disables the cache
+    - generation moves on every delete and clear, a value read before
+      an invalidation is stored only if set() is given the generation
+      seen before the read and nothing was invalidated since
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.generation = 0
+
+        # key -> (expires_at, value), ordered from least to most recently used
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: float | None = None,
+        generation: int | None = None,
+    ) -> None:
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self.generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def __contains__(self, key: str) -> bool:
+        """a live entry, without touching the stats or the LRU order"""
+        item = self._data.get(key)
+        return item is not None and item[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": hit_ratio(self.hits, self.misses),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SingleFlight:
+    """
+    Concurrent calls for the same key share one run, one per worker.
+
+    - the first caller starts fn() as a task, later callers await that task
+    - every caller gets its result or its exception
+    - the task is shielded, a caller that goes away doesn't cancel it
+      for the others
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """(result, True for the caller that ran fn)"""
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task), leader
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class Batcher:
+    """
+    Concurrent calls of a worker share one run of fn on their items.
+
+    - the first item waits up to wait seconds for others, a batch runs
+      at once when it holds max_size items
+    - fn(items) runs in a thread and returns one result per item, in order,
+      an exception fails every call of its batch
+    - a caller that goes away doesn't cancel the batch for the others
+    """
+
+    def __init__(self, fn: Callable[[list], list], max_size: int, wait: float):
+        self.fn = fn
+        self.max_size = max_size
+        self.wait = wait
+        self._items: list[tuple[Any, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._running: set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._items.append((item, future))
+        if len(self._items) >= self.max_size:
+            self._start()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.wait, self._start)
+        return await asyncio.shield(future)
+
+    def _start(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._items = self._items, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await asyncio.to_thread(self.fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,313 @@
+import time
+import threading
+from contextlib import AsyncExitStack
+import redis
+import redis.asyncio
+from sqlalchemy import Engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ..monitoring.metrics import (
+    count_redis_call,
+    redis_circuit_opened,
+    redis_calls_rejected,
+)
+
+
+class WaitTimer:
+    """time spent getting a connection out of a pool"""
+
+    def __init__(self):
+        self.waits = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.waits += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "waits": self.waits,
+            "wait_seconds_total": self.total,
+            "wait_seconds_max": self.max,
+        }
+
+
+class CircuitBreaker:
+    """
+    Redis health as seen by this process, shared by its clients
+
+    - closed: calls go through, connection errors and timeouts in a row
+      are counted, any reply resets the count
+    - open: after `failures` of them, every checkout fails at once
+      without touching the network, for reset_seconds
+    - half open: then one call goes through, its reply closes the
+      circuit, its failure opens it again
+    """
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.failed = 0
+        self.opened_at: float | None = None
+        self.trial_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None or not self.failures:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # one trial per reset_seconds, a trial that never replied
+            # does not keep the circuit open for ever
+            if now - max(self.opened_at, self.trial_at) < self.reset_seconds:
+                return False
+            self.trial_at = now
+            return True
+
+    def success(self) -> None:
+        if self.failed or self.opened_at is not None:
+            with self._lock:
+                self.failed = 0
+                self.opened_at = None
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failed += 1
+            if self.failures and self.failed >= self.failures:
+                if self.opened_at is None:
+                    redis_circuit_opened.inc()
+                self.opened_at = time.monotonic()
+
+    def check(self) -> None:
+        """raise at once while the circuit is open"""
+        if not self.allow():
+            redis_calls_rejected.inc()
+            raise redis.ConnectionError("Redis circuit breaker open")
+
+
+"""
+Connections that report every reply, connection error and timeout
+to the CircuitBreaker of their pool
+"""
+BREAKER_ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+
+class BreakerConnection(redis.Connection):
+    def __init__(self, *args, breaker: CircuitBreaker, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    def connect(self, *args, **kwargs):
+        try:
+            return super().connect(*args, **kwargs)
+        except BREAKER_ERRORS:
+            self.breaker.failure()
+            raise
+
+    def send_packed_command(self, *args, **kwargs):
+        try:
+            return super().send_packed_command(*args, **kwargs)
+        except BREAKER_ERRORS:
+            self.breaker.failure()
+            raise
+
+    def read_response(self, *args, **kwargs):
+        try:
+            response = super().read_response(*args, **kwargs)
+        except BREAKER_ERRORS:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return response
+
+
+class AsyncBreakerConnection(redis.asyncio.Connection):
+    def __init__(self, *args, breaker: CircuitBreaker, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    async def connect(self, *args, **kwargs):
+        try:
+            return await super().connect(*args, **kwargs)
+        except BREAKER_ERRORS:
+            self.breaker.failure()
+            raise
+
+    async def send_packed_command(self, *args, **kwargs):
+        try:
+            return await super().send_packed_command(*args, **kwargs)
+        except BREAKER_ERRORS:
+            self.breaker.failure()
+            raise
+
+    async def read_response(self, *args, **kwargs):
+        try:
+            response = await super().read_response(*args, **kwargs)
+        except BREAKER_ERRORS:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return response
+
+
+"""
+Pools that time every checkout
+
+- one WaitTimer per class, it survives engine.dispose() recreating the pool
+- the time includes opening a new connection when the pool has none idle
+- a Redis checkout is one round trip (command, pipeline or script),
+  counted for the request that made it
+"""
+
+
+class TimedQueuePool(QueuePool):
+    wait = WaitTimer()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait.observe(time.perf_counter() - start)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    wait = WaitTimer()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait.observe(time.perf_counter() - start)
+
+
+class TimedBlockingConnectionPool(redis.BlockingConnectionPool):
+    wait = WaitTimer()
+
+    def get_connection(self, *args, **kwargs):
+        breaker = self.connection_kwargs.get("breaker")
+        if breaker is not None:
+            breaker.check()
+        count_redis_call()
+        start = time.perf_counter()
+        try:
+            return super().get_connection(*args, **kwargs)
+        finally:
+            self.wait.observe(time.perf_counter() - start)
+
+
+class TimedAsyncBlockingConnectionPool(redis.asyncio.BlockingConnectionPool):
+    wait = WaitTimer()
+
+    async def get_connection(self, *args, **kwargs):
+        breaker = self.connection_kwargs.get("breaker")
+        if breaker is not None:
+            breaker.check()
+        count_redis_call()
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(*args, **kwargs)
+        finally:
+            self.wait.observe(time.perf_counter() - start)
+
+
+def database_pool_stats(engine: Engine | AsyncEngine) -> dict[str, float]:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+
+    stats = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+    }
+    if isinstance(pool, (TimedQueuePool, TimedAsyncQueuePool)):
+        stats.update(pool.wait.stats())
+    return stats
+
+
+def redis_pool_stats(client: redis.Redis | redis.asyncio.Redis) -> dict[str, float]:
+    pool = client.connection_pool
+    if isinstance(pool, redis.BlockingConnectionPool):
+        # LIFO queue of idle connections, None for a slot never opened
+        idle = sum(connection is not None for connection in list(pool.pool.queue))
+        opened = len(pool._connections)
+    else:
+        idle = len(getattr(pool, "_available_connections", ()))
+        opened = idle + len(getattr(pool, "_in_use_connections", ()))
+
+    stats = {
+        "max_connections": pool.max_connections,
+        "checked_out": opened - idle,
+        "idle": idle,
+    }
+    if isinstance(
+        pool, (TimedBlockingConnectionPool, TimedAsyncBlockingConnectionPool)
+    ):
+        stats.update(pool.wait.stats())
+    return stats
+
+
+"""
+Warm-up, open count connections and return them to the pool idle
+so the first requests after a start or deploy don't pay for the connects
+"""
+
+
+def warm_database_pool(engine: Engine, count: int) -> int:
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+async def warm_async_database_pool(engine: AsyncEngine, count: int) -> int:
+    async with AsyncExitStack() as stack:
+        for _ in range(count):
+            await stack.enter_async_context(engine.connect())
+    return count
+
+
+def warm_redis_pool(client: redis.Redis, count: int) -> int:
+    pool = client.connection_pool
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(pool.get_connection())
+    finally:
+        for connection in connections:
+            pool.release(connection)
+    return len(connections)
+
+
+async def warm_async_redis_pool(client: redis.asyncio.Redis, count: int) -> int:
+    pool = client.connection_pool
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(await pool.get_connection())
+    finally:
+        for connection in connections:
+            await pool.release(connection)
+    return len(connections)
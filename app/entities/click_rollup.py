@@ -0,0 +1,44 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from ..database.core import Base
+
+"""
+Clicks per short code and time bucket, rolled up from the click events
+
+one row per (short_code, bucket, referrer, ua_class, country),
+the primary key starts with short_code and bucket, so the stats of a
+link over a time range are one range scan
+"""
+
+
+class ClickRollup:
+    short_code = Column(String(10), primary_key=True)
+    # start of the hour or day, UTC
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    referrer = Column(String(255), primary_key=True)
+    ua_class = Column(String(16), primary_key=True)
+    country = Column(String(2), primary_key=True)
+    clicks = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<{type(self).__name__}(short_code='{self.short_code}', bucket='{self.bucket}')>"
+
+
+class ClickRollupHourly(ClickRollup, Base):
+    __tablename__ = "click_rollups_hourly"
+
+
+class ClickRollupDaily(ClickRollup, Base):
+    __tablename__ = "click_rollups_daily"
+
+
+class ClickUniquesDaily(Base):
+    """approximate unique visitors of a url per UTC day, PFCOUNT snapshots"""
+
+    __tablename__ = "click_uniques_daily"
+
+    short_code = Column(String(10), primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    visitors = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ClickUniquesDaily(short_code='{self.short_code}', bucket='{self.bucket}')>"
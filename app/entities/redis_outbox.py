@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String
+from ..database.core import Base
+
+"""
+Redis writes that failed, replayed oldest first by
+app.background_tasks.outbox until Redis takes them
+
+a delete records its drop in its own transaction and removes it once
+Redis dropped the url, a create or a password change only records its
+write when it failed
+"""
+
+
+class RedisOutbox(Base):
+    __tablename__ = "redis_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # "remember": key short_code, value long_url
+    # "drop": key short_code
+    # "password_changed": key user_id, value timestamp
+    op = Column(String(16), nullable=False)
+    key = Column(String(64), nullable=False)
+    value = Column(String(2083), nullable=True)
+
+    def __repr__(self):
+        return f"<RedisOutbox(op='{self.op}', key='{self.key}')>"
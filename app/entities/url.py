@@ -1,18 +1,56 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func
+from datetime import datetime, timezone
+from sqlalchemy import (
+    DDL,
+    Column,
+    Integer,
+    String,
+    ForeignKey,
+    DateTime,
+    event,
+    Index,
+    Sequence,
+    func,
+)
 from sqlalchemy.dialects.postgresql import UUID
 from ..database.core import Base
 from ..urls.utils import encode_base62
 
+"""
+Postgres: url ids come from urls_id_block_seq one by one, workers lease
+a batch of them per round trip (see IdBlockAllocator), an INSERT without
+an id (a manual insert) takes the next one, it can never reuse a leased id.
+Only the unused rest of a lease is skipped, when its worker stops.
+Other databases ignore the sequence and autoincrement.
+"""
+url_id_blocks = Sequence("urls_id_block_seq", start=1, metadata=Base.metadata)
+
 
 class URL(Base):
     __tablename__ = "urls"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Integer, url_id_blocks, primary_key=True, autoincrement=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
     long_url = Column(String(2083), nullable=False)
     short_code = Column(String(10), unique=True, index=True)
     clicks = Column(Integer, default=0)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # PFCOUNT of uv:short_code at the last click sync, approximate
+    unique_clicks = Column(Integer, default=0, server_default="0", nullable=False)
+    # set by the app too, every dialect stores the full precision and
+    # keyset cursors on (created_at, id) compare equal to the stored value
+    created_at = Column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+    )
+
+    # hash_url(long_url), an existing link of a user in one indexed lookup
+    url_hash = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        Index("ix_urls_user_id_url_hash", "user_id", "url_hash"),
+        # list-urls pages, newest first
+        Index("ix_urls_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
 
     def generate_short_code(self):
         if not self.id:
@@ -21,3 +59,13 @@ class URL(Base):
 
     def __repr__(self):
         return f"<URL(short_code='{self.short_code}', long_url='{self.long_url}')>"
+
+
+# create_all on Postgres: INSERTs outside the app take an id of the sequence too
+event.listen(
+    URL.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE urls ALTER COLUMN id SET DEFAULT nextval('urls_id_block_seq')"
+    ).execute_if(dialect="postgresql"),
+)
@@ -56,3 +56,21 @@ class UrlNotFoundError(UrlError):
     def __init__(self, short_code: str):
         message = f"{short_code} corresponding long url not found"
         super().__init__(status_code=404, detail=message)
+
+
+class UrlBulkPayloadError(UrlError):
+    def __init__(self):
+        super().__init__(
+            status_code=400, detail="Expected a JSON array or NDJSON, one url per line"
+        )
+
+
+class UrlBulkTooLargeError(UrlError):
+    def __init__(self, max_items: int):
+        message = f"At most {max_items} urls per request"
+        super().__init__(status_code=413, detail=message)
+
+
+class UrlCursorError(UrlError):
+    def __init__(self):
+        super().__init__(status_code=400, detail="Invalid cursor")
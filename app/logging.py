@@ -1,5 +1,19 @@
+import os
+import sys
+import copy
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
 import logging
+import logging.handlers
 from enum import StrEnum
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+load_dotenv()
 
 """
 %(levelname)s → logging level (INFO, ERROR, DEBUG, WARN)
@@ -7,9 +21,27 @@ from enum import StrEnum
 %(pathname)s → full path of the Python file where the log was triggered
 %(funcName)s → function name where it happened
 %(lineno)d → line number in the file
+%(request_id)s → X-Request-ID of the request that logged it
 """
+LOG_FORMAT = "%(levelname)s:%(name)s:%(request_id)s:%(message)s"
 LOG_FORMAT_DEBUG = "%(levelname)s:%(message)s:%(pathname)s:%(funcName)s:%(lineno)d"
 
+"""
+records go through a queue, a listener thread formats and writes them
+
+LOG_JSON: one JSON object per line instead of the text format
+LOG_QUEUE_SIZE: records waiting for the listener, more are dropped
+LOG_RATE_LIMIT: records per second per message type, 0 disables
+LOG_SAMPLE_RATE: share of INFO and DEBUG records kept, 1 keeps all
+"""
+LOG_JSON = os.getenv("LOG_JSON", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE") or 10000)
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT") or 10)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE") or 1)
+
+# set per request by RequestIdMiddleware, "-" outside a request
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
 
 class LogLevels(StrEnum):
     """
@@ -25,23 +57,203 @@ class LogLevels(StrEnum):
     debug = "DEBUG"
 
 
-def configure_logging(log_level: str = LogLevels.error):
+class RateLimitFilter(logging.Filter):
+    """
+    per message type, the logger and the unformatted %-style message,
+    so "%s corresponding long url not found" is one type for every code
+
+    - at most rate records per second of a type, a burst of rate at once
+    - sample_rate of the INFO and DEBUG records, WARNING and up always pass
+    - the next record let through carries how many were suppressed
+    - no lock, a race lets a record more or less through
+    """
+
+    MAX_TYPES = 10000
+
+    def __init__(
+        self, rate: float = LOG_RATE_LIMIT, sample_rate: float = LOG_SAMPLE_RATE
+    ):
+        super().__init__()
+        self.rate = rate
+        self.sample_rate = sample_rate
+        # type -> [tokens, last refill, suppressed]
+        self._buckets: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_rate < 1 and record.levelno < logging.WARNING:
+            if random.random() >= self.sample_rate:
+                return False
+        if self.rate <= 0:
+            return True
+
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # f-string messages are a type each, don't grow for ever
+            if len(self._buckets) >= self.MAX_TYPES:
+                self._buckets.clear()
+            bucket = self._buckets[key] = [self.rate, now, 0]
+
+        tokens = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False
+
+        bucket[0] = tokens - 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    enqueues a copy with the message merged and the traceback as text,
+    like the stdlib QueueHandler, the args and exc_info it held may change
+    or hold frames alive once the caller moves on, the listener thread
+    only writes out what it gets
+
+    - records a filter drops are never merged
+    - request_id is read here, the listener thread has no request context
+    - a full queue drops the record, the next one carries the count
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.exception_formatter.formatException(
+                    record.exc_info
+                )
+            record.exc_info = None
+        record.request_id = request_id.get()
+        if self.dropped:
+            record.dropped = self.dropped
+            self.dropped = 0
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """one JSON object per line, extra attributes become fields"""
+
+    # attributes every LogRecord has, the rest came from extra=
+    RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message"}
+
+    def __init__(self, debug: bool = False):
+        super().__init__()
+        self.debug = debug
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if self.debug:
+            entry.update(
+                path=record.pathname, function=record.funcName, line=record.lineno
+            )
+        for name, value in vars(record).items():
+            if name not in self.RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdMiddleware:
+    """
+    pure ASGI, takes X-Request-ID from the request or makes one,
+    every record logged for the request carries it, so does the response
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        value = headers.get(b"x-request-id", b"").decode("latin-1")[:64]
+        value = value or uuid.uuid4().hex
+        token = request_id.set(value)
+
+        async def send_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-request-id", value.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_request_id)
+        finally:
+            request_id.reset(token)
+
+
+listener: logging.handlers.QueueListener | None = None
+
+
+def configure_logging(
+    log_level: str = LogLevels.error,
+    json_format: bool = LOG_JSON,
+    rate_limit: float = LOG_RATE_LIMIT,
+    sample_rate: float = LOG_SAMPLE_RATE,
+):
     """
     This sets up the logging system for your app.
     Default log level is ERROR.
     """
+    global listener
 
     log_level = str(log_level).upper()
     log_levels = [level.value for level in LogLevels]
 
     # If level not valid, falls back to ERROR
     if log_level not in log_levels:
-        logging.basicConfig(level=LogLevels.error)
-        return
+        log_level = LogLevels.error
 
     # If the chosen level is DEBUG, it uses the special detailed format.
-    if log_level == LogLevels.debug:
-        logging.basicConfig(level=log_level, format=LOG_FORMAT_DEBUG)
+    debug = log_level == LogLevels.debug
+    if json_format:
+        formatter = JsonFormatter(debug=debug)
+    else:
+        formatter = logging.Formatter(LOG_FORMAT_DEBUG if debug else LOG_FORMAT)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(formatter)
+
+    queue_handler = ContextQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(RateLimitFilter(rate_limit, sample_rate))
+
+    # no-op when the root logger is already set up
+    logging.basicConfig(level=log_level, handlers=[queue_handler])
+    if queue_handler not in logging.getLogger().handlers or listener is not None:
         return
 
-    logging.basicConfig(level=log_level)
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    listener.start()
+    # writes out what is still queued
+    atexit.register(listener.stop)
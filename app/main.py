@@ -1,24 +1,83 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
-from .database.core import engine, Base
-from .logging import configure_logging, LogLevels
+from .database.core import engine, async_engine, Base
+from .database.cache import async_redis_client, pubsub_client, listen, redis_memory
+from .urls.clicks import click_buffer
+from .urls.service import run_trending_warmer
+from .background_tasks.bloom import ensure_bloom
+from .background_tasks.warm_up import watch_warm_up
+from .background_tasks.outbox import run_outbox
+from .monitoring.service import warm_up_pools, dump_metrics
+from .monitoring.metrics import dump
+from .monitoring.middleware import MetricsMiddleware
+from .logging import configure_logging, LogLevels, RequestIdMiddleware
 
 configure_logging(LogLevels.info)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # open the minimum connections before the app reports ready
+    await warm_up_pools()
+
+    # Bloom filter of short codes, when Redis has none yet
+    await asyncio.to_thread(ensure_bloom)
+
+    # pub/sub invalidations, batched click flushes, metrics for other workers,
+    # Redis memory against its budget, trending links into url_cache,
+    # Redis warmed up from the database once it lost its urls, url writes
+    # that failed while Redis was unavailable
+    tasks = [
+        asyncio.create_task(listen()),
+        asyncio.create_task(click_buffer.run()),
+        asyncio.create_task(dump_metrics()),
+        asyncio.create_task(redis_memory.watch()),
+        asyncio.create_task(run_trending_warmer()),
+        asyncio.create_task(watch_warm_up()),
+        asyncio.create_task(run_outbox()),
+    ]
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        await click_buffer.flush()
+    except Exception as e:
+        logging.error("Failed to flush clicks on shutdown. Error: %s", e)
+    dump()
+
+    # async connections are bound to the event loop that opened them
+    await async_redis_client.aclose()
+    await pubsub_client.aclose()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
 """ Only uncomment below to create new tables, 
 otherwise the tests will fail if not connected
 """
 from .entities.user import User  # noqa: E402, F401
 from .entities.url import URL  # noqa: E402, F401
+from .entities import click_rollup  # noqa: E402, F401
+from .entities import redis_outbox  # noqa: E402, F401
 
 Base.metadata.create_all(bind=engine)
 
 from .auth.controller import router as auth_router  # noqa: E402
 from .users.controller import router as users_router  # noqa: E402
 from .urls.controller import router as urls_router  # noqa: E402
+from .monitoring.controller import router as monitoring_router  # noqa: E402
 
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(users_router, prefix="/users", tags=["users"])
 app.include_router(urls_router, prefix="/urls", tags=["urls"])
+app.include_router(monitoring_router, tags=["monitoring"])
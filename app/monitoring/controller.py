@@ -0,0 +1,26 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from . import model
+from . import service
+
+router = APIRouter()
+
+
+# liveness of the database and Redis, pool gauges
+@router.get("/health", response_model=model.HealthResponse)
+async def health():
+    health = await service.get_health()
+    if health.status != "ok":
+        return JSONResponse(
+            health.model_dump(), status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    return health
+
+
+# counters and histograms of every worker, Prometheus text format
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(
+        await service.get_metrics(), media_type="text/plain; version=0.0.4"
+    )
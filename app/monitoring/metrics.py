@@ -0,0 +1,364 @@
+"""
+Counters and histograms in the Prometheus text format, no client library
+
+- every thread writes to its own shard (threading.local), an observation
+  takes no lock, a scrape sums the shards
+- labels are positional values, in the order of labelnames
+- with several uvicorn workers set METRICS_DIR, every process dumps its
+  totals there as <pid>.json and /metrics merges the dumps of the
+  processes still alive, a dead one's dump is deleted, its counters
+  reset like a restarted process's
+- gauges are set by the process answering the scrape and never dumped
+"""
+
+import os
+import json
+import bisect
+import logging
+import threading
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_DUMP_SECONDS = float(os.getenv("METRICS_DUMP_SECONDS") or 5)
+
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+CALL_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50)
+SYNC_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+registry: list["Metric"] = []
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        # only taken the first time a thread writes
+        self._shards_lock = threading.Lock()
+        registry.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._shards.append(values)
+            return values
+
+    def collect(self) -> dict[tuple, object]:
+        """labels -> value summed over every thread"""
+        totals = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # dict.copy() holds the GIL, safe against a concurrent insert
+            for labels, value in shard.copy().items():
+                totals[labels] = self.merge(totals.get(labels), value)
+        return totals
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        values = self._shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def samples(self, labels: tuple, value) -> list[tuple[str, dict, float]]:
+        return [(self.name, dict(zip(self.labelnames, labels)), value)]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str) -> None:
+        values = self._shard()
+        counts = values.get(labels)
+        if counts is None:
+            # one slot per bucket, one for +Inf, then the sum
+            counts = values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def merge(self, total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, labels: tuple, value) -> list[tuple[str, dict, float]]:
+        names = dict(zip(self.labelnames, labels))
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), value[:-1]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            samples.append((f"{self.name}_bucket", {**names, "le": le}, cumulative))
+        samples.append((f"{self.name}_sum", names, value[-1]))
+        samples.append((f"{self.name}_count", names, cumulative))
+        return samples
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def collect(self) -> dict[tuple, object]:
+        return dict(self._values)
+
+    def samples(self, labels: tuple, value) -> list[tuple[str, dict, float]]:
+        return [(self.name, dict(zip(self.labelnames, labels)), value)]
+
+
+"""
+What is measured
+"""
+
+http_requests = Counter(
+    "http_requests_total", "Requests by route and status", ("method", "route", "status")
+)
+http_request_seconds = Histogram(
+    "http_request_seconds", "Request latency by route", ("route",)
+)
+http_request_redis_calls = Histogram(
+    "http_request_redis_calls",
+    "Redis round trips per request",
+    ("route",),
+    buckets=CALL_BUCKETS,
+)
+http_request_database_calls = Histogram(
+    "http_request_database_calls",
+    "Database statements per request",
+    ("route",),
+    buckets=CALL_BUCKETS,
+)
+redirect_seconds = Histogram(
+    "redirect_seconds",
+    "Redirect lookup latency by the tier that answered",
+    ("tier",),
+)
+url_loads = Counter(
+    "url_loads_total",
+    "Redirect misses resolved by a database read or another worker's lease",
+    ("source",),
+)
+url_cache_lookups = Counter(
+    "url_cache_lookups_total",
+    "Redirect lookups by cache and result",
+    ("cache", "result"),
+)
+urls_created = Counter("urls_created_total", "Short urls created")
+urls_listed = Counter("urls_listed_total", "Urls returned by list pages")
+click_sync_seconds = Histogram(
+    "click_sync_seconds", "Duration of a click sync cycle", buckets=SYNC_BUCKETS
+)
+click_sync_codes = Counter("click_sync_codes_total", "Short codes synced to the db")
+click_events_dropped = Counter(
+    "click_events_dropped_total",
+    "Click events and visitors dropped, the buffer was full",
+    ("kind",),
+)
+click_rollup_events = Counter(
+    "click_rollup_events_total", "Click events rolled up into the database"
+)
+click_backlog = Gauge("click_backlog", "Short codes waiting for a sync (dirty_clicks)")
+redis_memory_bytes = Gauge("redis_memory_bytes", "Memory used by Redis")
+redis_memory_budget_bytes = Gauge(
+    "redis_memory_budget_bytes", "REDIS_MEMORY_BUDGET_BYTES, 0 when unset"
+)
+url_key_memory_bytes = Gauge(
+    "url_key_memory_bytes", "Redis memory per cached url, from a sample of keys"
+)
+url_key_ttl_seconds = Gauge(
+    "url_key_ttl_seconds", "TTL left per cached url, from a sample of keys"
+)
+redis_circuit_opened = Counter(
+    "redis_circuit_opened_total", "Times the Redis circuit breaker opened"
+)
+redis_calls_rejected = Counter(
+    "redis_calls_rejected_total", "Redis calls failed at once, the circuit was open"
+)
+bloom_memory_bytes = Gauge("bloom_memory_bytes", "Size of the short code Bloom filter")
+bloom_false_positive_rate = Gauge(
+    "bloom_false_positive_rate",
+    "False positive rate of the Bloom filter, from the share of bits set",
+)
+bloom_false_negatives = Counter(
+    "bloom_false_negatives_total",
+    "Codes missing from the Bloom filter but found in the database, added back",
+)
+
+
+"""
+Calls per request
+
+the middleware puts a RequestCalls in request_calls, the pools and the
+database engines count into it, calls outside a request are not counted
+"""
+
+
+class RequestCalls:
+    __slots__ = ("redis", "database")
+
+    def __init__(self):
+        self.redis = 0
+        self.database = 0
+
+
+request_calls: ContextVar[RequestCalls | None] = ContextVar(
+    "request_calls", default=None
+)
+
+
+def count_redis_call() -> None:
+    calls = request_calls.get()
+    if calls is not None:
+        calls.redis += 1
+
+
+def count_database_call(*args) -> None:
+    """also a before_cursor_execute listener"""
+    calls = request_calls.get()
+    if calls is not None:
+        calls.database += 1
+
+
+"""
+Multiprocess, dump this process and merge every dump
+"""
+
+
+def snapshot() -> dict[str, list]:
+    return {
+        metric.name: [
+            [list(labels), value] for labels, value in metric.collect().items()
+        ]
+        for metric in registry
+        if metric.kind != "gauge"
+    }
+
+
+def dump(directory: str | None = METRICS_DIR) -> None:
+    if not directory:
+        return
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    try:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(snapshot(), f)
+        # a scrape never reads a half written file
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        logging.warning("Failed to dump metrics to %s. Error: %s", directory, e)
+
+
+def pid_alive(pid: int) -> bool:
+    """signal 0 only checks the pid, on Windows os.kill would terminate it"""
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # alive, owned by another user
+        return True
+    return True
+
+
+def merged(directory: str | None = METRICS_DIR) -> dict[str, dict[tuple, object]]:
+    """this process live, every other live process from its last dump"""
+    metrics = {metric.name: metric for metric in registry}
+    totals = {metric.name: metric.collect() for metric in registry}
+    if not directory:
+        return totals
+
+    own = str(os.getpid())
+    for file_name in os.listdir(directory):
+        pid, extension = os.path.splitext(file_name)
+        if extension != ".json" or pid == own:
+            continue
+        path = os.path.join(directory, file_name)
+        if pid.isdigit() and not pid_alive(int(pid)):
+            # a worker that exited or was replaced, every restart left one
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                dumped = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("Skipped metrics dump %s. Error: %s", file_name, e)
+            continue
+        for name, values in dumped.items():
+            metric = metrics.get(name)
+            if metric is None:
+                continue
+            for labels, value in values:
+                labels = tuple(labels)
+                totals[name][labels] = metric.merge(totals[name].get(labels), value)
+    return totals
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(directory: str | None = METRICS_DIR) -> str:
+    """Prometheus text exposition format 0.0.4"""
+    totals = merged(directory)
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, value in sorted(totals[metric.name].items()):
+            for name, names, sample in metric.samples(labels, value):
+                if names:
+                    pairs = ",".join(f'{k}="{escape(v)}"' for k, v in names.items())
+                    name = f"{name}{{{pairs}}}"
+                lines.append(f"{name} {sample}")
+    return "\n".join(lines) + "\n"
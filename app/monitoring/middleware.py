@@ -0,0 +1,50 @@
+import time
+
+from .metrics import (
+    RequestCalls,
+    request_calls,
+    http_requests,
+    http_request_seconds,
+    http_request_redis_calls,
+    http_request_database_calls,
+)
+
+
+class MetricsMiddleware:
+    """
+    pure ASGI, latency, status and calls per request labelled by the route
+    template (/urls/{short_code}), never the raw path
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        calls = RequestCalls()
+        token = request_calls.set(calls)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_calls.reset(token)
+
+            # set by the router once a route matched
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            http_requests.inc(scope["method"], route, str(status))
+            http_request_seconds.observe(elapsed, route)
+            http_request_redis_calls.observe(calls.redis, route)
+            http_request_database_calls.observe(calls.database, route)
@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+
+
+class HealthResponse(BaseModel):
+    """
+    status: "ok" or "degraded" when the database or Redis is unreachable
+    redis_circuit: "closed", "open" while Redis calls fail at once, or
+    "half_open" while one call tries Redis again
+    pools: checked_out, idle and wait gauges per connection pool
+    caches: hits, misses and evictions per in-process cache of this worker
+    """
+
+    status: str
+    database: bool
+    redis: bool
+    redis_circuit: str
+    pools: dict[str, dict[str, float]]
+    caches: dict[str, dict[str, float]]
@@ -0,0 +1,149 @@
+import anyio
+import logging
+from sqlalchemy import text
+
+from . import model
+from . import metrics
+from ..database.core import engine, async_engine, DB_POOL_SIZE
+from ..database.cache import (
+    redis_client,
+    async_redis_client,
+    bloom_stats,
+    redis_memory,
+    redis_breaker,
+    url_key_stats,
+    REDIS_POOL_MIN_SIZE,
+)
+from ..database.pool import (
+    database_pool_stats,
+    redis_pool_stats,
+    warm_database_pool,
+    warm_async_database_pool,
+    warm_redis_pool,
+    warm_async_redis_pool,
+)
+from ..database.memory_cache import hit_ratio
+from ..urls.service import url_cache
+from ..auth.service import token_cache
+
+
+def pool_stats() -> dict[str, dict[str, float]]:
+    return {
+        "database": database_pool_stats(engine),
+        "database_async": database_pool_stats(async_engine),
+        "redis": redis_pool_stats(redis_client),
+        "redis_async": redis_pool_stats(async_redis_client),
+    }
+
+
+def cache_stats() -> dict[str, dict[str, float]]:
+    """
+    hit, miss and eviction counters of this worker's in-process caches,
+    and of its redirect lookups that reached Redis
+    """
+    lookups = metrics.url_cache_lookups.collect()
+    hits = lookups.get(("redis", "hit"), 0)
+    misses = lookups.get(("redis", "miss"), 0)
+    return {
+        "url_cache": url_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "redis_urls": {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hit_ratio(hits, misses),
+        },
+    }
+
+
+async def check_database() -> bool:
+    try:
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logging.warning("Database health check failed. Error: %s", e)
+        return False
+
+
+async def check_redis() -> bool:
+    try:
+        return bool(await async_redis_client.ping())
+    except Exception as e:
+        logging.warning("Redis health check failed. Error: %s", e)
+        return False
+
+
+async def get_health() -> model.HealthResponse:
+    database = await check_database()
+    redis = await check_redis()
+    return model.HealthResponse(
+        status="ok" if database and redis else "degraded",
+        database=database,
+        redis=redis,
+        redis_circuit=redis_breaker.state,
+        pools=pool_stats(),
+        caches=cache_stats(),
+    )
+
+
+async def warm_up_pools() -> None:
+    """
+    open the minimum connections of every pool before the app serves,
+    a failure is logged, the pools then connect on demand
+    """
+    warm_ups = {
+        "database": lambda: anyio.to_thread.run_sync(
+            warm_database_pool, engine, DB_POOL_SIZE
+        ),
+        "database_async": lambda: warm_async_database_pool(async_engine, DB_POOL_SIZE),
+        "redis": lambda: anyio.to_thread.run_sync(
+            warm_redis_pool, redis_client, REDIS_POOL_MIN_SIZE
+        ),
+        "redis_async": lambda: warm_async_redis_pool(
+            async_redis_client, REDIS_POOL_MIN_SIZE
+        ),
+    }
+    for name, warm_up in warm_ups.items():
+        try:
+            opened = await warm_up()
+            logging.info("Warmed up %s pool with %s connections", name, opened)
+        except Exception as e:
+            logging.warning("Failed to warm up %s pool. Error: %s", name, e)
+
+
+async def get_metrics() -> str:
+    """Prometheus text of every worker, the click backlog read at scrape time"""
+    try:
+        metrics.click_backlog.set(await async_redis_client.scard("dirty_clicks"))
+    except Exception as e:
+        logging.warning("Failed to read the click backlog. Error: %s", e)
+
+    try:
+        bloom = await bloom_stats()
+        if bloom:
+            metrics.bloom_memory_bytes.set(bloom["memory_bytes"])
+            metrics.bloom_false_positive_rate.set(bloom["false_positive_rate"])
+    except Exception as e:
+        logging.warning("Failed to read the Bloom filter. Error: %s", e)
+
+    try:
+        metrics.redis_memory_bytes.set(await redis_memory.read())
+        metrics.redis_memory_budget_bytes.set(redis_memory.budget)
+        keys = await url_key_stats()
+        if keys["sampled"]:
+            metrics.url_key_memory_bytes.set(keys["memory_bytes"])
+            metrics.url_key_ttl_seconds.set(keys["ttl_seconds"])
+    except Exception as e:
+        logging.warning("Failed to read the Redis memory. Error: %s", e)
+
+    # reads the other workers' dumps from disk
+    return await anyio.to_thread.run_sync(metrics.render)
+
+
+async def dump_metrics() -> None:
+    """this worker's totals to METRICS_DIR every METRICS_DUMP_SECONDS"""
+    if not metrics.METRICS_DIR:
+        return
+    while True:
+        await anyio.to_thread.run_sync(metrics.dump)
+        await anyio.sleep(metrics.METRICS_DUMP_SECONDS)
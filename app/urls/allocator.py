@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import deque
+from dotenv import load_dotenv
+from sqlalchemy import Sequence, func, select, text
+from sqlalchemy.orm import Session
+
+from ..entities.url import URL, url_id_blocks
+
+load_dotenv()
+
+# ids leased per round trip, at most this many are skipped when a worker stops
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE") or 100)
+
+
+class IdBlockAllocator:
+    """
+    Hands out url ids leased in blocks off a Postgres sequence.
+
+    - one round trip leases block_size ids to this worker, nextval of an
+      increment 1 sequence, so an INSERT without an id takes one id only
+    - ids and short codes are known before the INSERT,
+      no flush round trip, no contention on the urls sequence
+    - ids of a block left unused when the worker stops are skipped
+    """
+
+    def __init__(self, sequence: Sequence, block_size: int):
+        self.sequence = sequence
+        self.block_size = block_size
+        self._ids: deque[int] = deque()
+        self._aligned = False
+        self._lock = threading.Lock()
+
+    def supported(self, db: Session) -> bool:
+        return db.get_bind().dialect.name == "postgresql"
+
+    def allocate(self, db: Session, count: int = 1) -> list[int]:
+        with self._lock:
+            missing = count - len(self._ids)
+            if missing > 0:
+                self._lease(db, -(-missing // self.block_size) * self.block_size)
+            return [self._ids.popleft() for _ in range(count)]
+
+    def _lease(self, db: Session, count: int) -> None:
+        """lease count ids in one round trip"""
+        if not self._aligned:
+            self._align(db)
+            self._aligned = True
+
+        self._ids.extend(
+            db.scalars(
+                select(self.sequence.next_value()).select_from(
+                    func.generate_series(1, count)
+                )
+            ).all()
+        )
+
+    def _align(self, db: Session) -> None:
+        """
+        Move the sequence past ids it never handed out (rows created
+        before the allocator existed), once per process.
+        Ids it handed out are never touched, so ids leased by other
+        workers stay valid.
+        """
+        name = self.sequence.name
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": name}
+        )
+
+        last_value, is_called = db.execute(
+            text(f"SELECT last_value, is_called FROM {name}")
+        ).one()
+        next_start = last_value + 1 if is_called else last_value
+
+        max_id = db.scalar(select(func.coalesce(func.max(URL.id), 0)))
+        if max_id >= next_start:
+            db.execute(select(func.setval(name, max_id + 1, False)))
+
+
+# one allocator per worker process
+id_allocator = IdBlockAllocator(url_id_blocks, ID_BLOCK_SIZE)
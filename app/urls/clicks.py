@@ -0,0 +1,204 @@
+import os
+import time
+import hashlib
+import asyncio
+import logging
+from typing import Mapping
+from collections import Counter
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+
+from ..database.cache import (
+    incr_clicks,
+    CLICK_EVENTS_MAX_LENGTH,
+    UNIQUE_CLICKS,
+    TRENDING_MAX_SIZE,
+)
+from ..monitoring.metrics import click_events_dropped
+
+load_dotenv()
+
+CLICK_FLUSH_INTERVAL_SECONDS = float(os.getenv("CLICK_FLUSH_INTERVAL_SECONDS", 1))
+# click events waiting for a flush, more are dropped
+CLICK_EVENTS_BUFFER_SIZE = int(os.getenv("CLICK_EVENTS_BUFFER_SIZE", 100000))
+# header a proxy or CDN sets to the visitor country, e.g. CF-IPCountry
+CLICK_COUNTRY_HEADER = os.getenv("CLICK_COUNTRY_HEADER", "cf-ipcountry").lower()
+
+"""
+Click event of a redirect, from its request headers, made at flush time,
+a redirect only queues the raw headers
+
+- referrer: host of the Referer, "" for a direct visit
+- user agent class: bot, mobile, desktop, or unknown without a User-Agent
+- country: two letters from CLICK_COUNTRY_HEADER, "" when absent
+"""
+BOT_MARKERS = ("bot", "crawl", "spider", "slurp", "curl", "wget", "python-")
+MOBILE_MARKERS = ("mobi", "android", "iphone", "ipad")
+
+
+def ua_class(user_agent: str) -> str:
+    user_agent = user_agent.lower()
+    if not user_agent:
+        return "unknown"
+    if any(marker in user_agent for marker in BOT_MARKERS):
+        return "bot"
+    if any(marker in user_agent for marker in MOBILE_MARKERS):
+        return "mobile"
+    return "desktop"
+
+
+def referrer_host(referrer: str) -> str:
+    try:
+        return (urlsplit(referrer).hostname or "")[:255]
+    except ValueError:
+        return ""
+
+
+def click_event(
+    short_code: str, timestamp: int, referrer: str, user_agent: str, country: str
+) -> dict:
+    return {
+        "c": short_code,
+        "t": timestamp,
+        "r": referrer_host(referrer),
+        "u": ua_class(user_agent),
+        "g": country.upper() if len(country) == 2 and country.isalpha() else "",
+    }
+
+
+def visitor_fingerprint(client_ip: str, user_agent: str) -> bytes:
+    """a visitor is a client address and user agent, hashed before Redis"""
+    return hashlib.blake2b(f"{client_ip} {user_agent}".encode(), digest_size=8).digest()
+
+
+class ClickBuffer:
+    """
+    Clicks served from the in-process cache are counted here, the click
+    events, visitors and trending counts of every redirect are buffered
+    here, all are flushed to Redis in one round trip per interval.
+
+    - the trending counts are per short code, like the clicks, never dropped
+    - visitors are deduplicated per (short_code, UTC midnight), at most
+      events_max distinct ones, the events are a list of at most events_max,
+      what doesn't fit is dropped and counted in click_events_dropped
+    - a flush that fails keeps everything for the next one
+
+    Only the event loop touches the buffer, so swapping the
+    counters in drain() needs no lock.
+    """
+
+    def __init__(self, events_max: int = CLICK_EVENTS_BUFFER_SIZE):
+        self._counts: Counter[str] = Counter()
+        self._trending: Counter[str] = Counter()
+        # (short_code, UTC midnight) -> visitor fingerprints
+        self._visitors: dict[tuple[str, int], set[bytes]] = {}
+        self._visitors_size = 0
+        # (short_code, timestamp, referrer, user agent, country)
+        self._events: list[tuple] = []
+        self.events_max = events_max if CLICK_EVENTS_MAX_LENGTH else 0
+        self.visitors_max = events_max if UNIQUE_CLICKS else 0
+
+    def add(self, short_code: str, count: int = 1) -> None:
+        self._counts[short_code] += count
+
+    def record(
+        self, short_code: str, headers: Mapping[str, str], client_ip: str = ""
+    ) -> None:
+        """buffer the click event, visitor and trending count of a redirect"""
+        if TRENDING_MAX_SIZE:
+            self._trending[short_code] += 1
+        if not self.events_max and not self.visitors_max:
+            return
+
+        timestamp = int(time.time())
+        user_agent = headers.get("user-agent", "")
+        if self.visitors_max:
+            self.add_visitor(
+                (short_code, timestamp - timestamp % 86400),
+                visitor_fingerprint(client_ip, user_agent),
+            )
+        if not self.events_max:
+            return
+        if len(self._events) >= self.events_max:
+            click_events_dropped.inc("event")
+            return
+        self._events.append(
+            (
+                short_code,
+                timestamp,
+                headers.get("referer", ""),
+                user_agent,
+                headers.get(CLICK_COUNTRY_HEADER, ""),
+            )
+        )
+
+    def add_visitor(self, key: tuple[str, int], fingerprint: bytes) -> None:
+        """a visitor seen already is free, a new one past visitors_max is dropped"""
+        known = self._visitors.get(key)
+        if known is not None and fingerprint in known:
+            return
+        if self._visitors_size >= self.visitors_max:
+            click_events_dropped.inc("visitor")
+            return
+        if known is None:
+            self._visitors[key] = {fingerprint}
+        else:
+            known.add(fingerprint)
+        self._visitors_size += 1
+
+    def drain(self) -> Counter[str]:
+        counts, self._counts = self._counts, Counter()
+        return counts
+
+    def drain_events(
+        self,
+    ) -> tuple[list[tuple], dict[tuple[str, int], set[bytes]], Counter[str]]:
+        """(events, visitors, trending counts) buffered since the last flush"""
+        events, self._events = self._events, []
+        visitors, self._visitors = self._visitors, {}
+        trending, self._trending = self._trending, Counter()
+        self._visitors_size = 0
+        return events, visitors, trending
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    async def flush(self) -> None:
+        counts = self.drain()
+        events, visitors, trending = self.drain_events()
+        if not counts and not events and not visitors and not trending:
+            return
+
+        try:
+            await incr_clicks(
+                counts,
+                [click_event(*event) for event in events],
+                visitors,
+                trending,
+            )
+        except Exception:
+            # keep everything for the next flush, the events up to events_max
+            self._counts.update(counts)
+            self._trending.update(trending)
+            for key, fingerprints in visitors.items():
+                for fingerprint in fingerprints:
+                    self.add_visitor(key, fingerprint)
+            events += self._events
+            if len(events) > self.events_max:
+                click_events_dropped.inc("event", amount=len(events) - self.events_max)
+            self._events = events[: self.events_max]
+            raise
+
+    async def run(self, interval: float = CLICK_FLUSH_INTERVAL_SECONDS) -> None:
+        """flush every interval seconds until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.warning(
+                    "Failed to flush %s buffered clicks. Error: %s", len(self), e
+                )
+
+
+click_buffer = ClickBuffer()
@@ -1,11 +1,11 @@
-from typing import List
-from fastapi import APIRouter, status
-from fastapi.responses import RedirectResponse
+from typing import Annotated, List, Literal
+from fastapi import APIRouter, Query, Request, Response, status
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 from . import model
 from . import service
 from ..auth.service import current_user
-from ..database.core import DbSession
+from ..database.core import DbSession, AsyncDbSession
 
 router = APIRouter()
 
@@ -15,22 +15,106 @@ router = APIRouter()
 async def short_url_private(
     current_user: current_user, db: DbSession, user_request: model.ShortUrlRequest
 ):
-    return service.register_url(db, user_request, current_user.get_uuid())
+    if user_request.dedup:
+        return service.register_url(db, user_request, current_user.get_uuid(), True)
+    return await service.create_url(user_request, current_user.get_uuid())
+
+
+# logged in user bulk short urls
+@router.post("/short-url/bulk")
+async def short_url_bulk(
+    current_user: current_user, db: DbSession, request: Request, dedup: bool = False
+):
+    """
+    - Content-Type: application/json -> [{"long_url": ...}, ...]
+    - Content-Type: application/x-ndjson -> {"long_url": ...} per line
+    - ?dedup=true reuses the short url of a long url the user already has
+    - streams back NDJSON, one result per url in input order
+    """
+    items = service.parse_bulk_request(
+        await request.body(), request.headers.get("content-type", "")
+    )
+    return StreamingResponse(
+        service.register_urls_bulk(db, items, current_user.get_uuid(), dedup=dedup),
+        media_type="application/x-ndjson",
+    )
 
 
 # public short url route
 @router.post("/short-url-public/", status_code=status.HTTP_201_CREATED)
 async def short_url_public(db: DbSession, user_request: model.ShortUrlRequest):
-    return service.register_url(db, user_request)
+    if user_request.dedup:
+        return service.register_url(db, user_request, dedup=True)
+    return await service.create_url(user_request)
 
 
-# list all current user shorted urls
+# a page of current user shorted urls, newest first
 @router.get("/list-urls/", response_model=List[model.ListUrlsResponse])
-async def list_urls(current_user: current_user, db: DbSession):
-    return service.list_urls(current_user, db)
+async def list_urls(
+    current_user: current_user,
+    db: DbSession,
+    response: Response,
+    limit: Annotated[
+        int, Query(ge=1, le=service.LIST_MAX_PAGE_SIZE)
+    ] = service.LIST_PAGE_SIZE,
+    cursor: str | None = None,
+):
+    """next page: ?cursor= the X-Next-Cursor header, absent on the last page"""
+    urls = service.list_urls(current_user, db, limit, cursor)
+    next_cursor = service.next_cursor(urls, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return urls
+
+
+# every current user url as one streamed file
+@router.get("/export-urls/")
+async def export_urls(
+    current_user: current_user,
+    db: DbSession,
+    fmt: Annotated[Literal["ndjson", "csv"], Query(alias="format")] = "ndjson",
+):
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        service.export_urls(db, current_user.get_uuid(), fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=urls.{fmt}"},
+    )
 
 
 # get a long url from short code
 @router.get("/get-url/{short_code}", response_class=RedirectResponse)
-async def get_long_url(db: DbSession, short_code: str):
-    return service.get_long_url(db, short_code)
+async def get_long_url(short_code: str, request: Request):
+    client_ip = request.client.host if request.client else ""
+    return await service.get_long_url(short_code, request.headers, client_ip)
+
+
+# hottest links of the last 5 minutes, hour or day
+@router.get("/trending", response_model=List[model.TrendingUrl])
+async def trending(
+    current_user: current_user,
+    db: AsyncDbSession,
+    window: Literal["5m", "1h", "24h"] = "1h",
+    limit: Annotated[int, Query(ge=1, le=service.TRENDING_TOP_MAX)] = 10,
+):
+    return await service.get_trending(db, current_user.get_uuid(), window, limit)
+
+
+# clicks of a url per hour or day, from the rollups
+@router.get("/{short_code}/stats", response_model=model.UrlStatsResponse)
+async def url_stats(
+    current_user: current_user,
+    db: DbSession,
+    short_code: str,
+    granularity: Literal["hour", "day"] = "hour",
+    buckets: Annotated[int, Query(ge=1, le=service.STATS_MAX_BUCKETS)] = 24,
+):
+    return service.get_url_stats(
+        db, short_code, current_user.get_uuid(), granularity, buckets
+    )
+
+
+# delete a current user url
+@router.delete("/delete-url/{short_code}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_url(current_user: current_user, db: DbSession, short_code: str):
+    service.delete_url(db, short_code, current_user.get_uuid())
@@ -4,9 +4,13 @@ from pydantic import BaseModel, HttpUrl, ConfigDict
 
 
 class ShortUrlRequest(BaseModel):
-    """2083 len charecter http/https"""
+    """
+    2083 len charecter http/https
+    dedup: return the existing short url if this user already shortened long_url
+    """
 
     long_url: HttpUrl
+    dedup: bool = False
 
 
 class ShortUrlResponse(BaseModel):
@@ -19,6 +23,40 @@ class ListUrlsResponse(BaseModel):
     long_url: str
     short_code: str
     clicks: int
+    # approximate, as of the last click sync
+    unique_clicks: int
     created_at: datetime
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class ClickCount(BaseModel):
+    bucket: datetime
+    clicks: int
+    # approximate unique visitors of a day, None per hour
+    unique_clicks: int | None = None
+
+
+class UrlStatsResponse(BaseModel):
+    """
+    clicks of a url per hour or day since the first bucket
+    referrers, ua_classes, countries: top values over the same window,
+    "" for a direct visit or an unknown country
+    """
+
+    short_code: str
+    granularity: str
+    since: datetime
+    clicks: int
+    series: list[ClickCount]
+    referrers: dict[str, int]
+    ua_classes: dict[str, int]
+    countries: dict[str, int]
+
+
+class TrendingUrl(BaseModel):
+    """score: clicks, each one halved for every window since it happened"""
+
+    short_code: str
+    long_url: str
+    score: float
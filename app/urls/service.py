@@ -1,74 +1,597 @@
+import io
 import os
+import csv
+import json
+import time
+import redis
+import asyncio
 import logging
 from uuid import UUID
-from typing import List
+from datetime import datetime, timezone
+from typing import Iterator, List, Mapping
 from dotenv import load_dotenv
+from pydantic import ValidationError
+from sqlalchemy import bindparam, delete, desc, func, insert, select, tuple_, update
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.responses import RedirectResponse
 
 from . import model
+from .clicks import click_buffer
+from .utils import (
+    encode_base62,
+    decode_base62,
+    is_short_code,
+    hash_url,
+    encode_cursor,
+    decode_cursor,
+)
+from .allocator import id_allocator
 from ..entities.url import URL
+from ..entities.redis_outbox import RedisOutbox
+from ..entities.click_rollup import (
+    ClickRollupHourly,
+    ClickRollupDaily,
+    ClickUniquesDaily,
+)
+from ..monitoring.metrics import (
+    redirect_seconds,
+    urls_created,
+    urls_listed,
+    url_loads,
+    url_cache_lookups,
+    bloom_false_negatives,
+)
 from ..auth.model import TokenData
-from ..database.cache import redis_client
-from ..exceptions import InternalServerError, UrlNotFoundError
-
+from ..database.memory_cache import TTLCache, SingleFlight, Batcher
+from ..database.core import SessionLocal, AsyncSessionLocal
+from ..database.cache import (
+    publish,
+    subscribe,
+    get_url_and_count,
+    cache_url_and_count,
+    cache_missing,
+    take_url_lease,
+    peek_url,
+    peek_urls,
+    trending_urls,
+    URL_LEASE_SECONDS,
+    TRENDING_MAX_SIZE,
+    remember_urls,
+    drop_url,
+    URL_MISSING,
+    URL_NOT_IN_BLOOM,
+    URL_INVALIDATION_CHANNEL,
+)
+from ..exceptions import (
+    InternalServerError,
+    UrlNotFoundError,
+    UrlCursorError,
+    UrlBulkPayloadError,
+    UrlBulkTooLargeError,
+)
 
 load_dotenv()
 
 SERVER_ADDRESS = os.getenv("SERVER_ADDRESS")
-CLICKS_EXPIRE_SECONDS = os.getenv("CLICKS_EXPIRE_SECONDS")
 SHORTCODE_EXPIRE_SECONDS = os.getenv("SHORTCODE_EXPIRE_SECONDS")
+URL_CACHE_MAX_SIZE = int(os.getenv("URL_CACHE_MAX_SIZE", 10000))
+URL_CACHE_TTL_SECONDS = float(os.getenv("URL_CACHE_TTL_SECONDS", 60))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 100000))
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 1000))
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", 100))
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", 1000))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# a miss looks the url up by its primary key, decode_base62(short_code)
+URL_LOOKUP_BY_ID = os.getenv("URL_LOOKUP_BY_ID", "false").lower() == "true"
+STATS_MAX_BUCKETS = int(os.getenv("STATS_MAX_BUCKETS", 744))
+STATS_TOP = int(os.getenv("STATS_TOP", 10))
+# GET /urls/trending?limit=, the codes read before the visible ones are kept
+TRENDING_TOP_MAX = 100
+# hottest codes of the last 5 minutes kept in url_cache of every worker (0 disables)
+TRENDING_WARM_SIZE = int(os.getenv("TRENDING_WARM_SIZE", 100))
+TRENDING_WARM_SECONDS = float(os.getenv("TRENDING_WARM_SECONDS", 10))
+# concurrent creates of a worker share one INSERT and one commit
+CREATE_BATCH_SIZE = int(os.getenv("CREATE_BATCH_SIZE", 100))
+CREATE_BATCH_WAIT_SECONDS = float(os.getenv("CREATE_BATCH_WAIT_SECONDS", 0.002))
+
+# urls.id is an INTEGER, a longer code can't be an id
+MAX_URL_ID = 2**31 - 1
+
+# list and export columns, plain rows instead of ORM objects
+LIST_COLUMNS = (
+    URL.id,
+    URL.user_id,
+    URL.long_url,
+    URL.short_code,
+    URL.clicks,
+    URL.unique_clicks,
+    URL.created_at,
+)
+
+# in-process short_code -> long_url, hot links resolve without a network hop
+url_cache = TTLCache(maxsize=URL_CACHE_MAX_SIZE, ttl=URL_CACHE_TTL_SECONDS)
+
+# a url changed or deleted on any worker drops it here too
+subscribe(URL_INVALIDATION_CHANNEL, url_cache.delete, on_reset=url_cache.clear)
+
+# concurrent misses of a code in this worker share one load
+url_loads_in_flight = SingleFlight()
+URL_LEASE_POLL_SECONDS = float(os.getenv("URL_LEASE_POLL_SECONDS") or 0.02)
+
+
+async def get_long_url(
+    short_code: str,
+    headers: Mapping[str, str] | None = None,
+    client_ip: str = "",
+) -> RedirectResponse:
+    """
+    take short_code for long_url lookup, never blocks the event loop
+    a miss loads on a session of its own, see load_in_session
+    headers: of the request, referrer, user agent and country of the
+    click event, queued and sent to Redis with the buffered clicks
+    client_ip: with the user agent, the visitor of the unique clicks
+
+    Redis down, slow or its circuit open: the database and url_cache
+    answer, the clicks stay in click_buffer until Redis is back
+    """
 
+    start = time.perf_counter()
+    headers = headers or {}
 
-def get_long_url(db: Session, short_code: str) -> RedirectResponse:
-    """take short_code for long_url lookup"""
+    # not a code this service makes, no cache or database lookup
+    if not is_short_code(short_code):
+        redirect_seconds.observe(time.perf_counter() - start, "invalid")
+        raise UrlNotFoundError(short_code)
+
+    # a delete seen while this lookup runs keeps its result out of url_cache
+    generation = url_cache.generation
 
-    # check Redis first
-    cached_url = redis_client.get(short_code)
-    if cached_url:
-        # Redis: clicks += 1
-        redis_client.incr(f"clicks:{short_code}")
+    # in-process cache first, clicks are flushed to Redis in batches
+    long_url = url_cache.get(short_code)
+    if long_url is not None:
+        click_buffer.add(short_code)
+        click_buffer.record(short_code, headers, client_ip)
+        url_cache_lookups.inc("memory", "hit")
+        redirect_seconds.observe(time.perf_counter() - start, "memory")
+        return RedirectResponse(long_url, status_code=307)
+    url_cache_lookups.inc("memory", "miss")
 
-        # also mark this shortcode as "dirty" (needs syncing)
-        redis_client.sadd("dirty_clicks", short_code)
+    # check Redis, a hit also counts the click and extends the TTL
+    # in the same round trip
+    loader = load_url
+    try:
+        cached_url = await get_url_and_count(short_code, SHORTCODE_EXPIRE_SECONDS)
+    except redis.RedisError as e:
+        logging.warning(
+            "Redis unavailable, %s read from the database. Error: %s", short_code, e
+        )
+        cached_url, loader = None, load_url_from_database
+    if isinstance(cached_url, str):
+        url_cache.set(short_code, cached_url, generation=generation)
+        click_buffer.record(short_code, headers, client_ip)
+        url_cache_lookups.inc("redis", "hit")
+        redirect_seconds.observe(time.perf_counter() - start, "redis")
         return RedirectResponse(cached_url, status_code=307)
 
-    # cache miss
-    url = db.query(URL).filter(URL.short_code == short_code).first()
+    # known missing, no database query
+    if cached_url == URL_MISSING:
+        redirect_seconds.observe(time.perf_counter() - start, "negative")
+        logging.warning("%s corresponding long url not found", short_code)
+        raise UrlNotFoundError(short_code)
+
+    # not in the Bloom filter, most likely unknown, but a code whose Redis
+    # write failed or was lost in a failover is missing from it too, the
+    # database confirms and missing:short_code answers the next lookups
+    if cached_url == URL_NOT_IN_BLOOM:
+        url_cache_lookups.inc("redis", "bloom")
+    else:
+        url_cache_lookups.inc("redis", "miss" if loader is load_url else "error")
+
+    # cache miss, one load for every request of this worker that missed
+    try:
+        (long_url, source), leader = await url_loads_in_flight.do(
+            short_code, lambda: load_in_session(loader, short_code)
+        )
+    except UrlNotFoundError:
+        tier = "bloom" if cached_url == URL_NOT_IN_BLOOM else "not_found"
+        redirect_seconds.observe(time.perf_counter() - start, tier)
+        logging.warning("%s corresponding long url not found", short_code)
+        raise
+
+    # the load cached the url and added it back to the Bloom filter
+    if leader and cached_url == URL_NOT_IN_BLOOM and source == "database":
+        bloom_false_negatives.inc()
+        logging.warning("%s was missing from the Bloom filter", short_code)
+
+    # the database load counted its click while caching the url
+    if not (leader and source == "database"):
+        click_buffer.add(short_code)
+    click_buffer.record(short_code, headers, client_ip)
+    url_cache.set(short_code, long_url, generation=generation)
+    tier = source if leader else "coalesced"
+    redirect_seconds.observe(time.perf_counter() - start, tier)
+
+    return RedirectResponse(long_url, status_code=307)
+
+
+async def load_in_session(loader, short_code: str) -> tuple[str, str]:
+    """
+    the single-flight load on a session it opens and closes, not on the
+    session of the request that leads it, the waiting requests don't
+    depend on that request and its session is never used concurrently
+    """
+    async with AsyncSessionLocal() as db:
+        return await loader(db, short_code)
+
+
+async def load_url(db: AsyncSession, short_code: str) -> tuple[str, str]:
+    """
+    long_url of a missed code and where it came from, raises UrlNotFoundError
+    - "database": this worker holds the lease, read and cached it
+    - "lease": another worker held it, its result was read from Redis
+    - "fallback": Redis failed on the way, read from the database alone
+    """
+    try:
+        return await load_url_with_lease(db, short_code)
+    except redis.RedisError as e:
+        logging.warning(
+            "Redis unavailable, %s read from the database. Error: %s", short_code, e
+        )
+        return await load_url_from_database(db, short_code)
+
+
+async def load_url_from_database(db: AsyncSession, short_code: str) -> tuple[str, str]:
+    """long_url without Redis, no lease, nothing cached but url_cache"""
+    url_loads.inc("fallback")
+    url = await find_long_url(db, short_code)
     if url is None:
-        logging.warning(f"{short_code} corresponding long url not found")
         raise UrlNotFoundError(short_code)
+    return url.long_url, "fallback"
+
+
+async def load_url_with_lease(db: AsyncSession, short_code: str) -> tuple[str, str]:
+    """load_url while Redis answers"""
+    deadline = time.monotonic() + URL_LEASE_SECONDS
+    while not await take_url_lease(short_code):
+        # another worker reads the database, wait for what it caches
+        await asyncio.sleep(URL_LEASE_POLL_SECONDS)
+        cached_url = await peek_url(short_code)
+        if isinstance(cached_url, str):
+            url_loads.inc("lease")
+            return cached_url, "lease"
+        if cached_url is not None:
+            raise UrlNotFoundError(short_code)
+        if time.monotonic() >= deadline:
+            # the lease holder is slow or gone, read it anyway
+            break
+
+    url_loads.inc("database")
+    url = await find_long_url(db, short_code)
+    if url is None:
+        # the next lookups of this code stop at Redis
+        await cache_missing(short_code)
+        raise UrlNotFoundError(short_code)
+
+    # if cache miss than store, one script call
+    # short_code -> long_url, clicks delta += this click
+    # unless the url was deleted since it was read
+    if not await cache_url_and_count(
+        short_code, str(url.long_url), SHORTCODE_EXPIRE_SECONDS
+    ):
+        logging.warning("%s deleted while it was looked up", short_code)
+        raise UrlNotFoundError(short_code)
+    return url.long_url, "database"
+
+
+async def find_long_url(db: AsyncSession, short_code: str):
+    """
+    row with long_url, or None
+    URL_LOOKUP_BY_ID: primary key lookup, short_code is encode_base62(id)
+    """
+    if not URL_LOOKUP_BY_ID:
+        result = await db.execute(
+            select(URL.long_url).where(URL.short_code == short_code)
+        )
+        return result.first()
+
+    url_id = decode_base62(short_code)
+    if url_id > MAX_URL_ID:
+        return None
+    result = await db.execute(
+        select(URL.long_url).where(URL.id == url_id, URL.short_code == short_code)
+    )
+    return result.first()
+
+
+ROLLUPS = {"hour": (ClickRollupHourly, 3600), "day": (ClickRollupDaily, 86400)}
+
+
+def get_url_stats(
+    db: Session,
+    short_code: str,
+    user_id: UUID,
+    granularity: str = "hour",
+    buckets: int = 24,
+) -> model.UrlStatsResponse:
+    """
+    clicks of the last buckets hours or days, from the rollup tables only
+    a url of another user is not found, a public url is anyone's
+    """
+    owner = db.execute(select(URL.user_id).where(URL.short_code == short_code)).first()
+    if owner is None or owner.user_id not in (None, user_id):
+        logging.warning("%s stats not found for user_id: %s", short_code, user_id)
+        raise UrlNotFoundError(short_code)
+
+    table, seconds = ROLLUPS[granularity]
+    now = int(time.time())
+    since = datetime.fromtimestamp(
+        now - now % seconds - (buckets - 1) * seconds, timezone.utc
+    )
+    window = (table.short_code == short_code, table.bucket >= since)
+    clicks = func.sum(table.clicks).label("clicks")
+
+    series = db.execute(
+        select(table.bucket, clicks)
+        .where(*window)
+        .group_by(table.bucket)
+        .order_by(table.bucket)
+    ).all()
+
+    def top(column) -> dict[str, int]:
+        rows = db.execute(
+            select(column, clicks)
+            .where(*window)
+            .group_by(column)
+            .order_by(desc("clicks"))
+            .limit(STATS_TOP)
+        )
+        return {value: total for value, total in rows}
+
+    # approximate unique visitors per day, snapshots of the click sync
+    uniques = {}
+    if granularity == "day":
+        rows = db.execute(
+            select(ClickUniquesDaily.bucket, ClickUniquesDaily.visitors).where(
+                ClickUniquesDaily.short_code == short_code,
+                ClickUniquesDaily.bucket >= since,
+            )
+        )
+        uniques = dict(rows.all())
+
+    return model.UrlStatsResponse(
+        short_code=short_code,
+        granularity=granularity,
+        since=since,
+        clicks=sum(row.clicks for row in series),
+        series=[
+            {
+                "bucket": row.bucket,
+                "clicks": row.clicks,
+                "unique_clicks": (
+                    uniques.get(row.bucket, 0) if granularity == "day" else None
+                ),
+            }
+            for row in series
+        ],
+        referrers=top(table.referrer),
+        ua_classes=top(table.ua_class),
+        countries=top(table.country),
+    )
+
+
+async def get_trending(
+    db: AsyncSession, user_id: UUID, window: str = "1h", limit: int = 10
+) -> List[model.TrendingUrl]:
+    """
+    hottest links of the window, by clicks decayed by half every window
+    only the links of current user and public ones, like their stats
+    """
+    scores = await trending_urls(window, TRENDING_TOP_MAX)
+    if not scores:
+        return []
+
+    rows = await db.execute(
+        select(URL.short_code, URL.long_url, URL.user_id).where(
+            URL.short_code.in_([short_code for short_code, _ in scores])
+        )
+    )
+    visible = {
+        row.short_code: row.long_url for row in rows if row.user_id in (None, user_id)
+    }
+    return [
+        model.TrendingUrl(
+            short_code=short_code, long_url=visible[short_code], score=round(score, 3)
+        )
+        for short_code, score in scores
+        if short_code in visible
+    ][:limit]
+
+
+async def warm_trending(size: int = TRENDING_WARM_SIZE) -> int:
+    """
+    the hottest codes of the last 5 minutes missing from url_cache, read
+    from Redis in one pipeline, their next redirects need no network hop
+    returns how many were added
+    """
+    generation = url_cache.generation
+    short_codes = [
+        short_code
+        for short_code, _ in await trending_urls("5m", size)
+        if short_code not in url_cache
+    ]
+    if not short_codes:
+        return 0
+
+    long_urls = await peek_urls(short_codes)
+    for short_code, long_url in long_urls.items():
+        url_cache.set(short_code, long_url, generation=generation)
+    return len(long_urls)
+
+
+async def run_trending_warmer(interval: float = TRENDING_WARM_SECONDS) -> None:
+    """warm_trending every interval seconds until cancelled"""
+    if not TRENDING_WARM_SIZE or not TRENDING_MAX_SIZE or not url_cache.maxsize:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await warm_trending()
+        except Exception as e:
+            logging.warning("Failed to warm trending urls. Error: %s", e)
+
+
+def list_urls(
+    current_user: TokenData,
+    db: Session,
+    limit: int = LIST_PAGE_SIZE,
+    cursor: str | None = None,
+) -> List[model.ListUrlsResponse]:
+    """
+    a page of current user urls, newest first
+    cursor: next_cursor of the previous page, keyset on (created_at, id)
+    so every page is one range scan of ix_urls_user_id_created_at_id
+    """
+    query = (
+        select(*LIST_COLUMNS)
+        .where(URL.user_id == current_user.get_uuid())
+        .order_by(URL.created_at.desc(), URL.id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        try:
+            created_at, url_id = decode_cursor(cursor)
+        except ValueError:
+            raise UrlCursorError()
+        query = query.where(tuple_(URL.created_at, URL.id) < (created_at, url_id))
+    urls = db.execute(query).all()
+    urls_listed.inc(amount=len(urls))
+    return urls
+
+
+def next_cursor(urls: list, limit: int) -> str | None:
+    """cursor after the last url of a full page, None on the last page"""
+    if len(urls) < limit:
+        return None
+    return encode_cursor(urls[-1].created_at, urls[-1].id)
+
+
+def export_value(value):
+    """JSON and CSV friendly column value"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+def export_urls(db: Session, user_id: UUID, fmt: str = "ndjson") -> Iterator[str]:
+    """
+    every url of a user as NDJSON or CSV, newest first
+    rows come from a server-side cursor EXPORT_BATCH_SIZE at a time,
+    the whole result is never in memory
+
+    runs while the response streams, so the session is closed here
+    """
+    fields = [column.key for column in LIST_COLUMNS]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    try:
+        if fmt == "csv":
+            writer.writerow(fields)
+            yield buffer.getvalue()
+
+        result = db.execute(
+            select(*LIST_COLUMNS)
+            .where(URL.user_id == user_id)
+            .order_by(URL.created_at.desc(), URL.id.desc())
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        exported = 0
+        for rows in result.partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            for row in rows:
+                values = [export_value(value) for value in row]
+                if fmt == "csv":
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(fields, values))) + "\n")
+            exported += len(rows)
+            yield buffer.getvalue()
+        logging.info("Exported %s urls of user_id: %s", exported, user_id)
+    finally:
+        db.close()
+
+
+def owned_by(user_id: UUID | None):
+    """public urls have no user, user_id = NULL never matches"""
+    return URL.user_id.is_(None) if user_id is None else URL.user_id == user_id
 
-    # if cache miss than store
-    # short_code -> long_url
-    redis_client.set(short_code, str(url.long_url), ex=SHORTCODE_EXPIRE_SECONDS)
-    # clicks -> url.clicks
-    redis_client.set(f"clicks:{short_code}", url.clicks + 1, ex=CLICKS_EXPIRE_SECONDS)
 
-    return RedirectResponse(url.long_url, status_code=307)
+def find_short_code(db: Session, url_hash: str, user_id: UUID | None) -> str | None:
+    """existing short code of the same url, one lookup on (user_id, url_hash)"""
+    return db.scalars(
+        select(URL.short_code)
+        .where(owned_by(user_id), URL.url_hash == url_hash)
+        .order_by(URL.id)
+        .limit(1)
+    ).first()
 
 
-def list_urls(current_user: TokenData, db: Session) -> List[model.ListUrlsResponse]:
-    """list all urls of current user"""
-    return db.query(URL).filter(URL.user_id == current_user.get_uuid()).all()
+def find_short_codes(
+    db: Session, url_hashes: list[str], user_id: UUID | None
+) -> dict[str, str]:
+    """url_hash -> existing short code for a chunk, one IN lookup"""
+    rows = db.execute(
+        select(URL.url_hash, URL.short_code)
+        .where(owned_by(user_id), URL.url_hash.in_(set(url_hashes)))
+        .order_by(URL.id.desc())
+    )
+    # oldest row wins, same as find_short_code
+    return {url_hash: short_code for url_hash, short_code in rows}
 
 
 def register_url(
-    db: Session, user_request: model.ShortUrlRequest, user_id: UUID | None = None
+    db: Session,
+    user_request: model.ShortUrlRequest,
+    user_id: UUID | None = None,
+    dedup: bool = False,
 ) -> model.ShortUrlResponse:
-    """create a url in database"""
+    """
+    create a url in database
+    dedup: if this user already has long_url, return that short url instead
+    """
     try:
         long_url = str(user_request.long_url)
-        create_url = URL(user_id=user_id, long_url=long_url)
-        db.add(create_url)
-        db.flush()
-        create_url.generate_short_code()
+        url_hash = hash_url(long_url)
+
+        if dedup:
+            short_code = find_short_code(db, url_hash, user_id)
+            if short_code is not None:
+                logging.info("Existing url returned")
+                return model.ShortUrlResponse(
+                    short_code=f"{SERVER_ADDRESS}/urls/get-url/{short_code}"
+                )
+
+        create_url = URL(user_id=user_id, long_url=long_url, url_hash=url_hash)
+
+        if id_allocator.supported(db):
+            # id from this worker's leased block, one INSERT
+            create_url.id = id_allocator.allocate(db)[0]
+            create_url.generate_short_code()
+            db.add(create_url)
+        else:
+            # autoincrement id, flush to get it before the code exists
+            db.add(create_url)
+            db.flush()
+            create_url.generate_short_code()
         db.commit()
+        urls_created.inc()
 
-        # Redis: short_code -> long_url
-        redis_client.set(create_url.short_code, long_url, ex=SHORTCODE_EXPIRE_SECONDS)
-        # Redis: clicks:short_code -> click count
-        redis_client.set(f"clicks:{create_url.short_code}", 0, ex=CLICKS_EXPIRE_SECONDS)
+        # Redis: short_code -> long_url, added to the Bloom filter
+        # clicks:short_code is created by the first click
+        remember_or_record(db, {create_url.short_code: long_url})
 
         logging.info("Successfully new url created")
         return model.ShortUrlResponse(
@@ -76,5 +599,290 @@ def register_url(
         )
     except Exception as e:
         db.rollback()
-        logging.error(f"Failed to create url. Error: {str(e)}")
+        logging.error("Failed to create url. Error: %s", e)
+        raise InternalServerError()
+
+
+def create_url_batch(items: list[tuple[str, UUID | None]]) -> list[str]:
+    """
+    (long_url, user_id) pairs -> short codes in the same order, one
+    multi-row INSERT per user, one commit, one Redis round trip
+    """
+    db = SessionLocal()
+    try:
+        positions: dict[UUID | None, list[int]] = {}
+        for position, (_, user_id) in enumerate(items):
+            positions.setdefault(user_id, []).append(position)
+
+        codes = [""] * len(items)
+        try:
+            for user_id, group in positions.items():
+                long_urls = [items[position][0] for position in group]
+                for position, code in zip(group, insert_urls(db, long_urls, user_id)):
+                    codes[position] = code
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        urls_created.inc(amount=len(items))
+
+        remember_or_record(
+            db, {code: long_url for code, (long_url, _) in zip(codes, items)}
+        )
+        logging.info("%s urls created in one batch", len(items))
+        return codes
+    finally:
+        db.close()
+
+
+create_batcher = Batcher(create_url_batch, CREATE_BATCH_SIZE, CREATE_BATCH_WAIT_SECONDS)
+
+
+async def create_url(
+    user_request: model.ShortUrlRequest, user_id: UUID | None = None
+) -> model.ShortUrlResponse:
+    """
+    register_url without dedup, the event loop never waits for the
+    database, concurrent creates of this worker share one commit
+    """
+    try:
+        short_code = await create_batcher.submit((str(user_request.long_url), user_id))
+    except Exception as e:
+        logging.error("Failed to create url. Error: %s", e)
         raise InternalServerError()
+    return model.ShortUrlResponse(
+        short_code=f"{SERVER_ADDRESS}/urls/get-url/{short_code}"
+    )
+
+
+def parse_bulk_request(body: bytes, content_type: str) -> list:
+    """
+    JSON array of {"long_url": ...} or NDJSON, one object per line
+    NDJSON lines stay raw bytes, each one is parsed while validating
+    so a broken line is an error of that item only
+    """
+    try:
+        if "ndjson" in content_type:
+            items = [line for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+    except ValueError:
+        raise UrlBulkPayloadError()
+
+    if not isinstance(items, list):
+        raise UrlBulkPayloadError()
+    if len(items) > BULK_MAX_ITEMS:
+        raise UrlBulkTooLargeError(BULK_MAX_ITEMS)
+    return items
+
+
+def validate_bulk_item(item) -> str:
+    """long_url of a bulk item, raises ValidationError"""
+    if isinstance(item, (bytes, str)):
+        return str(model.ShortUrlRequest.model_validate_json(item).long_url)
+    return str(model.ShortUrlRequest.model_validate(item).long_url)
+
+
+def insert_urls(db: Session, long_urls: list[str], user_id: UUID | None) -> list[str]:
+    """multi-row INSERT of a chunk, returns the short codes in the same order"""
+    if id_allocator.supported(db):
+        # codes computed up front from leased ids
+        ids = id_allocator.allocate(db, len(long_urls))
+        rows = [
+            {
+                "id": i,
+                "user_id": user_id,
+                "long_url": u,
+                "url_hash": hash_url(u),
+                "short_code": encode_base62(i),
+            }
+            for i, u in zip(ids, long_urls)
+        ]
+        db.execute(insert(URL), rows)
+        return [row["short_code"] for row in rows]
+
+    # INSERT ... RETURNING id, then the codes in one executemany
+    ids = db.scalars(
+        insert(URL).returning(URL.id, sort_by_parameter_order=True),
+        [
+            {"user_id": user_id, "long_url": u, "url_hash": hash_url(u)}
+            for u in long_urls
+        ],
+    ).all()
+    codes = [encode_base62(i) for i in ids]
+
+    urls = URL.__table__
+    db.execute(
+        update(urls)
+        .where(urls.c.id == bindparam("b_id"))
+        .values(short_code=bindparam("b_code")),
+        [{"b_id": i, "b_code": code} for i, code in zip(ids, codes)],
+    )
+    return codes
+
+
+def register_url_chunk(
+    db: Session, items: list, user_id: UUID | None, dedup: bool = False
+) -> list[dict]:
+    """
+    validate, insert and cache a chunk, one result per item
+    dedup: urls the user already has, or repeated in the chunk, reuse one code
+    """
+    results: list[dict] = [{} for _ in items]
+    valid: list[tuple[int, str]] = []
+
+    for position, item in enumerate(items):
+        try:
+            valid.append((position, validate_bulk_item(item)))
+        except ValidationError as e:
+            results[position] = {"error": e.errors()[0]["msg"]}
+
+    # one url to insert -> every position that gets its code
+    new: list[tuple[int, str]] = []
+    same: dict[int, list[int]] = {}
+    if dedup and valid:
+        hashes = [hash_url(long_url) for _, long_url in valid]
+        try:
+            existing = find_short_codes(db, hashes, user_id)
+        except Exception as e:
+            db.rollback()
+            logging.error("Failed to look up %s bulk urls. Error: %s", len(valid), e)
+            existing = None
+
+        first: dict[str, int] = {}
+        for (position, long_url), url_hash in zip(valid, hashes):
+            if existing is None:
+                results[position] = {"error": "An unexpected error occurred"}
+            elif url_hash in existing:
+                code = existing[url_hash]
+                results[position] = {
+                    "short_code": f"{SERVER_ADDRESS}/urls/get-url/{code}"
+                }
+            elif url_hash in first:
+                same[first[url_hash]].append(position)
+            else:
+                first[url_hash] = position
+                same[position] = [position]
+                new.append((position, long_url))
+    else:
+        new = valid
+
+    if not new:
+        return results
+
+    try:
+        codes = insert_urls(db, [long_url for _, long_url in new], user_id)
+        db.commit()
+        urls_created.inc(amount=len(codes))
+    except Exception as e:
+        db.rollback()
+        logging.error("Failed to create %s bulk urls. Error: %s", len(new), e)
+        for position, _ in new:
+            for target in same.get(position, [position]):
+                results[target] = {"error": "An unexpected error occurred"}
+        return results
+
+    remember_or_record(db, {code: long_url for code, (_, long_url) in zip(codes, new)})
+
+    for code, (position, _) in zip(codes, new):
+        for target in same.get(position, [position]):
+            results[target] = {"short_code": f"{SERVER_ADDRESS}/urls/get-url/{code}"}
+    return results
+
+
+def register_urls_bulk(
+    db: Session,
+    items: list,
+    user_id: UUID | None = None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    dedup: bool = False,
+) -> Iterator[str]:
+    """
+    create urls chunk by chunk, one NDJSON line per item in input order
+    {"index": 0, "short_code": "..."} or {"index": 1, "error": "..."}
+
+    runs while the response streams, after the request dependencies
+    are closed, so the session is closed here once done
+    """
+    created = 0
+    try:
+        for offset in range(0, len(items), chunk_size):
+            chunk = items[offset : offset + chunk_size]
+            for index, result in enumerate(
+                register_url_chunk(db, chunk, user_id, dedup), offset
+            ):
+                created += "short_code" in result
+                yield json.dumps({"index": index, **result}) + "\n"
+    finally:
+        db.close()
+        logging.info("Bulk request: %s of %s urls created", created, len(items))
+
+
+def remember_or_record(db: Session, urls: dict[str, str]) -> None:
+    """
+    Redis: the new urls, or the outbox when Redis fails, replayed once it
+    is back; a url not cached meanwhile is read from the database by its
+    first redirect
+    """
+    try:
+        remember_urls(urls, SHORTCODE_EXPIRE_SECONDS)
+    except redis.RedisError as e:
+        logging.warning(
+            "Failed to cache %s urls, replayed later. Error: %s", len(urls), e
+        )
+        try:
+            db.add_all(
+                RedisOutbox(op="remember", key=short_code, value=long_url)
+                for short_code, long_url in urls.items()
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.error("Failed to record %s urls. Error: %s", len(urls), e)
+
+
+def delete_url(db: Session, short_code: str, user_id: UUID) -> None:
+    """delete a url of current user and every cached copy of it"""
+    url = (
+        db.query(URL)
+        .filter(URL.short_code == short_code, URL.user_id == user_id)
+        .first()
+    )
+    if url is None:
+        logging.warning("%s not found for user_id: %s", short_code, user_id)
+        raise UrlNotFoundError(short_code)
+
+    # the drop is recorded with the delete, replayed if Redis fails,
+    # a create not replayed yet never caches the url again
+    drop = RedisOutbox(op="drop", key=short_code)
+    try:
+        db.execute(
+            delete(RedisOutbox).where(
+                RedisOutbox.op == "remember", RedisOutbox.key == short_code
+            )
+        )
+        db.add(drop)
+        db.delete(url)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logging.error("Failed to delete url %s. Error: %s", short_code, e)
+        raise InternalServerError()
+
+    # this worker, Redis, then every other worker through pub/sub
+    url_cache.delete(short_code)
+    try:
+        drop_url(short_code)
+        publish(URL_INVALIDATION_CHANNEL, short_code)
+    except redis.RedisError as e:
+        logging.warning(
+            "Failed to drop %s from Redis, replayed later. Error: %s", short_code, e
+        )
+        return
+    try:
+        db.delete(drop)
+        db.commit()
+    except Exception as e:
+        # replayed once more, harmless
+        db.rollback()
+        logging.warning("Failed to clear the drop of %s. Error: %s", short_code, e)
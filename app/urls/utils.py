@@ -1,4 +1,8 @@
+import base64
 import string
+import hashlib
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit
 
 """
 Digits: 0-9
@@ -9,6 +13,12 @@ Uppercase letters: A-Z
 """
 BASE62 = string.digits + string.ascii_letters
 
+# byte of a BASE62 char -> its digit, decode without a search per char
+BASE62_DIGITS = {ord(c): digit for digit, c in enumerate(BASE62)}
+
+# urls.short_code is a String(10)
+SHORT_CODE_MAX_LENGTH = 10
+
 
 def encode_base62(num: int) -> str:
     if num == 0:
@@ -23,8 +33,70 @@ def encode_base62(num: int) -> str:
 
 
 def decode_base62(s: str) -> int:
+    """raises ValueError for an empty string or a char outside BASE62"""
+    if not (s.isascii() and s.isalnum()):
+        raise ValueError(f"not a base62 string: {s!r}")
     num = 0
-    base = len(BASE62)
-    for c in s:
-        num = num * base + BASE62.index(c)
+    for b in s.encode():
+        num = num * 62 + BASE62_DIGITS[b]
     return num
+
+
+def is_short_code(s: str) -> bool:
+    """
+    a code encode_base62 could have made, checked before any I/O
+    - 1 to SHORT_CODE_MAX_LENGTH chars of BASE62
+    - no leading 0, "01" would decode to the id of "1"
+    """
+    return (
+        0 < len(s) <= SHORT_CODE_MAX_LENGTH
+        and s.isascii()
+        and s.isalnum()
+        and (s[0] != "0" or s == "0")
+    )
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    same link, same string
+    - lowercase scheme and host
+    - no default port
+    - empty path -> /
+    the fragment stays, single page apps route on it
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if parts.username or parts.password:
+        userinfo = parts.username or ""
+        if parts.password:
+            userinfo = f"{userinfo}:{parts.password}"
+        host = f"{userinfo}@{host}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, parts.fragment))
+
+
+def hash_url(url: str) -> str:
+    """SHA-256 of the normalized url, 64 hex chars"""
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+
+def encode_cursor(created_at: datetime, url_id: int) -> str:
+    """position after a row in a (created_at, id) ordered list, url safe"""
+    raw = f"{created_at.isoformat()}|{url_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """inverse of encode_cursor, raises ValueError"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    except UnicodeDecodeError as e:
+        raise ValueError(str(e))
+    created_at, _, url_id = raw.rpartition("|")
+    return datetime.fromisoformat(created_at), int(url_id)
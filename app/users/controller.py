@@ -22,7 +22,7 @@ async def user_profile(current_user: current_user, db: DbSession):
 async def change_password(
     current_user: current_user, db: DbSession, user_request: model.ChangeUserPassword
 ):
-    service.change_user_password(db, current_user.get_uuid(), user_request)
+    await service.change_user_password(db, current_user.get_uuid(), user_request)
 
 
 @router.put("/change-username/", status_code=status.HTTP_200_OK)
@@ -1,3 +1,4 @@
+import redis
 import logging
 from uuid import UUID
 from sqlalchemy.orm import Session
@@ -5,8 +6,13 @@ from datetime import datetime, timezone
 
 from . import model
 from ..entities.user import User
-from ..database.cache import redis_client
-from ..auth.service import verify_password, get_pass_hash
+from ..entities.redis_outbox import RedisOutbox
+from ..database.cache import redis_client, publish, PASSWORD_CHANGED_CHANNEL
+from ..auth.service import (
+    verify_password_async,
+    get_pass_hash_async,
+    record_password_change,
+)
 from ..exceptions import UserNotFoundError, InvalidPasswordError, InternalServerError
 
 
@@ -14,42 +20,80 @@ def get_user_by_id(db: Session, user_id: UUID) -> model.UserProfileResponse:
     user = db.get(User, user_id)
 
     if not user:
-        logging.warning(f"User not found with ID: {user_id}")
+        logging.warning("User not found with ID: %s", user_id)
         raise UserNotFoundError(user_id)
     return user
 
 
-def store_password_changed_in_cache(user_id: UUID, timestamp: int) -> None:
+def store_password_changed_in_cache(db: Session, user_id: UUID, timestamp: int) -> None:
     """
     Store the last password change timestamp in Redis.
     Key: user:password_changed:<user_id>
     Value: timestamp in UTC
+
+    Cached tokens issued before it are rejected on this worker at once
+    and on the others when the pub/sub message arrives.
+    Redis down: recorded in the outbox, replayed once it is back.
     """
-    redis_client.set(f"user:password_changed:{user_id}", timestamp)
+    record_password_change(str(user_id), timestamp)
+    try:
+        publish_password_change(str(user_id), timestamp)
+    except redis.RedisError as e:
+        logging.warning(
+            "Failed to publish the password change of user %s, replayed later. "
+            "Error: %s",
+            user_id,
+            e,
+        )
+        try:
+            db.add(
+                RedisOutbox(
+                    op="password_changed", key=str(user_id), value=str(timestamp)
+                )
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.error(
+                "Failed to record the password change of user %s. Error: %s",
+                user_id,
+                e,
+            )
+
+
+def publish_password_change(user_id: str, timestamp: int) -> None:
+    """Redis: the timestamp unless a later change is there already, then pub/sub"""
+    key = f"user:password_changed:{user_id}"
+    last_changed = redis_client.get(key)
+    if last_changed is None or int(last_changed) < timestamp:
+        redis_client.set(key, timestamp)
+    publish(PASSWORD_CHANGED_CHANNEL, f"{user_id}:{timestamp}")
 
 
-def change_user_password(
+async def change_user_password(
     db: Session, user_id: UUID, user_request: model.ChangeUserPassword
 ) -> None:
     try:
         user = get_user_by_id(db, user_id)
 
         # check the given password matched with current password
-        if not verify_password(user_request.password, user.password):
+        if not await verify_password_async(user_request.password, user.password):
             raise InvalidPasswordError()
 
-        user.password = get_pass_hash(user_request.new_password)
+        user.password = await get_pass_hash_async(user_request.new_password)
         db.commit()
 
         timestamp = int(datetime.now(timezone.utc).timestamp())
-        store_password_changed_in_cache(user_id, timestamp)
+        store_password_changed_in_cache(db, user_id, timestamp)
 
     except InvalidPasswordError:
-        logging.warning(f"Invalid current password for user ID: {user_id}")
+        logging.warning("Invalid current password for user ID: %s", user_id)
         raise
     except Exception as e:
         logging.warning(
-            f"Unexpected error while changing password for user_id: {user_id}. Error: {str(e)}"
+            "Unexpected error while changing password for user_id: %s. Error: %s",
+            user_id,
+            e,
         )
         raise InternalServerError()
 
@@ -63,6 +107,8 @@ def change_user_username(
         db.commit()
     except Exception as e:
         logging.warning(
-            f"Unexpected error while changing username for user_id: {user_id}. Error: {str(e)}"
+            "Unexpected error while changing username for user_id: %s. Error: %s",
+            user_id,
+            e,
         )
         raise InternalServerError()
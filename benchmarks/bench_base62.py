@@ -0,0 +1,64 @@
+"""
+Base62 encode / decode / validate throughput, no server needed.
+
+    python -m benchmarks.bench_base62 --codes 200000
+
+Codes are encode_base62 of ids spread over the INTEGER range of urls.id.
+decode is compared with the previous BASE62.index scan per char.
+"""
+
+import time
+import random
+import argparse
+
+from app.urls.utils import BASE62, encode_base62, decode_base62, is_short_code
+
+
+def decode_base62_index(s: str) -> int:
+    """the decode before the lookup table"""
+    num = 0
+    base = len(BASE62)
+    for c in s:
+        num = num * base + BASE62.index(c)
+    return num
+
+
+def throughput(fn, values: list, repeat: int) -> float:
+    """calls per second, best of repeat runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in values:
+            fn(value)
+        best = min(best, time.perf_counter() - start)
+    return len(values) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--codes", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    ids = [random.randrange(1, 2**31) for _ in range(args.codes)]
+    codes = [encode_base62(i) for i in ids]
+    assert [decode_base62(code) for code in codes] == ids
+
+    results = {
+        "encode_base62": throughput(encode_base62, ids, args.repeat),
+        "decode_base62 (index)": throughput(decode_base62_index, codes, args.repeat),
+        "decode_base62 (table)": throughput(decode_base62, codes, args.repeat),
+        "is_short_code": throughput(is_short_code, codes, args.repeat),
+    }
+
+    print(
+        f"{args.codes} codes, {sum(map(len, codes)) / len(codes):.1f} chars on average"
+    )
+    for name, per_second in results.items():
+        print(f"{name:<24}{per_second / 1e6:8.2f} M/s {1e9 / per_second:8.0f} ns")
+    speedup = results["decode_base62 (table)"] / results["decode_base62 (index)"]
+    print(f"decode speedup:         {speedup:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Click sync throughput, Redis -> database.
+
+Seeds --codes urls with a click counter each, marks them all
+dirty, then times one sync_clicks_to_db run:
+
+    python -m benchmarks.bench_click_sync --codes 1000000
+
+Uses the Redis and database from .env, the seeded rows are deleted afterwards.
+"""
+
+import time
+import argparse
+from sqlalchemy import delete, insert
+
+from app.main import app  # noqa: F401, creates the tables
+from app.entities.url import URL
+from app.urls.utils import encode_base62
+from app.database.core import SessionLocal
+from app.database.cache import redis_client
+from app.background_tasks.tasks import sync_clicks_to_db, SYNC_CHUNK_SIZE
+
+# far above real ids, so the seeded rows never collide,
+# and below 2**31, urls.id is a Postgres INTEGER
+FIRST_ID = 2_000_000_000
+MAX_CODES = 2**31 - FIRST_ID
+
+
+def seed(codes: int, chunk_size: int) -> None:
+    db = SessionLocal()
+    try:
+        for start in range(FIRST_ID, FIRST_ID + codes, chunk_size):
+            ids = range(start, min(start + chunk_size, FIRST_ID + codes))
+            db.execute(
+                insert(URL),
+                [
+                    {
+                        "id": i,
+                        "long_url": "https://example.com/bench",
+                        "short_code": encode_base62(i),
+                        "clicks": 0,
+                    }
+                    for i in ids
+                ],
+            )
+
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.mset({f"clicks:{encode_base62(i)}": i % 100 for i in ids})
+            pipe.sadd("dirty_clicks", *(encode_base62(i) for i in ids))
+            pipe.execute()
+        db.commit()
+    finally:
+        db.close()
+
+
+def cleanup(codes: int, chunk_size: int) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(delete(URL).where(URL.id >= FIRST_ID))
+        db.commit()
+    finally:
+        db.close()
+
+    for start in range(FIRST_ID, FIRST_ID + codes, chunk_size):
+        ids = range(start, min(start + chunk_size, FIRST_ID + codes))
+        redis_client.delete(*(f"clicks:{encode_base62(i)}" for i in ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--codes", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=SYNC_CHUNK_SIZE)
+    args = parser.parse_args()
+    if args.codes > MAX_CODES:
+        parser.error(f"--codes must be at most {MAX_CODES}")
+
+    print(f"seeding {args.codes} dirty codes")
+    seed(args.codes, args.chunk_size)
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        synced = sync_clicks_to_db(db, args.chunk_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+        cleanup(args.codes, args.chunk_size)
+
+    print(f"synced:     {synced} codes in {elapsed:.2f} s")
+    print(f"throughput: {synced / elapsed:.0f} codes/s")
+
+
+if __name__ == "__main__":
+    main()
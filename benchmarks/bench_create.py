@@ -0,0 +1,97 @@
+"""
+Short url create throughput under concurrent load.
+
+Compares one create per request, with autoincrement ids (INSERT + flush,
+then the code) and with leased ids (one INSERT), against concurrent
+creates of one worker batched into one INSERT and one commit:
+
+    python -m benchmarks.bench_create --creates 20000 --concurrency 12
+
+Needs Postgres, the id allocator is off on other databases.
+"""
+
+import time
+import asyncio
+import logging
+import argparse
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+
+from app.main import app  # noqa: F401, creates the tables
+from app.urls import service
+from app.urls.allocator import id_allocator
+from app.urls.model import ShortUrlRequest
+from app.database.core import SessionLocal, engine
+
+REQUEST = ShortUrlRequest(long_url="https://example.com/bench")
+
+
+def create(count: int) -> None:
+    db = SessionLocal()
+    try:
+        for _ in range(count):
+            service.register_url(db, REQUEST)
+    finally:
+        db.close()
+
+
+def measure(name: str, creates: int, concurrency: int) -> float:
+    per_thread = creates // concurrency
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(create, [per_thread] * concurrency))
+    elapsed = time.perf_counter() - start
+
+    rate = per_thread * concurrency / elapsed
+    print(f"{name:<20} {rate:>8.0f} creates/s")
+    return rate
+
+
+async def create_batched(creates: int, in_flight: int) -> None:
+    async def creator(count: int) -> None:
+        for _ in range(count):
+            await service.create_url(REQUEST)
+
+    await asyncio.gather(*(creator(creates // in_flight) for _ in range(in_flight)))
+
+
+def measure_batched(creates: int, in_flight: int) -> float:
+    start = time.perf_counter()
+    asyncio.run(create_batched(creates, in_flight))
+    elapsed = time.perf_counter() - start
+
+    rate = creates // in_flight * in_flight / elapsed
+    print(f"{'batched creates':<20} {rate:>8.0f} creates/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--creates", type=int, default=20000)
+    # stay within the engine pool (5 + 10 overflow by default)
+    parser.add_argument("--concurrency", type=int, default=12)
+    # requests in flight in the one event loop of the batched run
+    parser.add_argument("--in-flight", type=int, default=200)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if not id_allocator.supported(db):
+            print(f"{engine.dialect.name}: no sequences, the allocator is unused")
+    finally:
+        db.close()
+
+    # one line per created url otherwise
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with patch.object(id_allocator, "supported", return_value=False):
+        baseline = measure("autoincrement + flush", args.creates, args.concurrency)
+    leased = measure("leased id blocks", args.creates, args.concurrency)
+    batched = measure_batched(args.creates, args.in_flight)
+    print(
+        f"speedup: leased {leased / baseline:.1f}x, batched {batched / baseline:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
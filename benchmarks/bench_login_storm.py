@@ -0,0 +1,142 @@
+"""
+Redirect latency while a login storm hits the same worker.
+
+Start a single worker, then:
+
+    uvicorn app.main:app --workers 1
+    python -m benchmarks.bench_login_storm --logins 200 --login-concurrency 50
+
+Creates a user and a link, measures redirects alone, then again while
+login requests (one bcrypt verify each) run concurrently. With hashing
+on the event loop every login stalls every redirect; offloaded, the
+redirect p99 should stay close to the quiet run.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+import httpx
+from dotenv import load_dotenv
+
+from .bench_redirect import percentile
+
+load_dotenv()
+
+SERVER_ADDRESS = os.getenv("SERVER_ADDRESS", "http://localhost:8000")
+PASSWORD = "bench-password"
+
+
+async def setup(client: httpx.AsyncClient) -> tuple[str, str]:
+    """a fresh user and a link, returns (email, short code)"""
+    name = uuid.uuid4().hex[:12]
+    email = f"{name}@example.com"
+    response = await client.post(
+        "/auth/sign-up/",
+        json={"email": email, "username": name, "password": PASSWORD},
+    )
+    response.raise_for_status()
+
+    response = await client.post(
+        "/urls/short-url-public/", json={"long_url": "https://example.com/"}
+    )
+    response.raise_for_status()
+    return email, response.json()["short_code"].split("/")[-1]
+
+
+async def redirects(
+    client: httpx.AsyncClient, path: str, seconds: float, latencies: list[float]
+) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await client.get(path)
+        latencies.append(time.perf_counter() - start)
+
+
+async def logins(client: httpx.AsyncClient, email: str, count: int) -> int:
+    failed = 0
+    for _ in range(count):
+        response = await client.post(
+            "/auth/log-in/", data={"username": email, "password": PASSWORD}
+        )
+        failed += response.status_code != 200
+    return failed
+
+
+def report(label: str, latencies: list[float]) -> None:
+    print(
+        f"{label:<12} redirects: {len(latencies):>6}  "
+        f"p50: {statistics.median(latencies) * 1000:7.2f} ms  "
+        f"p99: {percentile(latencies, 99) * 1000:7.2f} ms"
+    )
+
+
+async def run(
+    base_url: str,
+    seconds: float,
+    redirect_concurrency: int,
+    login_count: int,
+    login_concurrency: int,
+) -> None:
+    limits = httpx.Limits(max_connections=redirect_concurrency + login_concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, follow_redirects=False, timeout=120
+    ) as client:
+        email, code = await setup(client)
+        path = f"/urls/get-url/{code}"
+        await client.get(path)
+
+        quiet: list[float] = []
+        await asyncio.gather(
+            *(
+                redirects(client, path, seconds, quiet)
+                for _ in range(redirect_concurrency)
+            )
+        )
+
+        storm: list[float] = []
+        per_worker = max(1, login_count // login_concurrency)
+        start = time.perf_counter()
+        storm_tasks = asyncio.gather(
+            *(logins(client, email, per_worker) for _ in range(login_concurrency))
+        )
+        await asyncio.gather(
+            *(
+                redirects(client, path, seconds, storm)
+                for _ in range(redirect_concurrency)
+            )
+        )
+        failed = sum(await storm_tasks)
+        elapsed = time.perf_counter() - start
+
+    report("quiet", quiet)
+    report("login storm", storm)
+    total = per_worker * login_concurrency
+    print(f"logins:      {total} ({failed} failed) in {elapsed:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default=SERVER_ADDRESS, help="server base url")
+    parser.add_argument("--seconds", type=float, default=10, help="per phase")
+    parser.add_argument("--concurrency", type=int, default=20, help="redirects")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--login-concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    asyncio.run(
+        run(
+            args.url,
+            args.seconds,
+            args.concurrency,
+            args.logins,
+            args.login_concurrency,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
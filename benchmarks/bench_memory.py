@@ -0,0 +1,94 @@
+"""
+Redis memory per link, "keys" against "hash" REDIS_URL_LAYOUT.
+
+Writes --links urls with a click delta each in both layouts,
+one after the other, and reports the used_memory they added:
+
+    python -m benchmarks.bench_memory --links 1000000 --url-length 60
+
+Uses the Redis from .env, the links are deleted afterwards. The hash
+layout only stays compact with hash-max-listpack-entries at least
+URL_HASH_BUCKET_SIZE and hash-max-listpack-value at least --url-length,
+both are printed with the encoding of a bucket.
+"""
+
+import argparse
+
+import app.database.cache as cache
+from app.urls.utils import encode_base62
+from app.database.cache import redis_client, url_key, clicks_key
+
+# far above real ids, the links never collide with real ones
+FIRST_ID = 2_000_000_000
+
+
+def long_url(i: int, length: int) -> str:
+    prefix = "https://example.com/"
+    return prefix + str(i).zfill(max(0, length - len(prefix)))
+
+
+def used_memory() -> int:
+    return redis_client.info("memory")["used_memory"]
+
+
+def write(links: int, url_length: int, expire: int, chunk_size: int) -> None:
+    for start in range(FIRST_ID, FIRST_ID + links, chunk_size):
+        buckets = set()
+        pipe = redis_client.pipeline(transaction=False)
+        for i in range(start, min(start + chunk_size, FIRST_ID + links)):
+            code = encode_base62(i)
+            key, field = url_key(code)
+            clicks, clicks_field = clicks_key(code)
+            if field:
+                pipe.hset(key, field, long_url(i, url_length))
+                pipe.hincrby(clicks, clicks_field, 1)
+                buckets.add(key)
+            else:
+                pipe.set(key, long_url(i, url_length), ex=expire or None)
+                pipe.incr(clicks)
+        if expire:
+            for key in buckets:
+                pipe.expire(key, expire)
+        pipe.execute()
+
+
+def delete(links: int, chunk_size: int) -> None:
+    for start in range(FIRST_ID, FIRST_ID + links, chunk_size):
+        keys = set()
+        for i in range(start, min(start + chunk_size, FIRST_ID + links)):
+            code = encode_base62(i)
+            keys.update((url_key(code)[0], clicks_key(code)[0]))
+        redis_client.delete(*keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--links", type=int, default=100000)
+    parser.add_argument("--url-length", type=int, default=60)
+    parser.add_argument("--expire", type=int, default=86400)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    config = redis_client.config_get("hash-max-listpack-*")
+    print(
+        f"{args.links} links, urls of {args.url_length} chars, "
+        f"URL_HASH_BUCKET_SIZE={cache.URL_HASH_BUCKET_SIZE}, {config}"
+    )
+
+    for layout in ("keys", "hash"):
+        cache.REDIS_URL_LAYOUT = layout
+        before = used_memory()
+        write(args.links, args.url_length, args.expire, args.chunk_size)
+        added = used_memory() - before
+
+        first = url_key(encode_base62(FIRST_ID))[0]
+        encoding = redis_client.object("encoding", first)
+        print(
+            f"{layout:<5} {added / 2**20:>9.1f} MB"
+            f"   {added / args.links:>6.1f} bytes/link   {encoding}"
+        )
+        delete(args.links, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
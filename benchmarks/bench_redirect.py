@@ -0,0 +1,83 @@
+"""
+Redirect throughput of one running server.
+
+Start a single worker, create a link, then hammer its redirect:
+
+    uvicorn app.main:app --workers 1
+    python -m benchmarks.bench_redirect --code 1 --requests 20000 --concurrency 200
+
+Run it once on the old (blocking) build and once on the current one
+to compare requests/second and tail latency per worker.
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import statistics
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SERVER_ADDRESS = os.getenv("SERVER_ADDRESS", "http://localhost:8000")
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(len(samples) * pct / 100))
+    return samples[index]
+
+
+async def worker(
+    client: httpx.AsyncClient, path: str, count: int, latencies: list[float]
+) -> int:
+    errors = 0
+    for _ in range(count):
+        start = time.perf_counter()
+        response = await client.get(path)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 307:
+            errors += 1
+    return errors
+
+
+async def run(base_url: str, code: str, requests: int, concurrency: int) -> None:
+    path = f"/urls/get-url/{code}"
+    latencies: list[float] = []
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, follow_redirects=False
+    ) as client:
+        # warm the caches before measuring
+        await client.get(path)
+
+        per_worker = requests // concurrency
+        start = time.perf_counter()
+        errors = await asyncio.gather(
+            *(worker(client, path, per_worker, latencies) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+
+    total = per_worker * concurrency
+    print(f"requests:    {total} ({sum(errors)} non-307)")
+    print(f"concurrency: {concurrency}")
+    print(f"throughput:  {total / elapsed:.0f} req/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"latency p99: {percentile(latencies, 99) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default=SERVER_ADDRESS, help="server base url")
+    parser.add_argument("--code", required=True, help="existing short code")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.url, args.code, args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Redis round trips per redirect, for each cache tier.
+
+Needs the Redis and database from .env:
+
+    python -m benchmarks.bench_round_trips --redirects 1000
+
+Every command, script call or pipeline sent by the async
+client counts as one round trip.
+"""
+
+import time
+import asyncio
+import argparse
+from contextlib import contextmanager
+from redis.asyncio.client import Pipeline
+
+from app.main import app  # noqa: F401, creates the tables
+from app.urls import service
+from app.urls.clicks import click_buffer
+from app.urls.model import ShortUrlRequest
+from app.database.core import SessionLocal, AsyncSessionLocal, async_engine
+from app.database.cache import async_redis_client, url_key, drop_url
+
+
+class RoundTrips:
+    count = 0
+
+
+@contextmanager
+def count_round_trips():
+    execute_command = async_redis_client.execute_command
+    pipeline_execute = Pipeline.execute
+
+    async def counted_command(*args, **kwargs):
+        RoundTrips.count += 1
+        return await execute_command(*args, **kwargs)
+
+    async def counted_pipeline(self, *args, **kwargs):
+        RoundTrips.count += 1
+        return await pipeline_execute(self, *args, **kwargs)
+
+    async_redis_client.execute_command = counted_command
+    Pipeline.execute = counted_pipeline
+    try:
+        yield
+    finally:
+        async_redis_client.execute_command = execute_command
+        Pipeline.execute = pipeline_execute
+
+
+async def measure(name: str, short_code: str, redirects: int, before) -> None:
+    # load the lua scripts once, outside the measurement
+    await before()
+    await service.get_long_url(short_code)
+
+    RoundTrips.count = 0
+    elapsed = 0.0
+    with count_round_trips():
+        for _ in range(redirects):
+            await before()
+            start = time.perf_counter()
+            await service.get_long_url(short_code)
+            elapsed += time.perf_counter() - start
+
+    # before() is not part of the redirect
+    trips = RoundTrips.count - redirects * before.round_trips
+    print(
+        f"{name:<14} {trips / redirects:>5.2f} round trips/redirect"
+        f"   {elapsed / redirects * 1e6:>8.1f} us/redirect"
+    )
+
+
+async def run(redirects: int) -> None:
+    db = SessionLocal()
+    try:
+        response = service.register_url(
+            db, ShortUrlRequest(long_url="https://example.com/bench")
+        )
+        short_code = str(response.short_code).split("/")[-1]
+    finally:
+        db.close()
+
+    async def memory_tier():
+        pass
+
+    async def redis_tier():
+        service.url_cache.delete(short_code)
+
+    async def database_tier():
+        service.url_cache.delete(short_code)
+        key, field = url_key(short_code)
+        if field:
+            await async_redis_client.hdel(key, field)
+        else:
+            await async_redis_client.delete(key)
+
+    memory_tier.round_trips = 0
+    redis_tier.round_trips = 0
+    database_tier.round_trips = 1
+
+    print(f"short code {short_code}, {redirects} redirects per tier")
+    await measure("memory hit", short_code, redirects, memory_tier)
+    await measure("redis hit", short_code, redirects, redis_tier)
+    await measure("miss (db)", short_code, redirects, database_tier)
+
+    click_buffer.drain()
+    drop_url(short_code)
+    await async_redis_client.aclose()
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--redirects", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.redirects))
+
+
+if __name__ == "__main__":
+    main()
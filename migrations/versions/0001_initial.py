@@ -0,0 +1,51 @@
+"""users and urls tables
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("email", sa.String(), nullable=False, unique=True),
+        sa.Column("username", sa.String(), nullable=False, unique=True),
+        sa.Column("password", sa.String(), nullable=False),
+    )
+    op.create_table(
+        "urls",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column(
+            "user_id",
+            postgresql.UUID(as_uuid=True),
+            sa.ForeignKey("users.id"),
+            nullable=True,
+        ),
+        sa.Column("long_url", sa.String(2083), nullable=False),
+        sa.Column("short_code", sa.String(10), unique=True),
+        sa.Column("clicks", sa.Integer()),
+        sa.Column(
+            "created_at", sa.DateTime(timezone=True), server_default=sa.func.now()
+        ),
+    )
+    op.create_index("ix_urls_short_code", "urls", ["short_code"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_urls_short_code", table_name="urls")
+    op.drop_table("urls")
+    op.drop_table("users")
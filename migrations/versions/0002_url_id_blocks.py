@@ -0,0 +1,32 @@
+"""sequence for url id blocks
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    # may already exist, created by Base.metadata.create_all
+    # IdBlockAllocator moves it past the existing ids on its first lease
+    op.execute(
+        "CREATE SEQUENCE IF NOT EXISTS urls_id_block_seq START WITH 1 INCREMENT BY 1000"
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP SEQUENCE IF EXISTS urls_id_block_seq")
@@ -0,0 +1,40 @@
+"""urls.url_hash for per user deduplication
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Existing rows get their hash from the batched backfill,
+run it after this migration:
+
+    python -m app.background_tasks.backfill_url_hash
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("urls", sa.Column("url_hash", sa.String(64), nullable=True))
+
+    # don't lock urls against writes while the index builds
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_urls_user_id_url_hash",
+            "urls",
+            ["user_id", "url_hash"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_urls_user_id_url_hash", table_name="urls")
+    op.drop_column("urls", "url_hash")
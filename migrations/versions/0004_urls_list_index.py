@@ -0,0 +1,31 @@
+"""urls(user_id, created_at, id) for keyset pages of list-urls
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # don't lock urls against writes while the index builds
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_urls_user_id_created_at_id",
+            "urls",
+            ["user_id", "created_at", "id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_urls_user_id_created_at_id", table_name="urls")
@@ -0,0 +1,49 @@
+"""urls.id defaults to the id block sequence
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+
+The SERIAL sequence urls_id_seq never saw the ids leased in blocks,
+so an INSERT without an id (an old worker during a rolling deploy,
+a manual insert) could take an id a worker already handed out.
+From here every id comes from urls_id_block_seq.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    # same lock as IdBlockAllocator._align, past every existing id
+    op.execute("SELECT pg_advisory_xact_lock(hashtext('urls_id_block_seq'))")
+    op.execute("""
+        SELECT setval('urls_id_block_seq', max_id + 1, false)
+        FROM (SELECT coalesce(max(id), 0) AS max_id FROM urls) AS urls,
+             (SELECT last_value, is_called FROM urls_id_block_seq) AS seq
+        WHERE max_id >= CASE WHEN is_called THEN last_value + 1000 ELSE last_value END
+        """)
+    op.execute(
+        "ALTER TABLE urls ALTER COLUMN id SET DEFAULT nextval('urls_id_block_seq')"
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("CREATE SEQUENCE IF NOT EXISTS urls_id_seq OWNED BY urls.id")
+    op.execute(
+        "SELECT setval('urls_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM urls), false)"
+    )
+    op.execute("ALTER TABLE urls ALTER COLUMN id SET DEFAULT nextval('urls_id_seq')")
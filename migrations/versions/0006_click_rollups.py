@@ -0,0 +1,40 @@
+"""hourly and daily click rollups
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+
+Filled by the click event consumer of app.background_tasks.worker,
+clicks before this migration have no rollups.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("click_rollups_hourly", "click_rollups_daily")
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.create_table(
+            table,
+            sa.Column("short_code", sa.String(10), primary_key=True),
+            sa.Column("bucket", sa.DateTime(timezone=True), primary_key=True),
+            sa.Column("referrer", sa.String(255), primary_key=True),
+            sa.Column("ua_class", sa.String(16), primary_key=True),
+            sa.Column("country", sa.String(2), primary_key=True),
+            sa.Column("clicks", sa.Integer(), nullable=False),
+        )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_table(table)
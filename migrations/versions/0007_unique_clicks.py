@@ -0,0 +1,38 @@
+"""approximate unique clicks per url and per day
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+
+PFCOUNT snapshots of the visitor HyperLogLogs, written by the click sync.
+Existing urls start at 0 until their next click.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "urls",
+        sa.Column("unique_clicks", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.create_table(
+        "click_uniques_daily",
+        sa.Column("short_code", sa.String(10), primary_key=True),
+        sa.Column("bucket", sa.DateTime(timezone=True), primary_key=True),
+        sa.Column("visitors", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("click_uniques_daily")
+    op.drop_column("urls", "unique_clicks")
@@ -0,0 +1,34 @@
+"""redis outbox
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+
+Redis writes of created and deleted urls that failed, replayed by the
+web workers once Redis is back.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "redis_outbox",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("op", sa.String(16), nullable=False),
+        sa.Column("key", sa.String(64), nullable=False),
+        sa.Column("value", sa.String(2083), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("redis_outbox")
@@ -0,0 +1,32 @@
+"""url_hash keeps the fragment
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+
+hash_url dropped the fragment, so dedup of https://x.com/app#/billing
+returned the link of https://x.com/app#/settings. The hash of a url with
+a fragment is cleared here, a cleared row is never matched, rerun the
+backfill to hash it again:
+
+    python -m app.background_tasks.backfill_url_hash
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("UPDATE urls SET url_hash = NULL WHERE long_url LIKE '%#%'")
+
+
+def downgrade() -> None:
+    # the hashes without fragment come back with the old code and a backfill
+    op.execute("UPDATE urls SET url_hash = NULL WHERE long_url LIKE '%#%'")
@@ -0,0 +1,53 @@
+"""urls_id_block_seq increments by 1
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19
+
+With INCREMENT BY 1000 every INSERT without an id (bulk paths outside
+the allocator, manual inserts) took a whole block of ids of the INTEGER
+column. Workers now lease their ids with one nextval per id in one round
+trip. The sequence restarts past the blocks leased so far.
+
+Run it with the old workers stopped, they would read a nextval as the
+start of a block of 1000 and fail on duplicate ids.
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0010"
+down_revision: Union[str, None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    # same lock as IdBlockAllocator._align, past the last leased block
+    op.execute("SELECT pg_advisory_xact_lock(hashtext('urls_id_block_seq'))")
+    op.execute("""
+        SELECT setval('urls_id_block_seq', greatest(next_id, max_id + 1), false)
+        FROM (SELECT coalesce(max(id), 0) AS max_id FROM urls) AS urls,
+             (SELECT CASE WHEN is_called THEN last_value + 1000 ELSE last_value END
+              AS next_id FROM urls_id_block_seq) AS seq
+        """)
+    op.execute("ALTER SEQUENCE urls_id_block_seq INCREMENT BY 1")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("SELECT pg_advisory_xact_lock(hashtext('urls_id_block_seq'))")
+    op.execute("""
+        SELECT setval('urls_id_block_seq', greatest(next_id, max_id + 1), false)
+        FROM (SELECT coalesce(max(id), 0) AS max_id FROM urls) AS urls,
+             (SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END
+              AS next_id FROM urls_id_block_seq) AS seq
+        """)
+    op.execute("ALTER SEQUENCE urls_id_block_seq INCREMENT BY 1000")
@@ -1,11 +1,15 @@
 import pytest
 from uuid import uuid4
+from contextlib import nullcontext
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from app.database.core import Base
 from app.auth import service as auth_service
 from app.entities.user import User
 from app.entities.url import URL
+import app.urls.service as urls_service
 
 
 @pytest.fixture(scope="function")
@@ -39,6 +43,57 @@ def db_session():
         Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture(scope="function", autouse=True)
+def clear_local_caches():
+    """in-process caches are per worker, don't let them leak between tests"""
+    from app.urls.service import url_cache
+    from app.urls.clicks import click_buffer
+
+    yield
+    url_cache.clear()
+    click_buffer.drain()
+    click_buffer.drain_events()
+    auth_service.token_cache.clear()
+    auth_service.password_changed.clear()
+
+
+@pytest.fixture(scope="function")
+def anyio_backend():
+    """@pytest.mark.anyio tests run on asyncio only"""
+    return "asyncio"
+
+
+@pytest.fixture(scope="function")
+def async_session_factory(db_session, monkeypatch):
+    """
+    Async sessions on the same SQLite file as db_session,
+    also the ones the url loads open themselves.
+
+    NullPool opens a fresh connection per session, so no
+    connection outlives the event loop that created it.
+    """
+    engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+    factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    monkeypatch.setattr(urls_service, "AsyncSessionLocal", factory)
+    return factory
+
+
+@pytest.fixture(scope="function")
+async def async_db_session(async_session_factory):
+    async with async_session_factory() as db:
+        yield db
+
+
+@pytest.fixture(scope="function")
+def url_load_session(monkeypatch):
+    """the url loads run on the session given, a mock or a wrapper"""
+
+    def use(db):
+        monkeypatch.setattr(urls_service, "AsyncSessionLocal", lambda: nullcontext(db))
+
+    return use
+
+
 @pytest.fixture(scope="function")
 def test_user():
     hashed_password = auth_service.get_pass_hash("string")
@@ -52,9 +107,9 @@ def test_user():
 
 # send request without running the server
 @pytest.fixture(scope="function")
-def client(db_session):
+def client(db_session, async_session_factory, monkeypatch):
     from app.main import app
-    from app.database.core import get_db
+    from app.database.core import get_db, get_async_db
 
     def override_get_db():
         try:
@@ -62,9 +117,18 @@ def client(db_session):
         finally:
             db_session.close()
 
+    async def override_get_async_db():
+        async with async_session_factory() as db:
+            yield db
+
     # replaces the real DB session factory with a
     # test version (db_session from another fixture)
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    # sessions the services open themselves
+    monkeypatch.setattr(
+        urls_service, "SessionLocal", sessionmaker(bind=db_session.get_bind())
+    )
 
     from fastapi.testclient import TestClient
 
@@ -0,0 +1,41 @@
+def test_health(client):
+    response = client.get("/health")
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["status"] == "ok"
+    assert set(data["pools"]) == {"database", "database_async", "redis", "redis_async"}
+    assert "checked_out" in data["pools"]["redis"]
+    assert data["redis_circuit"] == "closed"
+    assert set(data["caches"]) == {"url_cache", "token_cache", "redis_urls"}
+    assert {"hits", "misses", "evictions"} <= set(data["caches"]["url_cache"])
+    assert "hit_ratio" in data["caches"]["redis_urls"]
+
+
+def test_metrics(client):
+    client.get("/urls/get-url/unknown", follow_redirects=False)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    text = response.text
+    # startup built the Bloom filter, the database confirmed the unknown code
+    assert 'redirect_seconds_count{tier="bloom"}' in text
+    assert (
+        'http_requests_total{method="GET",route="/urls/get-url/{short_code}",'
+        'status="404"}'
+    ) in text
+    assert (
+        'http_request_database_calls_bucket{route="/urls/get-url/{short_code}"' in text
+    )
+    assert "click_backlog " in text
+    assert "bloom_false_positive_rate " in text
+
+
+def test_request_id(client):
+    response = client.get("/health", headers={"X-Request-ID": "req-1"})
+    assert response.headers["x-request-id"] == "req-1"
+
+    # made up when the client sends none
+    assert len(client.get("/health").headers["x-request-id"]) == 32
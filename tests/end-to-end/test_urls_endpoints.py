@@ -1,3 +1,4 @@
+import json
 from app.urls.service import SERVER_ADDRESS
 
 
@@ -80,3 +81,185 @@ def test_get_url(client):
     assert response.status_code == 404
     data = response.json()["detail"]
     assert data == f"{non_existing_shor_code} corresponding long url not found"
+
+
+def test_delete_url(client, auth_headers):
+    response = client.post(
+        "/urls/short-url/",
+        headers=auth_headers,
+        json={"long_url": "https://example.com/"},
+    )
+    short_url = response.json()["short_code"]
+    short_code = short_url.split("/")[-1]
+
+    # cache the link in process
+    response = client.get(short_url, follow_redirects=False)
+    assert response.status_code == 307
+
+    response = client.delete(f"/urls/delete-url/{short_code}", headers=auth_headers)
+    assert response.status_code == 204
+
+    response = client.get(short_url, follow_redirects=False)
+    assert response.status_code == 404
+
+    # without login
+    response = client.delete(f"/urls/delete-url/{short_code}")
+    assert response.status_code == 401
+
+
+def test_short_url_bulk(client, auth_headers):
+    response = client.post(
+        "/urls/short-url/bulk",
+        headers=auth_headers,
+        json=[{"long_url": "https://example.com/"}, {"long_url": "ws://example.com/"}],
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert results[0]["index"] == 0
+    assert results[0]["short_code"].startswith(f"{SERVER_ADDRESS}/urls/get-url/")
+    assert results[1]["index"] == 1
+    assert "error" in results[1]
+
+    # created links redirect straight from the warmed cache
+    response = client.get(results[0]["short_code"], follow_redirects=False)
+    assert response.status_code == 307
+
+    # NDJSON
+    response = client.post(
+        "/urls/short-url/bulk",
+        headers={**auth_headers, "Content-Type": "application/x-ndjson"},
+        content=(
+            b'{"long_url": "https://example.com/a"}\n'
+            b'{"long_url": "https://example.com/b"}\n'
+        ),
+    )
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 2
+
+    # not a list
+    response = client.post(
+        "/urls/short-url/bulk", headers=auth_headers, json={"long_url": "x"}
+    )
+    assert response.status_code == 400
+
+    # without login
+    response = client.post("/urls/short-url/bulk", json=[])
+    assert response.status_code == 401
+
+
+def test_short_url_dedup(client, auth_headers):
+    body = {"long_url": "https://example.com/", "dedup": True}
+    first = client.post("/urls/short-url/", headers=auth_headers, json=body)
+    again = client.post("/urls/short-url/", headers=auth_headers, json=body)
+    assert again.status_code == 201
+    assert again.json()["short_code"] == first.json()["short_code"]
+
+    # without dedup a new short url
+    body["dedup"] = False
+    other = client.post("/urls/short-url/", headers=auth_headers, json=body)
+    assert other.json()["short_code"] != first.json()["short_code"]
+
+
+def test_list_urls_pages_and_export(client, auth_headers):
+    for i in range(3):
+        client.post(
+            "/urls/short-url/",
+            headers=auth_headers,
+            json={"long_url": f"https://example.com/{i}"},
+        )
+
+    response = client.get("/urls/list-urls/?limit=2", headers=auth_headers)
+    assert len(response.json()) == 2
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(
+        f"/urls/list-urls/?limit=2&cursor={cursor}", headers=auth_headers
+    )
+    assert [url["long_url"] for url in response.json()] == ["https://example.com/0"]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get("/urls/list-urls/?cursor=broken", headers=auth_headers)
+    assert response.status_code == 400
+
+    response = client.get("/urls/export-urls/?format=csv", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert len(response.text.splitlines()) == 4
+
+
+def test_url_stats(client, auth_headers, db_session):
+    from datetime import datetime, timezone
+    from app.entities.click_rollup import ClickRollupHourly
+
+    response = client.post(
+        "/urls/short-url/",
+        headers=auth_headers,
+        json={"long_url": "https://example.com/"},
+    )
+    short_code = response.json()["short_code"].split("/")[-1]
+
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    db_session.add_all(
+        [
+            ClickRollupHourly(
+                short_code=short_code,
+                bucket=now,
+                referrer="t.co",
+                ua_class="mobile",
+                country="US",
+                clicks=5,
+            ),
+            ClickRollupHourly(
+                short_code=short_code,
+                bucket=now,
+                referrer="",
+                ua_class="desktop",
+                country="",
+                clicks=2,
+            ),
+        ]
+    )
+    db_session.commit()
+
+    response = client.get(f"/urls/{short_code}/stats", headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["clicks"] == 7
+    assert len(data["series"]) == 1
+    assert data["referrers"] == {"t.co": 5, "": 2}
+    assert data["ua_classes"] == {"mobile": 5, "desktop": 2}
+
+    # login required, a window of at most STATS_MAX_BUCKETS
+    response = client.get(f"/urls/{short_code}/stats")
+    assert response.status_code == 401
+    response = client.get(
+        f"/urls/{short_code}/stats?buckets=100000", headers=auth_headers
+    )
+    assert response.status_code == 422
+
+    response = client.get("/urls/unknown/stats", headers=auth_headers)
+    assert response.status_code == 404
+
+
+def test_trending(client, auth_headers):
+    import time
+    from app.database.cache import redis_client, trending_key
+
+    codes = []
+    for path in ("/urls/short-url/", "/urls/short-url-public/"):
+        response = client.post(
+            path, headers=auth_headers, json={"long_url": "https://example.com/"}
+        )
+        codes.append(response.json()["short_code"].split("/")[-1])
+
+    key = trending_key("1h")
+    redis_client.set(f"{key}:landmark", time.time())
+    redis_client.zadd(key, {codes[0]: 2, codes[1]: 5, "zzzzzz": 9})
+
+    response = client.get("/urls/trending", headers=auth_headers)
+    assert response.status_code == 200
+    # a code without a url is left out
+    assert [url["short_code"] for url in response.json()] == codes[::-1]
+
+    response = client.get("/urls/trending?window=1w", headers=auth_headers)
+    assert response.status_code == 422
@@ -1,5 +1,8 @@
 import time
+import anyio
 import pytest
+import redis
+import threading
 from datetime import timedelta
 from unittest.mock import Mock
 from app.entities.user import User
@@ -21,7 +24,51 @@ class TestAuthService:
         assert auth_service.verify_password(plain_password, hashed_password)
         assert not auth_service.verify_password("wrongpassword", hashed_password)
 
-    def test_authenticate_user(self, db_session, test_user):
+    @pytest.mark.anyio
+    async def test_password_hashing_off_event_loop(self):
+        # the loop keeps running while bcrypt hashes in a thread
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await anyio.sleep(0.005)
+                ticks += 1
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(tick)
+            hashed = await auth_service.get_pass_hash_async("string")
+            tg.cancel_scope.cancel()
+
+        assert ticks > 0
+        assert await auth_service.verify_password_async("string", hashed)
+        assert not await auth_service.verify_password_async("wrong", hashed)
+
+    @pytest.mark.anyio
+    async def test_password_hashing_limit(self, monkeypatch):
+        running = peak = 0
+        lock = threading.Lock()
+
+        def slow_verify(plain_pass, hashed_pass):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            return True
+
+        monkeypatch.setattr(auth_service, "verify_password", slow_verify)
+        monkeypatch.setattr(auth_service, "password_limiter", anyio.CapacityLimiter(2))
+        async with anyio.create_task_group() as tg:
+            for _ in range(6):
+                tg.start_soon(auth_service.verify_password_async, "string", "hash")
+
+        assert peak == 2
+
+    @pytest.mark.anyio
+    async def test_authenticate_user(self, db_session, test_user):
         """
         pytest sees db_session and looks for a fixture named db_session/test_user
         It runs the fixture, gets the db object, and injects it.
@@ -31,24 +78,28 @@ class TestAuthService:
         db_session.commit()
 
         # authenticate the created user
-        user = auth_service.authenticate_user(test_user.email, "string", db_session)
+        user = await auth_service.authenticate_user(
+            test_user.email, "string", db_session
+        )
         assert user is not False
         assert user.email == test_user.email
         assert user.password == test_user.password
         assert user.username == test_user.username
 
-    def test_get_access_token(self, db_session, test_user):
+    @pytest.mark.anyio
+    async def test_get_access_token(self, db_session, test_user):
         db_session.add(test_user)
         db_session.commit()
 
         form_data = OAuth2PasswordRequestForm(
             username=test_user.email, password="string"
         )
-        token = auth_service.get_access_token(db_session, form_data)
+        token = await auth_service.get_access_token(db_session, form_data)
         assert token.token_type == "bearer"
         assert token.access_token is not None
 
-    def test_create_and_verify_access_token(self, test_user, db_session):
+    @pytest.mark.anyio
+    async def test_create_and_verify_access_token(self, test_user, db_session):
         token = auth_service.create_access_token(
             test_user.email, test_user.id, timedelta(seconds=1)
         )
@@ -74,16 +125,34 @@ class TestAuthService:
                 username=test_user.email, password="string"
             )
 
-            auth_service.get_access_token(db_session, form_data)
+            await auth_service.get_access_token(db_session, form_data)
             assert exc_info.value == "Invalid credentials"
 
-    def test_register_user(self, db_session, test_user):
+    def test_verify_token_redis_down(self, test_user, monkeypatch):
+        token = auth_service.create_access_token(
+            test_user.email, test_user.id, timedelta(minutes=1)
+        )
+        client = Mock()
+        client.get.side_effect = redis.ConnectionError("down")
+        monkeypatch.setattr(auth_service, "redis_client", client)
+
+        # accepted, not cached, Redis checks it again once it is back
+        assert auth_service.verify_token(token).get_uuid() == test_user.id
+        assert auth_service.token_digest(token) not in auth_service.token_cache
+
+        # a password change this worker heard of still applies
+        auth_service.record_password_change(str(test_user.id), int(time.time()) + 1)
+        with pytest.raises(AuthenticationError):
+            auth_service.verify_token(token)
+
+    @pytest.mark.anyio
+    async def test_register_user(self, db_session, test_user):
         form_data = RegisterUserRequest(
             email=test_user.email, username=test_user.username, password="string"
         )
 
         # create user
-        auth_service.register_user(db_session, form_data)
+        await auth_service.register_user(db_session, form_data)
         user = db_session.query(User).filter_by(email=test_user.email).first()
         assert user is not None
         assert user.username == test_user.username
@@ -94,7 +163,7 @@ class TestAuthService:
             email="test@email.com", username=test_user.username, password="string"
         )
         with pytest.raises(UserUserNameConflictError) as exc_info:
-            auth_service.register_user(db_session, form_data)
+            await auth_service.register_user(db_session, form_data)
             assert exc_info.value == "Username already registered"
 
         # email exist in database
@@ -102,7 +171,7 @@ class TestAuthService:
             email=test_user.email, username="test", password="string"
         )
         with pytest.raises(UserEmailConflictError) as exc_info:
-            auth_service.register_user(db_session, form_data)
+            await auth_service.register_user(db_session, form_data)
             assert exc_info.value == "Email already registered"
 
         # other error
@@ -112,5 +181,5 @@ class TestAuthService:
         db_mock.commit.side_effect = Exception
 
         with pytest.raises(InternalServerError) as exc_info:
-            auth_service.register_user(db_mock, form_data)
+            await auth_service.register_user(db_mock, form_data)
             assert exc_info.value == "An unexpected error occurred"
@@ -0,0 +1,92 @@
+import sys
+import json
+import queue
+import logging
+import app.logging as app_logging
+from app.logging import (
+    RateLimitFilter,
+    ContextQueueHandler,
+    JsonFormatter,
+    request_id,
+)
+
+
+def make_record(msg, *args, level=logging.WARNING):
+    return logging.LogRecord("root", level, __file__, 1, msg, args, None)
+
+
+class TestLogging:
+    def test_rate_limit_per_message_type(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(app_logging.time, "monotonic", lambda: now[0])
+        limit = RateLimitFilter(rate=2, sample_rate=1)
+
+        # every code is the same message type
+        template = "%s corresponding long url not found"
+        passed = [limit.filter(make_record(template, code)) for code in "abc"]
+        assert passed == [True, True, False]
+        assert limit.filter(make_record("%s deleted while it was looked up", "a"))
+
+        # refilled, the next record carries what was suppressed
+        now[0] += 1
+        record = make_record(template, "d")
+        assert limit.filter(record)
+        assert record.suppressed == 1
+
+    def test_sampling(self):
+        limit = RateLimitFilter(rate=0, sample_rate=0)
+        assert not limit.filter(make_record("created", level=logging.INFO))
+        assert limit.filter(make_record("failed", level=logging.ERROR))
+
+    def test_queue_handler(self):
+        handler = ContextQueueHandler(queue.Queue(1))
+        token = request_id.set("req-1")
+        try:
+            handler.handle(make_record("%s not found", "abc"))
+            # full queue, dropped and counted
+            handler.handle(make_record("%s not found", "xyz"))
+        finally:
+            request_id.reset(token)
+
+        # merged before it is queued, the listener gets no live args
+        record = handler.queue.get_nowait()
+        assert record.msg == "abc not found"
+        assert record.args is None
+        assert record.request_id == "req-1"
+
+        handler.handle(make_record("%s not found", "def"))
+        assert handler.queue.get_nowait().dropped == 1
+
+    def test_queue_handler_exception(self):
+        handler = ContextQueueHandler(queue.Queue())
+        record = make_record("%s failed", "sync")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record.exc_info = sys.exc_info()
+        handler.handle(record)
+
+        queued = handler.queue.get_nowait()
+        assert queued.exc_info is None
+        assert "ValueError: boom" in queued.exc_text
+        # the caller's record is left as it was
+        assert record.args == ("sync",)
+
+        entry = json.loads(JsonFormatter().format(queued))
+        assert entry["message"] == "sync failed"
+        assert "ValueError: boom" in entry["exception"]
+        assert "ValueError: boom" in logging.Formatter().format(queued)
+
+    def test_json_formatter(self):
+        record = make_record("%s not found", "abc")
+        record.request_id = "req-1"
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record.exc_info = sys.exc_info()
+
+        entry = json.loads(JsonFormatter().format(record))
+        assert entry["level"] == "WARNING"
+        assert entry["message"] == "abc not found"
+        assert entry["request_id"] == "req-1"
+        assert "ValueError: boom" in entry["exception"]
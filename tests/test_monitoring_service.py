@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import subprocess
+import threading
+import time
+import pytest
+import redis
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+import app.monitoring.service as monitoring_service
+from app.monitoring import metrics
+from app.database.core import get_pool_options
+from app.database.pool import (
+    WaitTimer,
+    TimedBlockingConnectionPool,
+    TimedQueuePool,
+    TimedAsyncQueuePool,
+    CircuitBreaker,
+    BreakerConnection,
+    database_pool_stats,
+    warm_database_pool,
+    warm_async_database_pool,
+)
+
+
+class TestMonitoringService:
+    def test_pool_options(self):
+        options = get_pool_options("postgresql://db/app", TimedQueuePool)
+        assert options["poolclass"] is TimedQueuePool
+        assert {"pool_size", "max_overflow", "pool_recycle", "pool_pre_ping"} <= set(
+            options
+        )
+
+        # in-memory sqlite keeps its single connection pool
+        assert get_pool_options("sqlite://", TimedQueuePool) == {}
+
+    def test_wait_timer(self):
+        wait = WaitTimer()
+        wait.observe(0.5)
+        wait.observe(0.25)
+        assert wait.stats() == {
+            "waits": 2,
+            "wait_seconds_total": 0.75,
+            "wait_seconds_max": 0.5,
+        }
+
+    def test_database_pool_stats(self, tmp_path):
+        database_url = f"sqlite:///{tmp_path}/pool.db"
+        engine = create_engine(
+            database_url, **get_pool_options(database_url, TimedQueuePool)
+        )
+        waits = TimedQueuePool.wait.waits
+
+        assert warm_database_pool(engine, 3) == 3
+        stats = database_pool_stats(engine)
+        assert stats["idle"] == 3
+        assert stats["checked_out"] == 0
+        assert stats["waits"] == waits + 3
+
+        with engine.connect():
+            assert database_pool_stats(engine)["checked_out"] == 1
+        engine.dispose()
+
+    @pytest.mark.anyio
+    async def test_async_database_pool_warm_up(self, tmp_path):
+        database_url = f"sqlite+aiosqlite:///{tmp_path}/pool.db"
+        engine = create_async_engine(
+            database_url, **get_pool_options(database_url, TimedAsyncQueuePool)
+        )
+        assert await warm_async_database_pool(engine, 2) == 2
+        assert database_pool_stats(engine)["idle"] == 2
+        await engine.dispose()
+
+    @pytest.mark.anyio
+    async def test_warm_up_pools_failure(self, monkeypatch, tmp_path):
+        # an unreachable pool is logged, startup goes on
+        def fail(*args):
+            raise ConnectionError("unreachable")
+
+        # throwaway engine, aiosqlite connection threads would outlive the test
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/pool.db")
+        monkeypatch.setattr(monitoring_service, "async_engine", engine)
+        monkeypatch.setattr(monitoring_service, "warm_redis_pool", fail)
+        monkeypatch.setattr(monitoring_service, "REDIS_POOL_MIN_SIZE", 0)
+        monkeypatch.setattr(monitoring_service, "DB_POOL_SIZE", 1)
+        try:
+            await monitoring_service.warm_up_pools()
+            assert database_pool_stats(engine)["idle"] == 1
+        finally:
+            await engine.dispose()
+
+
+class TestMetrics:
+    def test_counter_threads(self):
+        before = metrics.urls_created.collect().get((), 0)
+
+        # every thread counts into its own shard
+        threads = [
+            threading.Thread(
+                target=lambda: [metrics.urls_created.inc() for _ in range(1000)]
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert metrics.urls_created.collect()[()] == before + 4000
+
+    def test_histogram_render(self):
+        metrics.redirect_seconds.observe(0.0003, "memory")
+        metrics.redirect_seconds.observe(20, "memory")
+        counts = metrics.redirect_seconds.collect()[("memory",)]
+
+        text = metrics.render(None)
+        assert "# TYPE redirect_seconds histogram" in text
+        assert 'redirect_seconds_bucket{tier="memory",le="0.0005"}' in text
+        assert f'redirect_seconds_count{{tier="memory"}} {sum(counts[:-1])}' in text
+        # above the last bucket, only in +Inf
+        assert counts[-2] >= 1
+
+    def test_merge_other_workers(self, tmp_path):
+        metrics.urls_created.inc(amount=3)
+        own = metrics.urls_created.collect()[()]
+
+        # another worker's dump with the same totals
+        other = os.getppid()
+        (tmp_path / f"{other}.json").write_text(json.dumps(metrics.snapshot()))
+        (tmp_path / "metrics.json").write_text("half written")
+        assert metrics.merged(str(tmp_path))["urls_created_total"][()] == 2 * own
+
+        # this worker's own dump is never counted twice
+        metrics.dump(str(tmp_path))
+        assert metrics.merged(str(tmp_path))["urls_created_total"][()] == 2 * own
+
+        # a worker that exited, its dump is deleted, not merged
+        exited = subprocess.Popen([sys.executable, "-c", ""])
+        exited.wait()
+        dead = tmp_path / f"{exited.pid}.json"
+        dead.write_text(json.dumps(metrics.snapshot()))
+        assert metrics.merged(str(tmp_path))["urls_created_total"][()] == 2 * own
+        assert not dead.exists()
+        assert (tmp_path / f"{other}.json").exists()
+
+    def test_request_calls(self, tmp_path):
+        calls = metrics.RequestCalls()
+        token = metrics.request_calls.set(calls)
+        try:
+            # a Redis checkout counts even when the server is unreachable
+            pool = TimedBlockingConnectionPool(port=1, socket_connect_timeout=0.1)
+            with pytest.raises(Exception):
+                pool.get_connection()
+
+            engine = create_engine(f"sqlite:///{tmp_path}/calls.db")
+            event.listen(engine, "before_cursor_execute", metrics.count_database_call)
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+            engine.dispose()
+        finally:
+            metrics.request_calls.reset(token)
+
+        assert calls.redis == 1
+        assert calls.database == 2
+
+
+class TestCircuitBreaker:
+    def test_transitions(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(time, "monotonic", lambda: now[0])
+        breaker = CircuitBreaker(2, 5)
+
+        # a reply resets the failures in a row
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        assert breaker.state == "closed"
+        breaker.check()
+
+        breaker.failure()
+        assert breaker.state == "open"
+        with pytest.raises(redis.ConnectionError):
+            breaker.check()
+
+        # one trial once reset_seconds are over, the others still fail fast
+        now[0] += 5
+        assert breaker.state == "half_open"
+        breaker.check()
+        with pytest.raises(redis.ConnectionError):
+            breaker.check()
+
+        # the trial failed, open again
+        breaker.failure()
+        assert breaker.state == "open"
+
+        # a trial that never replied lets the next one through
+        now[0] += 5
+        breaker.check()
+        now[0] += 5
+        breaker.check()
+        breaker.success()
+        assert breaker.state == "closed"
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(0, 5)
+        for _ in range(10):
+            breaker.failure()
+        assert breaker.state == "closed"
+        breaker.check()
+
+    def test_unreachable_redis(self):
+        breaker = CircuitBreaker(2, 60)
+        pool = TimedBlockingConnectionPool(
+            port=1,
+            socket_connect_timeout=0.1,
+            connection_class=BreakerConnection,
+            breaker=breaker,
+        )
+        rejected = metrics.redis_calls_rejected.collect().get((), 0)
+
+        for _ in range(2):
+            with pytest.raises(redis.ConnectionError):
+                pool.get_connection()
+        assert breaker.state == "open"
+
+        # no connection attempt, no wait
+        start = time.perf_counter()
+        with pytest.raises(redis.ConnectionError, match="circuit breaker open"):
+            pool.get_connection()
+        assert time.perf_counter() - start < 0.05
+        assert metrics.redis_calls_rejected.collect().get((), 0) == rejected + 1
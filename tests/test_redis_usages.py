@@ -1,18 +1,48 @@
+import asyncio
 import pytest
+import redis
+from unittest.mock import Mock, patch
 from uuid import uuid4
 from datetime import datetime, timezone, timedelta
 import app.urls.service as urls_service
 import app.users.service as users_service
 import app.auth.service as auth_service
+import app.database.cache as cache
 from app.entities.url import URL
-from app.database.cache import redis_client
+from app.entities.redis_outbox import RedisOutbox
+from app.urls.clicks import click_buffer
+from app.database.cache import (
+    redis_client,
+    drop_url,
+    remember_urls,
+    warm_urls,
+    bloom_ready,
+    new_bloom_bitmap,
+    start_bloom_build,
+    finish_bloom_build,
+    bloom_positions,
+    BLOOM_KEY,
+)
+from app.background_tasks.bloom import rebuild_bloom
+from app.background_tasks import tasks
 from app.background_tasks.tasks import sync_clicks_to_db
-from app.exceptions import AuthenticationError
+from app.background_tasks import rollups
+from app.background_tasks import outbox
+from app.entities.click_rollup import (
+    ClickRollupHourly,
+    ClickRollupDaily,
+    ClickUniquesDaily,
+)
+from app.exceptions import AuthenticationError, UrlNotFoundError
+from redis.exceptions import LockNotOwnedError
 from app.users.model import ChangeUserPassword
 
 
 class TestRedisUsages:
-    def test_urls_service_caching(self, db_session, test_url_public):
+    @pytest.mark.anyio
+    async def test_urls_service_caching(
+        self, db_session, async_session_factory, test_url_public
+    ):
         class UserRequest:
             def __init__(self):
                 self.long_url = test_url_public.long_url
@@ -25,13 +55,18 @@ class TestRedisUsages:
         get_url_cache = redis_client.get(short_code)
         assert get_url_cache == test_url_public.long_url
 
-        # Redis: clicks:short_code -> count
+        # Redis: clicks:short_code -> clicks since the last sync
+        # created by the first click
         get_count_cache = redis_client.get(f"clicks:{short_code}")
-        assert get_count_cache == "0"
+        assert get_count_cache is None
 
         # mimic clicks
         for _ in range(20):
-            urls_service.get_long_url(db_session, short_code)
+            await urls_service.get_long_url(short_code)
+
+        # hot link served from the in-process cache, clicks are buffered
+        assert urls_service.url_cache.get(short_code) == test_url_public.long_url
+        await click_buffer.flush()
 
         get_count_cache = redis_client.get(f"clicks:{short_code}")
         assert get_count_cache == "20"
@@ -41,6 +76,22 @@ class TestRedisUsages:
         url = db_session.query(URL).filter(URL.short_code == short_code).first()
         assert url.clicks == 0
 
+    @pytest.mark.anyio
+    async def test_get_long_url_cache_miss(
+        self, db_session, async_session_factory, test_url_public
+    ):
+        response = urls_service.register_url(db_session, test_url_public)
+        short_code = str(response.short_code).split("/")[-1]
+
+        # Redis evicted the link
+        redis_client.delete(short_code, f"clicks:{short_code}")
+
+        # one pipeline restores the link, counts the click and marks it dirty
+        await urls_service.get_long_url(short_code)
+        assert redis_client.get(short_code) == test_url_public.long_url
+        assert redis_client.get(f"clicks:{short_code}") == "1"
+        assert redis_client.sismember("dirty_clicks", short_code)
+
     def test_sync_clicks_to_db(self, db_session, test_url_public):
         class UserRequest:
             def __init__(self):
@@ -63,22 +114,594 @@ class TestRedisUsages:
             redis_client.sadd("dirty_clicks", short_code)
             assert redis_client.sismember("dirty_clicks", short_code)
 
-        # Redis: clicks -> db
-        sync_clicks_to_db(db_session)
+        # a dirty code without url row, a dirty code without counter
+        redis_client.set("clicks:unknown", 5)
+        redis_client.sadd("dirty_clicks", "unknown")
+        redis_client.delete(f"clicks:{short_codes[0]}")
+
+        # Redis: clicks -> db, several chunks
+        # 19 deltas + the delta of the code without url row
+        synced = sync_clicks_to_db(db_session, chunk_size=7)
+        assert synced == 20
+        assert redis_client.scard("dirty_clicks") == 0
+        assert redis_client.get(f"clicks:{short_codes[1]}") is None
         for i, short_code in enumerate(short_codes):
             # load the url from database to get clicks
             url = db_session.query(URL).filter(URL.short_code == short_code).first()
+            db_session.refresh(url)
             assert url.clicks == i * 2
 
-    def test_users_service_caching(self):
+        # deltas are added, never overwrite the total
+        redis_client.set(f"clicks:{short_codes[1]}", 3)
+        redis_client.sadd("dirty_clicks", short_codes[1])
+        sync_clicks_to_db(db_session)
+        url = db_session.query(URL).filter(URL.short_code == short_codes[1]).first()
+        db_session.refresh(url)
+        assert url.clicks == 2 + 3
+
+    def test_sync_clicks_to_db_failure(self, db_session, test_url_public):
+        response = urls_service.register_url(db_session, test_url_public)
+        short_code = str(response.short_code).split("/")[-1]
+        redis_client.set(f"clicks:{short_code}", 4)
+        redis_client.sadd("dirty_clicks", short_code)
+
+        mock_db = Mock()
+        mock_db.commit.side_effect = Exception
+        with pytest.raises(Exception):
+            sync_clicks_to_db(mock_db)
+
+        # nothing was written, the delta waits in clicks:pending
+        mock_db.rollback.assert_called_once()
+        assert redis_client.hget("clicks:pending", short_code) == "4"
+
+        # clicked again meanwhile
+        redis_client.incr(f"clicks:{short_code}")
+        redis_client.sadd("dirty_clicks", short_code)
+
+        sync_clicks_to_db(db_session)
+        url = db_session.query(URL).filter(URL.short_code == short_code).first()
+        assert url.clicks == 5
+        assert not redis_client.exists("clicks:pending")
+
+    def test_sync_clicks_to_db_lock_expired(
+        self, db_session, test_url_public, monkeypatch
+    ):
+        for _ in range(3):
+            response = urls_service.register_url(db_session, test_url_public)
+            short_code = str(response.short_code).split("/")[-1]
+            redis_client.set(f"clicks:{short_code}", 1)
+            redis_client.sadd("dirty_clicks", short_code)
+
+        # the lock expires during the first chunk
+        lock = Mock()
+        lock.acquire.return_value = True
+        lock.reacquire.side_effect = [None, LockNotOwnedError]
+        lock.release.side_effect = LockNotOwnedError
+        monkeypatch.setattr(redis_client, "lock", Mock(return_value=lock))
+
+        # the run stops after its chunk, without raising on release
+        assert sync_clicks_to_db(db_session, chunk_size=1) == 1
+        assert redis_client.scard("dirty_clicks") == 2
+        assert not redis_client.exists("clicks:pending")
+
+    @pytest.mark.anyio
+    async def test_get_long_url_deleted_during_miss(
+        self, db_session, async_session_factory, test_url_public, monkeypatch
+    ):
+        response = urls_service.register_url(db_session, test_url_public)
+        short_code = str(response.short_code).split("/")[-1]
+        redis_client.delete(short_code)
+
+        # another worker deletes the link between the db read and the cache write
+        cache_url_and_count = urls_service.cache_url_and_count
+
+        async def delete_first(*args, **kwargs):
+            drop_url(short_code)
+            return await cache_url_and_count(*args, **kwargs)
+
+        monkeypatch.setattr(urls_service, "cache_url_and_count", delete_first)
+
+        with pytest.raises(UrlNotFoundError):
+            await urls_service.get_long_url(short_code)
+        assert redis_client.get(short_code) is None
+        assert urls_service.url_cache.get(short_code) is None
+
+    @pytest.mark.anyio
+    async def test_negative_cache(self, async_session_factory, url_load_session):
+        with pytest.raises(UrlNotFoundError):
+            await urls_service.get_long_url("unknown")
+        assert redis_client.exists("missing:unknown")
+
+        # answered by Redis, the database is not queried again
+        db = Mock()
+        db.execute.side_effect = AssertionError("database queried")
+        url_load_session(db)
+        with pytest.raises(UrlNotFoundError):
+            await urls_service.get_long_url("unknown")
+
+        # a url created with that code clears it
+        remember_urls({"unknown": "https://example.com/"}, None)
+        assert not redis_client.exists("missing:unknown")
+        response = await urls_service.get_long_url("unknown")
+        assert response.headers["location"] == "https://example.com/"
+
+    @pytest.mark.anyio
+    async def test_bloom_filter(
+        self, db_session, async_session_factory, test_url_public
+    ):
+        response = urls_service.register_url(db_session, test_url_public)
+        before = str(response.short_code).split("/")[-1]
+        assert not bloom_ready()
+        assert rebuild_bloom(db_session) == 1
+        assert bloom_ready()
+
+        # not in the filter, the database confirms, the next lookups stop at Redis
+        with pytest.raises(UrlNotFoundError):
+            await urls_service.get_long_url("garbage")
+        assert redis_client.exists("missing:garbage")
+
+        # created before and after the build, both pass the filter
+        response = urls_service.register_url(db_session, test_url_public)
+        after = str(response.short_code).split("/")[-1]
+        for short_code in (before, after):
+            redis_client.delete(short_code)
+            await urls_service.get_long_url(short_code)
+
+    @pytest.mark.anyio
+    async def test_bloom_filter_repaired(
+        self, db_session, async_session_factory, test_url_public
+    ):
+        response = urls_service.register_url(db_session, test_url_public)
+        short_code = str(response.short_code).split("/")[-1]
+        rebuild_bloom(db_session)
+
+        # its bits were lost, a failover that kept the ready bit
+        redis_client.delete(short_code)
+        for position in bloom_positions(short_code):
+            redis_client.setbit(BLOOM_KEY, position, 0)
+
+        response = await urls_service.get_long_url(short_code)
+        assert response.headers["location"] == test_url_public.long_url
+        assert all(
+            redis_client.getbit(BLOOM_KEY, p) for p in bloom_positions(short_code)
+        )
+
+        # warm-up sets them again too
+        for position in bloom_positions(short_code):
+            redis_client.setbit(BLOOM_KEY, position, 0)
+        warm_urls({short_code: str(test_url_public.long_url)}, None)
+        assert all(
+            redis_client.getbit(BLOOM_KEY, p) for p in bloom_positions(short_code)
+        )
+
+    def test_bloom_filter_created_during_rebuild(self):
+        start_bloom_build()
+        remember_urls({"during": "https://example.com/"}, None)
+        # the scan didn't see it, it is merged in anyway
+        finish_bloom_build(new_bloom_bitmap())
+
+        assert bloom_ready()
+        assert all(redis_client.getbit(BLOOM_KEY, p) for p in bloom_positions("during"))
+
+    @pytest.mark.anyio
+    async def test_concurrent_misses_one_query(
+        self, db_session, async_db_session, test_url_public, url_load_session
+    ):
+        response = urls_service.register_url(db_session, test_url_public)
+        short_code = str(response.short_code).split("/")[-1]
+        redis_client.delete(short_code)
+
+        class CountingSession:
+            queries = 0
+
+            async def execute(self, *args, **kwargs):
+                CountingSession.queries += 1
+                # a slow database, the other misses arrive meanwhile
+                await asyncio.sleep(0.05)
+                return await async_db_session.execute(*args, **kwargs)
+
+        url_load_session(CountingSession())
+        responses = await asyncio.gather(
+            *(urls_service.get_long_url(short_code) for _ in range(50))
+        )
+        assert CountingSession.queries == 1
+        assert {r.headers["location"] for r in responses} == {test_url_public.long_url}
+        assert not redis_client.exists(f"lease:{short_code}")
+
+        # every request counted its click once
+        await click_buffer.flush()
+        assert redis_client.get(f"clicks:{short_code}") == "50"
+
+    @pytest.mark.anyio
+    async def test_leader_request_cancelled(
+        self, db_session, async_db_session, test_url_public, url_load_session
+    ):
+        response = urls_service.register_url(db_session, test_url_public)
+        short_code = str(response.short_code).split("/")[-1]
+        redis_client.delete(short_code)
+
+        class SlowSession:
+            async def execute(self, *args, **kwargs):
+                await asyncio.sleep(0.05)
+                return await async_db_session.execute(*args, **kwargs)
+
+        # the load has a session of its own, the leader going away
+        # doesn't take it from the request still waiting
+        url_load_session(SlowSession())
+        leader = asyncio.create_task(urls_service.get_long_url(short_code))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(urls_service.get_long_url(short_code))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        response = await follower
+        assert response.headers["location"] == test_url_public.long_url
+        assert leader.cancelled()
+
+    @pytest.mark.anyio
+    async def test_miss_waits_for_other_worker_lease(self, url_load_session):
+        # another worker holds the lease and caches the url shortly
+        redis_client.set("lease:abc", 1, px=2000)
+
+        async def other_worker():
+            await asyncio.sleep(0.05)
+            redis_client.set("abc", "https://example.com/")
+
+        db = Mock()
+        db.execute.side_effect = AssertionError("database queried")
+        url_load_session(db)
+        response, _ = await asyncio.gather(
+            urls_service.get_long_url("abc"), other_worker()
+        )
+        assert response.headers["location"] == "https://example.com/"
+
+    @pytest.mark.anyio
+    async def test_xfetch_early_refresh(self, monkeypatch):
+        redis_client.set("abc", "https://example.com/", px=500)
+
+        # far from expiring, not refreshed
+        monkeypatch.setattr(cache, "URL_TTL_EXTEND_SECONDS", 0)
+        monkeypatch.setattr(cache, "XFETCH_DELTA_SECONDS", 0.000001)
+        await cache.get_url_and_count("abc", 60)
+        assert redis_client.pttl("abc") <= 500
+
+        # the gap outgrows the TTL left, refreshed to the full TTL
+        monkeypatch.setattr(cache, "XFETCH_DELTA_SECONDS", 1000)
+        await cache.get_url_and_count("abc", 60)
+        assert redis_client.pttl("abc") > 59000
+
+    @pytest.mark.anyio
+    async def test_hit_extends_ttl(self, monkeypatch):
+        monkeypatch.setattr(cache, "XFETCH_BETA", 0)
+        monkeypatch.setattr(cache, "URL_TTL_EXTEND_SECONDS", 30)
+        monkeypatch.setattr(cache, "URL_TTL_MAX_SECONDS", 100)
+        redis_client.set("abc", "https://example.com/", ex=10)
+
+        await cache.get_url_and_count("abc", 10)
+        assert 39000 < redis_client.pttl("abc") <= 40000
+        await cache.get_url_and_count("abc", 10)
+        assert 69000 < redis_client.pttl("abc") <= 70000
+
+        # capped
+        for _ in range(3):
+            await cache.get_url_and_count("abc", 10)
+        assert 99000 < redis_client.pttl("abc") <= 100000
+
+    @pytest.mark.anyio
+    async def test_over_memory_budget(self, monkeypatch):
+        monkeypatch.setattr(cache, "URL_TTL_PRESSURE_SECONDS", 60)
+        monkeypatch.setattr(cache.redis_memory, "budget", 1000)
+        monkeypatch.setattr(cache.redis_memory, "used", 2000)
+
+        # new keys get the shorter TTL, even without SHORTCODE_EXPIRE_SECONDS
+        remember_urls({"abc": "https://example.com/"}, 86400)
+        remember_urls({"abd": "https://example.com/"}, None)
+        assert 0 < redis_client.ttl("abc") <= 60
+        assert 0 < redis_client.ttl("abd") <= 60
+
+        # and hits don't extend it
+        await cache.get_url_and_count("abc", 86400)
+        assert redis_client.ttl("abc") <= 60
+
+        # back under budget
+        cache.redis_memory.used = 500
+        await cache.get_url_and_count("abc", 86400)
+        assert redis_client.ttl("abc") > 60
+
+    def test_is_url_key(self, monkeypatch):
+        remember_urls({"abc": "https://example.com/"}, 86400)
+        redis_client.sadd("dirty_clicks", "abc")
+        redis_client.sadd("dirty_uniques", "abc:20260101")
+        redis_client.set("clicks:abc", 1)
+        assert [
+            key
+            for key in ("abc", "dirty_clicks", "dirty_uniques", "clicks:abc")
+            if cache.is_url_key(key)
+        ] == ["abc"]
+
+        monkeypatch.setattr(cache, "REDIS_URL_LAYOUT", "hash")
+        assert cache.is_url_key("u:0")
+        assert not cache.is_url_key("uv:abc:20260101")
+        assert not cache.is_url_key("dirty_uniques")
+
+    @pytest.mark.anyio
+    async def test_lookup_hit_ratio(self, async_session_factory, monkeypatch):
+        monkeypatch.setattr(urls_service.url_cache, "maxsize", 0)
+        lookups = urls_service.url_cache_lookups
+        before = lookups.collect()
+        remember_urls({"abc": "https://example.com/"}, 60)
+
+        await urls_service.get_long_url("abc")
+        with pytest.raises(UrlNotFoundError):
+            await urls_service.get_long_url("zzzzzz")
+
+        after = lookups.collect()
+        for labels in [("redis", "hit"), ("redis", "miss")]:
+            assert after.get(labels, 0) - before.get(labels, 0) == 1
+
+    def test_delete_url_invalidates_caches(self, db_session, test_url_private):
+        response = urls_service.register_url(
+            db_session, test_url_private, test_url_private.user_id
+        )
+        short_code = str(response.short_code).split("/")[-1]
+        urls_service.url_cache.set(short_code, test_url_private.long_url)
+
+        urls_service.delete_url(db_session, short_code, test_url_private.user_id)
+        assert redis_client.get(short_code) is None
+        assert redis_client.get(f"clicks:{short_code}") is None
+        assert urls_service.url_cache.get(short_code) is None
+
+    @pytest.mark.anyio
+    async def test_hash_layout(
+        self, db_session, async_session_factory, test_url_public, monkeypatch
+    ):
+        response = urls_service.register_url(db_session, test_url_public)
+        short_code = str(response.short_code).split("/")[-1]
+        redis_client.delete(short_code)
+        monkeypatch.setattr(cache, "REDIS_URL_LAYOUT", "hash")
+        monkeypatch.setattr(urls_service.url_cache, "maxsize", 0)
+        bucket = cache.url_bucket(short_code)
+
+        # a miss caches the url in its bucket, a hit finds it there
+        for _ in range(2):
+            await urls_service.get_long_url(short_code)
+        long_url = test_url_public.long_url
+        assert redis_client.hget(f"u:{bucket}", short_code) == long_url
+        assert redis_client.hget(f"c:{bucket}", short_code) == "2"
+        assert redis_client.get(short_code) is None
+        assert await cache.peek_url(short_code) == long_url
+
+        # a delta left in the keys layout is synced too
+        redis_client.set(f"clicks:{short_code}", 3)
+        assert sync_clicks_to_db(db_session) == 1
+        url = db_session.query(URL).filter(URL.short_code == short_code).first()
+        db_session.refresh(url)
+        assert url.clicks == 5
+        assert not redis_client.exists(f"c:{bucket}", f"clicks:{short_code}")
+
+        drop_url(short_code)
+        assert redis_client.hget(f"u:{bucket}", short_code) is None
+
+    @pytest.mark.anyio
+    async def test_click_events_rollup(
+        self, db_session, async_session_factory, test_url_private, monkeypatch
+    ):
+        response = urls_service.register_url(
+            db_session, test_url_private, test_url_private.user_id
+        )
+        short_code = str(response.short_code).split("/")[-1]
+        headers = {
+            "referer": "https://news.example.org/item?id=1",
+            "user-agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0)",
+            "cf-ipcountry": "de",
+        }
+
+        # redis tier, then memory tier, no round trip for the events
+        for _ in range(3):
+            await urls_service.get_long_url(short_code, headers)
+        await urls_service.get_long_url(short_code)
+        assert not redis_client.exists(cache.CLICK_EVENTS_STREAM)
+        await click_buffer.flush()
+        assert redis_client.xlen(cache.CLICK_EVENTS_STREAM) == 4
+
+        # a batch that fails stays pending, the next run rolls it up
+        rollups.ensure_group()
+        monkeypatch.setattr(rollups, "upsert_rollups", Mock(side_effect=Exception))
+        with pytest.raises(Exception):
+            rollups.rollup_click_events(db_session, "test")
+        monkeypatch.undo()
+        assert rollups.rollup_click_events(db_session, "test", batch_size=3) == 4
+        assert rollups.rollup_click_events(db_session, "test") == 0
+        pending = redis_client.xpending(cache.CLICK_EVENTS_STREAM, rollups.ROLLUP_GROUP)
+        assert pending["pending"] == 0
+
+        for table in (ClickRollupHourly, ClickRollupDaily):
+            rows = db_session.query(table).filter(table.short_code == short_code)
+            counts = {
+                (row.referrer, row.ua_class, row.country): row.clicks for row in rows
+            }
+            assert counts == {
+                ("news.example.org", "mobile", "DE"): 3,
+                ("", "unknown", ""): 1,
+            }
+
+        stats = urls_service.get_url_stats(
+            db_session, short_code, test_url_private.user_id, "day", 7
+        )
+        assert stats.clicks == 4
+        assert len(stats.series) == 1
+        assert stats.referrers == {"news.example.org": 3, "": 1}
+        with pytest.raises(UrlNotFoundError):
+            urls_service.get_url_stats(db_session, short_code, uuid4())
+
+    def test_rollup_consumers_removed(self, db_session):
+        rollups.ensure_group()
+        redis_client.xadd(cache.CLICK_EVENTS_STREAM, {"c": "abc", "t": 0})
+        redis_client.xreadgroup(
+            rollups.ROLLUP_GROUP, "crashed", {cache.CLICK_EVENTS_STREAM: ">"}
+        )
+        rollups.rollup_click_events(db_session, "idle")
+
+        def consumers():
+            return {
+                info["name"]
+                for info in redis_client.xinfo_consumers(
+                    cache.CLICK_EVENTS_STREAM, rollups.ROLLUP_GROUP
+                )
+            }
+
+        # an event still pending keeps its consumer, for a claim
+        assert not rollups.remove_consumer("crashed")
+        assert rollups.prune_consumers(idle_seconds=0) == 1
+        assert consumers() == {"crashed"}
+
+        # claimed and rolled up, then nothing keeps it
+        with patch.object(rollups, "ROLLUP_CLAIM_SECONDS", 0):
+            assert rollups.rollup_click_events(db_session, "worker") == 1
+        assert rollups.prune_consumers(idle_seconds=3600) == 0
+        assert rollups.remove_consumer("crashed")
+        assert rollups.remove_consumer("worker")
+        assert consumers() == set()
+
+    @pytest.mark.anyio
+    async def test_unique_clicks(
+        self, db_session, async_session_factory, test_url_private, monkeypatch
+    ):
+        response = urls_service.register_url(
+            db_session, test_url_private, test_url_private.user_id
+        )
+        short_code = str(response.short_code).split("/")[-1]
+
+        # 5 clicks of 3 visitors
+        visitors = [("10.0.0.1", "a"), ("10.0.0.1", "a"), ("10.0.0.2", "a")]
+        visitors += [("10.0.0.1", "b"), ("10.0.0.2", "a")]
+        for client_ip, user_agent in visitors:
+            await urls_service.get_long_url(
+                short_code, {"user-agent": user_agent}, client_ip
+            )
+        await click_buffer.flush()
+        assert redis_client.pfcount(cache.visitors_key(short_code)) == 3
+
+        # a failed sync keeps the days for the next one
+        monkeypatch.setattr(tasks, "apply_unique_clicks", Mock(side_effect=Exception))
+        with pytest.raises(Exception):
+            sync_clicks_to_db(db_session)
+        monkeypatch.undo()
+        assert redis_client.scard(cache.DIRTY_UNIQUES) == 1
+        sync_clicks_to_db(db_session)
+        assert not redis_client.exists(cache.DIRTY_UNIQUES)
+
+        url = db_session.query(URL).filter(URL.short_code == short_code).first()
+        db_session.refresh(url)
+        assert (url.clicks, url.unique_clicks) == (5, 3)
+        day = db_session.query(ClickUniquesDaily).filter_by(short_code=short_code)
+        assert [row.visitors for row in day] == [3]
+
+        rollups.ensure_group()
+        rollups.rollup_click_events(db_session, "test")
+        stats = urls_service.get_url_stats(
+            db_session, short_code, test_url_private.user_id, "day", 7
+        )
+        assert [(c.clicks, c.unique_clicks) for c in stats.series] == [(5, 3)]
+
+        drop_url(short_code)
+        assert not redis_client.exists(cache.visitors_key(short_code))
+
+    @pytest.mark.anyio
+    async def test_trending(
+        self, db_session, async_db_session, test_url_private, monkeypatch
+    ):
+        codes = []
+        for user_id in (test_url_private.user_id, None, None):
+            response = urls_service.register_url(db_session, test_url_private, user_id)
+            codes.append(str(response.short_code).split("/")[-1])
+
+        for short_code, clicks in zip(codes, (3, 2, 1)):
+            for _ in range(clicks):
+                await urls_service.get_long_url(short_code)
+        await click_buffer.flush()
+
+        top = await cache.trending_urls("5m", 10)
+        assert [short_code for short_code, _ in top] == codes
+        assert [round(score) for _, score in top] == [3, 2, 1]
+
+        # another user sees the public links only
+        trending = await urls_service.get_trending(
+            async_db_session, test_url_private.user_id, "24h", 2
+        )
+        assert [url.short_code for url in trending] == codes[:2]
+        trending = await urls_service.get_trending(async_db_session, uuid4(), "24h")
+        assert [url.short_code for url in trending] == codes[1:]
+
+        # the hottest codes are warmed into url_cache
+        urls_service.url_cache.clear()
+        assert await urls_service.warm_trending(2) == 2
+        assert codes[0] in urls_service.url_cache
+        assert codes[2] not in urls_service.url_cache
+
+        # 33 windows later: scaled back, what decayed to nothing dropped
+        key = cache.trending_key("5m")
+        landmark = float(redis_client.get(f"{key}:landmark"))
+        redis_client.set(f"{key}:landmark", landmark - 33 * 300)
+        click_buffer.record(codes[2], {})
+        await click_buffer.flush()
+        assert float(redis_client.get(f"{key}:landmark")) > landmark
+        top = dict(await cache.trending_urls("5m", 10))
+        assert set(top) == {codes[0], codes[2]}
+        assert round(top[codes[2]]) == 1
+
+        # bounded, the lowest scores are trimmed
+        monkeypatch.setattr(cache, "TRENDING_MAX_SIZE", 1)
+        click_buffer.record(codes[2], {})
+        await click_buffer.flush()
+        assert redis_client.zrange(key, 0, -1) == [codes[2]]
+
+        drop_url(codes[2])
+        assert not redis_client.zscore(key, codes[2])
+
+    def test_users_service_caching(self, db_session):
         user_id = uuid4()
         timestamp = int(datetime.now(timezone.utc).timestamp())
-        users_service.store_password_changed_in_cache(user_id, timestamp)
+        users_service.store_password_changed_in_cache(db_session, user_id, timestamp)
 
         get_timestamp = redis_client.get(f"user:password_changed:{user_id}")
         assert timestamp == int(get_timestamp)
 
-    def test_password_change_reset_token(self, test_user, db_session):
+        # an earlier change replayed late doesn't overwrite it
+        users_service.publish_password_change(str(user_id), timestamp - 10)
+        assert int(redis_client.get(f"user:password_changed:{user_id}")) == timestamp
+
+    def test_password_change_redis_down(self, test_user, db_session, monkeypatch):
+        token = auth_service.create_access_token(
+            test_user.email, test_user.id, timedelta(minutes=1)
+        )
+        auth_service.verify_token(token)
+
+        client = Mock()
+        client.get.side_effect = redis.ConnectionError("down")
+        monkeypatch.setattr(users_service, "redis_client", client)
+        timestamp = int(datetime.now(timezone.utc).timestamp()) + 1
+        users_service.store_password_changed_in_cache(
+            db_session, test_user.id, timestamp
+        )
+
+        # rejected on this worker at once, even from the token cache
+        with pytest.raises(AuthenticationError):
+            auth_service.verify_token(token)
+        row = db_session.query(RedisOutbox).one()
+        assert (row.op, row.key, row.value) == (
+            "password_changed",
+            str(test_user.id),
+            str(timestamp),
+        )
+
+        monkeypatch.undo()
+        assert outbox.replay_outbox(db_session) == 1
+        last_changed = redis_client.get(f"user:password_changed:{test_user.id}")
+        assert int(last_changed) == timestamp
+
+    @pytest.mark.anyio
+    async def test_password_change_reset_token(self, test_user, db_session):
         db_session.add(test_user)
         db_session.commit()
 
@@ -90,7 +713,7 @@ class TestRedisUsages:
         assert token_data.get_uuid() == test_user.id
 
         form_data = ChangeUserPassword(password="string", new_password="string")
-        users_service.change_user_password(db_session, test_user.id, form_data)
+        await users_service.change_user_password(db_session, test_user.id, form_data)
 
         # get last password change time
         last_changed = redis_client.get(f"user:password_changed:{test_user.id}")
@@ -100,3 +723,30 @@ class TestRedisUsages:
         with pytest.raises(AuthenticationError) as exc_info:
             auth_service.verify_token(token)
             assert exc_info.value == "Token invalid due to password change"
+
+    def test_verified_token_cache(self, test_user, monkeypatch):
+        token = auth_service.create_access_token(
+            test_user.email, test_user.id, timedelta(minutes=5)
+        )
+        assert auth_service.verify_token(token).get_uuid() == test_user.id
+
+        # a cached token costs no Redis round trip
+        monkeypatch.setattr(
+            auth_service.redis_client, "get", Mock(side_effect=AssertionError)
+        )
+        assert auth_service.verify_token(token).get_uuid() == test_user.id
+        monkeypatch.undo()
+
+        # an old change of another user, older than a token lifetime
+        timestamp = int(datetime.now(timezone.utc).timestamp())
+        old = timestamp - auth_service.ACCESS_TOKEN_EXPIRE_MINUTES * 60 - 1
+        auth_service.record_password_change(str(uuid4()), old)
+
+        # password changed on another worker, pushed over pub/sub
+        auth_service.on_password_changed(f"{test_user.id}:{timestamp}")
+        with pytest.raises(AuthenticationError):
+            auth_service.verify_token(token)
+        assert len(auth_service.token_cache) == 0
+
+        # the old change is forgotten, every token before it has expired
+        assert list(auth_service.password_changed) == [str(test_user.id)]
@@ -1,19 +1,53 @@
+import json
+import asyncio
 import pytest
-from unittest.mock import Mock
-from app.urls.utils import encode_base62, decode_base62
+import redis
+from datetime import datetime, timezone, timedelta
+from uuid import uuid4
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import Mock, patch
+from app.urls.utils import (
+    encode_base62,
+    decode_base62,
+    is_short_code,
+    normalize_url,
+    hash_url,
+)
 import app.urls.service as urls_service
 from app.entities.url import URL
-from app.exceptions import UrlNotFoundError, InternalServerError
+from app.exceptions import (
+    UrlNotFoundError,
+    UrlCursorError,
+    InternalServerError,
+    UrlBulkPayloadError,
+    UrlBulkTooLargeError,
+)
 from app.urls.model import ShortUrlRequest
 from app.auth.model import TokenData
+from app.database.memory_cache import TTLCache, SingleFlight, Batcher
+from app.urls.clicks import (
+    ClickBuffer,
+    click_event,
+    ua_class,
+    visitor_fingerprint,
+)
+from app.urls.allocator import IdBlockAllocator
+from app.database.cache import redis_client, url_key
+from app.entities.redis_outbox import RedisOutbox
+from app.background_tasks import outbox
+from app.monitoring.metrics import click_events_dropped
+from app.background_tasks.backfill_url_hash import backfill_url_hash
 
 
 class TestUrlsService:
-    def test_get_long_url(self, db_session, test_url_public):
+    @pytest.mark.anyio
+    async def test_get_long_url(
+        self, db_session, async_session_factory, test_url_public
+    ):
         # non existing url
         with pytest.raises(UrlNotFoundError) as exc_info:
             invalid_short_code = "10"
-            urls_service.get_long_url(db_session, invalid_short_code)
+            await urls_service.get_long_url(invalid_short_code)
             assert (
                 exc_info.value
                 == f"{invalid_short_code} corresponding long url not found"
@@ -25,10 +59,43 @@ class TestUrlsService:
         test_url_public.generate_short_code()
         db_session.commit()
 
-        response = urls_service.get_long_url(db_session, str(test_url_public.id))
+        response = await urls_service.get_long_url(str(test_url_public.id))
         assert response.status_code == 307
         assert response.headers["location"] == test_url_public.long_url
 
+    @pytest.mark.anyio
+    async def test_get_long_url_invalid_code(self, monkeypatch, url_load_session):
+        async def no_io(*args):
+            raise AssertionError("Redis queried")
+
+        monkeypatch.setattr(urls_service, "get_url_and_count", no_io)
+        db = Mock()
+        db.execute.side_effect = AssertionError("database queried")
+        url_load_session(db)
+
+        for short_code in ("bad-code", "0abc", "a" * 11, "ü"):
+            with pytest.raises(UrlNotFoundError):
+                await urls_service.get_long_url(short_code)
+
+    @pytest.mark.anyio
+    async def test_get_long_url_by_id(
+        self, monkeypatch, db_session, async_db_session, test_url_public
+    ):
+        monkeypatch.setattr(urls_service, "URL_LOOKUP_BY_ID", True)
+        db_session.add(test_url_public)
+        db_session.flush()
+        test_url_public.generate_short_code()
+        db_session.commit()
+
+        url = await urls_service.find_long_url(
+            async_db_session, test_url_public.short_code
+        )
+        assert url.long_url == test_url_public.long_url
+
+        # beyond an INTEGER id, or an id without that code
+        assert await urls_service.find_long_url(async_db_session, "zzzzzzz") is None
+        assert await urls_service.find_long_url(async_db_session, "2") is None
+
     def test_register_url_private(self, db_session, test_user, test_url_private):
         # url registration fail
         user_request = ShortUrlRequest(long_url=test_url_private.long_url)
@@ -61,6 +128,101 @@ class TestUrlsService:
             str(response.short_code) == f"{urls_service.SERVER_ADDRESS}/urls/get-url/1"
         )
 
+    @pytest.mark.anyio
+    async def test_create_url(self, db_session, test_user, monkeypatch):
+        monkeypatch.setattr(
+            urls_service, "SessionLocal", sessionmaker(bind=db_session.get_bind())
+        )
+        requests = [
+            (ShortUrlRequest(long_url=f"https://example.com/{i}"), user_id)
+            for i, user_id in enumerate([test_user.id, None, test_user.id])
+        ]
+        responses = await asyncio.gather(
+            *(
+                urls_service.create_url(request, user_id)
+                for request, user_id in requests
+            )
+        )
+        codes = [str(response.short_code).rsplit("/", 1)[1] for response in responses]
+        assert len(set(codes)) == 3
+
+        # one batch, every url with its owner and cached
+        for code, (request, user_id) in zip(codes, requests):
+            url = db_session.query(URL).filter(URL.short_code == code).one()
+            assert (url.long_url, url.user_id) == (str(request.long_url), user_id)
+            key, field = url_key(code)
+            assert redis_client.hget(key, field) if field else redis_client.get(key)
+
+        # a failed batch fails its creates
+        monkeypatch.setattr(urls_service, "insert_urls", Mock(side_effect=Exception))
+        with pytest.raises(InternalServerError):
+            await urls_service.create_url(requests[0][0])
+
+    def test_register_url_dedup(self, db_session, test_user):
+        user_request = ShortUrlRequest(long_url="https://example.com/a")
+        first = urls_service.register_url(
+            db_session, user_request, test_user.id, dedup=True
+        )
+
+        # same url, same user -> same short url, no new row
+        again = urls_service.register_url(
+            db_session,
+            ShortUrlRequest(long_url="HTTPS://Example.com:443/a"),
+            test_user.id,
+            dedup=True,
+        )
+        assert again.short_code == first.short_code
+        assert db_session.query(URL).count() == 1
+
+        # another fragment is another page
+        fragment = urls_service.register_url(
+            db_session,
+            ShortUrlRequest(long_url="https://example.com/a#/billing"),
+            test_user.id,
+            dedup=True,
+        )
+        assert fragment.short_code != first.short_code
+        assert db_session.query(URL).count() == 2
+
+        # public links and dedup=False get their own row
+        public = urls_service.register_url(db_session, user_request, dedup=True)
+        assert public.short_code != first.short_code
+        urls_service.register_url(db_session, user_request, test_user.id)
+        assert db_session.query(URL).count() == 4
+
+    def test_register_urls_bulk_dedup(self, db_session, test_user):
+        urls_service.register_url(
+            db_session, ShortUrlRequest(long_url="https://example.com/0"), test_user.id
+        )
+        items = [
+            {"long_url": "https://example.com/0"},
+            {"long_url": "https://example.com/1"},
+            {"long_url": "HTTPS://Example.com:443/1"},
+        ]
+        results = [
+            json.loads(line)
+            for line in urls_service.register_urls_bulk(
+                db_session, items, test_user.id, dedup=True
+            )
+        ]
+        assert results[0]["short_code"].endswith("/urls/get-url/1")
+        assert results[1]["short_code"] == results[2]["short_code"]
+        assert db_session.query(URL).count() == 2
+
+    def test_backfill_url_hash(self, db_session, test_user):
+        for i in range(5):
+            db_session.add(
+                URL(user_id=test_user.id, long_url=f"https://example.com/{i}")
+            )
+        db_session.commit()
+
+        assert backfill_url_hash(db_session, chunk_size=2) == 5
+        for url in db_session.query(URL):
+            assert url.url_hash == hash_url(url.long_url)
+
+        # nothing left on a rerun
+        assert backfill_url_hash(db_session) == 0
+
     def test_list_urls(self, test_user, db_session):
         # create 20 urls
         for i in range(20):
@@ -75,8 +237,476 @@ class TestUrlsService:
         urls = urls_service.list_urls(current_user, db_session)
         assert len(urls) == 20
         assert all(test_user.id == url.user_id for url in urls)
+        assert urls_service.next_cursor(urls, urls_service.LIST_PAGE_SIZE) is None
+
+    def test_list_urls_pages(self, test_user, db_session):
+        # same created_at for several rows, id breaks the tie
+        created_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        for i in range(7):
+            db_session.add(
+                URL(
+                    user_id=test_user.id,
+                    long_url=f"https://example.com/{i}",
+                    created_at=created_at + timedelta(seconds=i // 3),
+                )
+            )
+        db_session.commit()
+
+        current_user = TokenData(user_id=str(test_user.id))
+        ids, cursor = [], None
+        while True:
+            urls = urls_service.list_urls(current_user, db_session, 3, cursor)
+            ids += [url.id for url in urls]
+            cursor = urls_service.next_cursor(urls, 3)
+            if cursor is None:
+                break
+
+        # newest first, every url exactly once
+        assert ids == [7, 6, 5, 4, 3, 2, 1]
+
+        with pytest.raises(UrlCursorError):
+            urls_service.list_urls(current_user, db_session, 3, "not a cursor")
+
+    def test_export_urls(self, test_user, db_session):
+        for i in range(5):
+            db_session.add(
+                URL(user_id=test_user.id, long_url=f"https://example.com/{i}")
+            )
+        db_session.commit()
+
+        lines = list(urls_service.export_urls(db_session, test_user.id))
+        rows = [json.loads(line) for line in "".join(lines).splitlines()]
+        assert [row["long_url"] for row in rows] == [
+            f"https://example.com/{i}" for i in reversed(range(5))
+        ]
+        assert rows[0]["user_id"] == str(test_user.id)
+
+        text = "".join(urls_service.export_urls(db_session, test_user.id, "csv"))
+        header, *rows = text.splitlines()
+        assert (
+            header == "id,user_id,long_url,short_code,clicks,unique_clicks,created_at"
+        )
+        assert len(rows) == 5
+
+    def test_parse_bulk_request(self, monkeypatch):
+        items = urls_service.parse_bulk_request(
+            b'[{"long_url": "https://example.com/"}]', "application/json"
+        )
+        assert items == [{"long_url": "https://example.com/"}]
+
+        # NDJSON lines are parsed per item, blank lines skipped
+        items = urls_service.parse_bulk_request(
+            b'{"long_url": "https://example.com/"}\n\nnot json\n',
+            "application/x-ndjson",
+        )
+        assert items == [b'{"long_url": "https://example.com/"}', b"not json"]
+
+        with pytest.raises(UrlBulkPayloadError):
+            urls_service.parse_bulk_request(b"not json", "application/json")
+        with pytest.raises(UrlBulkPayloadError):
+            urls_service.parse_bulk_request(b'{"long_url": 1}', "application/json")
+
+        monkeypatch.setattr(urls_service, "BULK_MAX_ITEMS", 1)
+        with pytest.raises(UrlBulkTooLargeError):
+            urls_service.parse_bulk_request(b"[{}, {}]", "application/json")
+
+    def test_register_urls_bulk(self, db_session, test_user):
+        items = [
+            {"long_url": "https://example.com/0"},
+            {"long_url": "ws://example.com/"},
+            b'{"long_url": "https://example.com/2"}',
+            b"not json",
+            {"long_url": "https://example.com/4"},
+        ]
+        lines = list(
+            urls_service.register_urls_bulk(
+                db_session, items, test_user.id, chunk_size=2
+            )
+        )
+        results = [json.loads(line) for line in lines]
+
+        # one result per item, in input order
+        assert [result["index"] for result in results] == [0, 1, 2, 3, 4]
+        assert "error" in results[1]
+        assert "error" in results[3]
+
+        for index in (0, 2, 4):
+            short_code = results[index]["short_code"].split("/")[-1]
+            url = db_session.query(URL).filter(URL.short_code == short_code).first()
+            assert url.long_url == f"https://example.com/{index}"
+            assert url.user_id == test_user.id
+
+        assert db_session.query(URL).count() == 3
+
+    def test_delete_url(self, db_session, test_user, test_url_private):
+        db_session.add(test_url_private)
+        db_session.flush()
+        test_url_private.generate_short_code()
+        db_session.commit()
+        short_code = test_url_private.short_code
+
+        # only the owner can delete
+        with pytest.raises(UrlNotFoundError):
+            urls_service.delete_url(db_session, short_code, uuid4())
+
+        urls_service.delete_url(db_session, short_code, test_user.id)
+        assert (
+            db_session.query(URL).filter(URL.short_code == short_code).first() is None
+        )
+
+        with pytest.raises(UrlNotFoundError):
+            urls_service.delete_url(db_session, short_code, test_user.id)
+
+    @pytest.mark.anyio
+    async def test_get_long_url_redis_down(
+        self, db_session, async_session_factory, test_url_public, monkeypatch
+    ):
+        db_session.add(test_url_public)
+        db_session.flush()
+        test_url_public.generate_short_code()
+        db_session.commit()
+        short_code = test_url_public.short_code
+
+        async def down(*args):
+            raise redis.ConnectionError("down")
+
+        # the lookup fails, the database serves the redirect
+        monkeypatch.setattr(urls_service, "get_url_and_count", down)
+        response = await urls_service.get_long_url(short_code)
+        assert response.headers["location"] == test_url_public.long_url
+        assert urls_service.url_cache.get(short_code) == test_url_public.long_url
+        assert urls_service.click_buffer.drain() == {short_code: 1}
+
+        with pytest.raises(UrlNotFoundError):
+            await urls_service.get_long_url("zzzz")
+
+        # the lookup missed, then the lease fails
+        async def miss(*args):
+            return None
+
+        urls_service.url_cache.clear()
+        monkeypatch.setattr(urls_service, "get_url_and_count", miss)
+        monkeypatch.setattr(urls_service, "take_url_lease", down)
+        response = await urls_service.get_long_url(short_code)
+        assert response.headers["location"] == test_url_public.long_url
+        assert urls_service.click_buffer.drain() == {short_code: 1}
+
+    def test_redis_writes_replayed(self, db_session, test_user, monkeypatch):
+        def down(*args):
+            raise redis.ConnectionError("down")
+
+        monkeypatch.setattr(urls_service, "remember_urls", down)
+        user_request = ShortUrlRequest(long_url="https://example.com/replayed")
+        response = urls_service.register_url(db_session, user_request, test_user.id)
+        short_code = str(response.short_code).rsplit("/", 1)[1]
+        assert [(row.op, row.key) for row in db_session.query(RedisOutbox)] == [
+            ("remember", short_code)
+        ]
+
+        # still down, kept for the next replay
+        monkeypatch.setattr(outbox, "warm_urls", down)
+        with pytest.raises(redis.ConnectionError):
+            outbox.replay_outbox(db_session)
+        db_session.rollback()
+        assert db_session.query(RedisOutbox).count() == 1
+
+        monkeypatch.undo()
+        assert outbox.replay_outbox(db_session) == 1
+        assert db_session.query(RedisOutbox).count() == 0
+        key, field = url_key(short_code)
+        assert redis_client.hget(key, field) if field else redis_client.get(key)
+
+        # a drop is recorded with the delete, cleared once Redis took it
+        urls_service.delete_url(db_session, short_code, test_user.id)
+        assert db_session.query(RedisOutbox).count() == 0
+        assert not (redis_client.hget(key, field) if field else redis_client.get(key))
+
+        response = urls_service.register_url(db_session, user_request, test_user.id)
+        other = str(response.short_code).rsplit("/", 1)[1]
+        monkeypatch.setattr(urls_service, "drop_url", down)
+        urls_service.delete_url(db_session, other, test_user.id)
+        assert [(row.op, row.key) for row in db_session.query(RedisOutbox)] == [
+            ("drop", other)
+        ]
+        monkeypatch.undo()
+        assert outbox.replay_outbox(db_session) == 1
+        assert redis_client.exists(f"deleted:{other}")
+
+    def test_create_replay_after_delete(self, db_session, test_user, monkeypatch):
+        def down(*args):
+            raise redis.ConnectionError("down")
+
+        monkeypatch.setattr(urls_service, "remember_urls", down)
+        user_request = ShortUrlRequest(long_url="https://example.com/gone")
+        response = urls_service.register_url(db_session, user_request, test_user.id)
+        short_code = str(response.short_code).rsplit("/", 1)[1]
+        monkeypatch.undo()
+
+        # the pending create goes with the url, nothing caches it again
+        urls_service.delete_url(db_session, short_code, test_user.id)
+        assert db_session.query(RedisOutbox).count() == 0
+        key, field = url_key(short_code)
+        assert not (redis_client.hget(key, field) if field else redis_client.get(key))
+
+
+class TestTTLCache:
+    def test_get_set(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        assert cache.get("a") is None
+        cache.set("a", "https://example.com/")
+        assert cache.get("a") == "https://example.com/"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["hit_ratio"] == 0.5
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # "a" becomes the most recently used, "b" is evicted
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1, ttl=0)
+        assert cache.get("a") is None
+        assert cache.stats()["expirations"] == 1
+        assert len(cache) == 0
+
+    def test_disabled_and_invalidation(self):
+        cache = TTLCache(maxsize=0, ttl=60)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set("a", 1)
+        cache.delete("a")
+        assert cache.get("a") is None
+
+    def test_stale_generation(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        generation = cache.generation
+
+        # an invalidation lands while the value was being looked up
+        cache.delete("a")
+        cache.set("a", 1, generation=generation)
+        assert cache.get("a") is None
+
+        cache.set("a", 1, generation=cache.generation)
+        assert cache.get("a") == 1
+
+
+class TestSingleFlight:
+    @pytest.mark.anyio
+    async def test_one_run_per_key(self):
+        flight = SingleFlight()
+        runs = []
+
+        async def load(key):
+            runs.append(key)
+            await asyncio.sleep(0.01)
+            if key == "missing":
+                raise KeyError(key)
+            return key.upper()
+
+        results = await asyncio.gather(
+            *(flight.do(key, lambda key=key: load(key)) for key in "aab"),
+            *(flight.do("missing", lambda: load("missing")) for _ in range(2)),
+            return_exceptions=True,
+        )
+        assert runs == ["a", "b", "missing"]
+        assert results[:3] == [("A", True), ("A", False), ("B", True)]
+        assert all(isinstance(result, KeyError) for result in results[3:])
+        assert len(flight) == 0
+
+    @pytest.mark.anyio
+    async def test_leader_cancelled(self):
+        flight = SingleFlight()
+
+        async def load():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        leader = asyncio.ensure_future(flight.do("a", load))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("a", load))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        # the load goes on for the other callers
+        assert await follower == ("done", False)
+
+
+class TestBatcher:
+    @pytest.mark.anyio
+    async def test_one_run_per_batch(self):
+        runs = []
+
+        def run(items):
+            runs.append(items)
+            return [item * 2 for item in items]
+
+        batcher = Batcher(run, max_size=3, wait=0.01)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        assert results == [0, 2, 4, 6, 8]
+        # full at 3, the rest after the wait
+        assert runs == [[0, 1, 2], [3, 4]]
+
+    @pytest.mark.anyio
+    async def test_failed_run(self):
+        def run(items):
+            raise ValueError("down")
+
+        batcher = Batcher(run, max_size=10, wait=0.01)
+        results = await asyncio.gather(
+            batcher.submit(1), batcher.submit(2), return_exceptions=True
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+
+
+class TestIdBlockAllocator:
+    def allocator(self, values):
+        """allocator leasing blocks of 10 off a sequence returning values"""
+        allocator = IdBlockAllocator(Mock(), block_size=10)
+        values = iter(values)
+
+        def lease(db, count):
+            allocator._ids.extend(next(values) for _ in range(count))
+
+        allocator._lease = Mock(side_effect=lease)
+        return allocator
+
+    def test_allocate_from_block(self):
+        allocator = self.allocator(range(1, 100))
+        assert allocator.allocate(None) == [1]
+        assert allocator.allocate(None, 3) == [2, 3, 4]
+
+        # one lease covers 10 ids
+        assert allocator._lease.call_count == 1
+
+        # the rest of the block, then a new one
+        assert allocator.allocate(None, 8) == [5, 6, 7, 8, 9, 10, 11, 12]
+        assert allocator._lease.call_count == 2
+
+    def test_allocate_many_blocks(self):
+        # ids taken by other workers meanwhile are skipped
+        values = [*range(1, 11), *range(31, 41), *range(51, 61)]
+        allocator = self.allocator(values)
+        ids = allocator.allocate(None, 25)
+        assert ids == values[:25]
+        assert len(set(ids)) == 25
+
+        # only the missing blocks are leased, in one round trip
+        allocator._lease.assert_called_once_with(None, 30)
+
+    def test_supported(self, db_session):
+        allocator = IdBlockAllocator(Mock(), block_size=10)
+        # SQLite has no sequences, urls get autoincrement ids
+        assert not allocator.supported(db_session)
 
 
 def test_encode_decode_base62():
     n = 99999999999999999
     assert decode_base62(encode_base62(n)) == n
+    assert decode_base62("zZ") == 35 * 62 + 61
+
+    for invalid in ("", "a-b", "ü"):
+        with pytest.raises(ValueError):
+            decode_base62(invalid)
+
+
+def test_is_short_code():
+    assert is_short_code("0")
+    assert is_short_code("aZ09")
+    assert is_short_code("z" * 10)
+    assert not is_short_code("")
+    assert not is_short_code("01")
+    assert not is_short_code("z" * 11)
+    assert not is_short_code("a b")
+    assert not is_short_code("ab١")
+
+
+class TestNormalizeUrl:
+    def test_normalize_url(self):
+        assert normalize_url("HTTPS://Example.COM") == "https://example.com/"
+        assert (
+            normalize_url("http://example.com:80/a?b=1#c")
+            == "http://example.com/a?b=1#c"
+        )
+        assert (
+            normalize_url("https://example.com:8443/A") == "https://example.com:8443/A"
+        )
+
+    def test_hash_url(self):
+        assert len(hash_url("https://example.com/")) == 64
+        assert hash_url("https://Example.com") == hash_url("https://example.com/")
+        assert hash_url("https://x.com/app#/billing") != hash_url(
+            "https://x.com/app#/settings"
+        )
+        assert hash_url("https://example.com/a") != hash_url("https://example.com/A")
+
+
+class TestClickEvents:
+    def test_ua_class(self):
+        assert ua_class("") == "unknown"
+        assert ua_class("Googlebot/2.1 (+http://www.google.com/bot.html)") == "bot"
+        assert ua_class("curl/8.4.0") == "bot"
+        assert ua_class("Mozilla/5.0 (Linux; Android 14) Mobile Safari") == "mobile"
+        assert ua_class("Mozilla/5.0 (Windows NT 10.0; Win64; x64)") == "desktop"
+
+    def test_click_event(self):
+        event = click_event("abc", 1700000000, "https://t.co/x", "x", "us")
+        assert event == {
+            "c": "abc",
+            "t": 1700000000,
+            "r": "t.co",
+            "u": "desktop",
+            "g": "US",
+        }
+
+        # no referrer, a country header that isn't one
+        event = click_event("abc", 1700000000, "http://[::1", "", "XX1")
+        assert (event["r"], event["u"], event["g"]) == ("", "unknown", "")
+
+    def test_click_visitors(self):
+        buffer = ClickBuffer()
+        with patch("app.urls.clicks.time.time", return_value=1700000000):
+            buffer.record("abc", {"user-agent": "firefox"}, "10.0.0.1")
+            buffer.record("abc", {"user-agent": "firefox"}, "10.0.0.1")
+            buffer.record("abc", {"user-agent": "chrome"}, "10.0.0.1")
+        with patch("app.urls.clicks.time.time", return_value=1700000000 + 86400):
+            buffer.record("abc", {"user-agent": "firefox"}, "10.0.0.1")
+
+        day = 1700000000 - 1700000000 % 86400
+        _, visitors, trending = buffer.drain_events()
+        assert visitors == {
+            ("abc", day): {
+                visitor_fingerprint("10.0.0.1", "firefox"),
+                visitor_fingerprint("10.0.0.1", "chrome"),
+            },
+            ("abc", day + 86400): {visitor_fingerprint("10.0.0.1", "firefox")},
+        }
+        assert trending == {"abc": 4}
+
+    def test_events_buffer_is_bounded(self):
+        dropped = click_events_dropped.collect()
+        before = {kind: dropped.get((kind,), 0) for kind in ("event", "visitor")}
+        buffer = ClickBuffer(events_max=2)
+        for visitor in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+            buffer.record("abc", {}, visitor)
+        buffer.record("abc", {}, "10.0.0.1")
+
+        # the trending counts aren't bounded by the events, the drops are counted
+        events, visitors, trending = buffer.drain_events()
+        assert len(events) == 2
+        assert sum(map(len, visitors.values())) == 2
+        assert trending == {"abc": 4}
+        dropped = click_events_dropped.collect()
+        assert dropped[("event",)] - before["event"] == 2
+        assert dropped[("visitor",)] - before["visitor"] == 1
@@ -20,18 +20,21 @@ class TestUsersService:
         with pytest.raises(UserNotFoundError):
             users_service.get_user_by_id(db_session, uuid4())
 
-    def test_change_user_password(self, db_session, test_user):
+    @pytest.mark.anyio
+    async def test_change_user_password(self, db_session, test_user):
         db_session.add(test_user)
         db_session.commit()
 
         # successful change password
         form_data = ChangeUserPassword(password="string", new_password="string")
-        users_service.change_user_password(db_session, test_user.id, form_data)
+        await users_service.change_user_password(db_session, test_user.id, form_data)
 
         # invalid password
         form_data = ChangeUserPassword(password="invalid", new_password="string")
         with pytest.raises(InvalidPasswordError) as exc_info:
-            users_service.change_user_password(db_session, test_user.id, form_data)
+            await users_service.change_user_password(
+                db_session, test_user.id, form_data
+            )
             assert exc_info == "Current password is incorrect"
 
         # other error
@@ -39,7 +42,7 @@ class TestUsersService:
         mock_db = Mock()
         mock_db.commit.side_effect = Exception
         with pytest.raises(InternalServerError) as exc_info:
-            users_service.change_user_password(mock_db, test_user.id, form_data)
+            await users_service.change_user_password(mock_db, test_user.id, form_data)
             assert exc_info == "An unexpected error occurred"
 
     def test_change_user_username(self, db_session, test_user):
@@ -0,0 +1,77 @@
+from unittest.mock import Mock
+from app.entities.url import URL
+from app.background_tasks import warm_up
+from app.database.cache import redis_client, url_key, drop_url
+
+
+def cached(short_code):
+    key, field = url_key(short_code)
+    return redis_client.hget(key, field) if field else redis_client.get(key)
+
+
+class TestWarmUp:
+    def add_urls(self, db_session, clicks):
+        urls = [
+            URL(long_url=f"https://example.com/{i}", clicks=count)
+            for i, count in enumerate(clicks)
+        ]
+        db_session.add_all(urls)
+        db_session.flush()
+        for url in urls:
+            url.generate_short_code()
+        db_session.commit()
+        return [url.short_code for url in urls]
+
+    def test_warm_up_by_clicks(self, db_session):
+        codes = self.add_urls(db_session, [5, None, 9, 1, 7])
+
+        assert warm_up.warm_up(db_session, size=3, rate=0, chunk_size=2) == 3
+        assert [cached(code) is not None for code in codes] == [
+            True,
+            False,
+            True,
+            False,
+            True,
+        ]
+        assert cached(codes[2]) == "https://example.com/2"
+        assert redis_client.exists(warm_up.WARM_UP_MARKER)
+
+        # cached already, deleted meanwhile, left alone
+        drop_url(codes[3])
+        assert warm_up.warm_up(db_session, size=5, rate=0) == 1
+        assert cached(codes[1]) is not None
+        assert cached(codes[3]) is None
+
+    def test_warm_up_recent_at_a_capped_rate(self, db_session, monkeypatch):
+        codes = self.add_urls(db_session, [5, 9, 1, 7])
+        sleep = Mock()
+        monkeypatch.setattr(warm_up.time, "sleep", sleep)
+
+        assert warm_up.warm_up(db_session, 2, "recent", rate=10, chunk_size=1) == 2
+        assert [cached(code) is not None for code in codes] == [
+            False,
+            False,
+            True,
+            True,
+        ]
+        # 2 urls at 10 per second, the second one waits until 0.2s
+        assert 0.15 < sleep.call_args.args[0] <= 0.2
+
+    def test_ensure_warm(self, monkeypatch):
+        run = Mock()
+        monkeypatch.setattr(warm_up, "warm_up", run)
+        monkeypatch.setattr(warm_up, "SessionLocal", Mock())
+
+        warm_up.ensure_warm()
+        run.assert_called_once()
+
+        # warmed up, until Redis loses its data
+        redis_client.set(warm_up.WARM_UP_MARKER, 1)
+        warm_up.ensure_warm()
+        run.assert_called_once()
+
+        # another worker holds the lock
+        redis_client.delete(warm_up.WARM_UP_MARKER)
+        redis_client.set("urls:warm:lock", "other")
+        warm_up.ensure_warm()
+        run.assert_called_once()
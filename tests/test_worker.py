@@ -0,0 +1,104 @@
+from unittest.mock import patch, MagicMock
+from app.background_tasks.worker import ClickSyncWorker
+
+
+def test_sync_cycle_metrics():
+    worker = ClickSyncWorker(interval=10, dirty_threshold=100, poll_seconds=0)
+
+    with patch("app.background_tasks.worker.SessionLocal") as mock_session:
+        with patch(
+            "app.background_tasks.worker.sync_clicks_to_db", return_value=42
+        ) as mock_task:
+            metrics = worker.sync("interval")
+
+            mock_task.assert_called_once_with(mock_session.return_value)
+            mock_session.return_value.close.assert_called_once()
+
+    assert metrics["synced"] == 42
+    assert metrics["trigger"] == "interval"
+    assert metrics["duration"] >= 0
+    assert metrics["lag"] >= 0
+    assert worker.cycles == 1
+    assert worker.synced_total == 42
+
+
+def test_backlog_trigger_and_shutdown():
+    worker = ClickSyncWorker(interval=3600, dirty_threshold=100, poll_seconds=0)
+    mock_redis = MagicMock()
+    mock_redis.scard.return_value = 150
+    triggers = []
+
+    def fake_sync(trigger):
+        triggers.append(trigger)
+        # SIGTERM arrives while syncing
+        worker.stop()
+
+    with patch("app.background_tasks.worker.redis_client", mock_redis):
+        with patch.object(worker, "sync", side_effect=fake_sync):
+            with patch.object(worker, "rollup", return_value=0):
+                worker.run()
+
+    # backlog past the threshold, then the final flush on shutdown
+    assert triggers == ["backlog", "shutdown"]
+
+
+def test_failed_cycle_keeps_running():
+    worker = ClickSyncWorker(interval=0, dirty_threshold=100, poll_seconds=0)
+    mock_redis = MagicMock()
+    mock_redis.scard.return_value = 0
+    calls = []
+
+    def fake_sync(trigger):
+        calls.append(trigger)
+        if len(calls) == 1:
+            raise Exception("database down")
+        worker.stop()
+
+    with patch("app.background_tasks.worker.redis_client", mock_redis):
+        with patch.object(worker, "sync", side_effect=fake_sync):
+            with patch.object(worker, "rollup", return_value=0):
+                worker.run()
+
+    assert calls == ["interval", "interval", "shutdown"]
+
+
+def test_rollup_every_poll_and_on_shutdown():
+    worker = ClickSyncWorker(interval=3600, dirty_threshold=100, poll_seconds=0)
+    mock_redis = MagicMock()
+    mock_redis.scard.return_value = 0
+    rollups = []
+
+    def fake_rollup():
+        rollups.append(len(rollups))
+        if len(rollups) == 2:
+            raise Exception("database down")
+        if len(rollups) == 3:
+            worker.stop()
+        return 5
+
+    with patch("app.background_tasks.worker.redis_client", mock_redis):
+        with patch.object(worker, "sync"):
+            with patch.object(worker, "rollup", side_effect=fake_rollup):
+                worker.run()
+
+    # a failed rollup doesn't stop the worker, one more on shutdown
+    assert len(rollups) == 4
+
+
+def test_rollup_creates_the_group_once():
+    worker = ClickSyncWorker()
+
+    with patch("app.background_tasks.worker.SessionLocal") as mock_session:
+        with patch("app.background_tasks.worker.ensure_group") as mock_group:
+            with patch("app.background_tasks.worker.prune_consumers") as mock_prune:
+                with patch(
+                    "app.background_tasks.worker.rollup_click_events", return_value=3
+                ):
+                    worker.rollup()
+                    worker.rollup()
+
+    mock_group.assert_called_once()
+    # idle consumers are pruned on start, then every idle period
+    mock_prune.assert_called_once()
+    assert mock_session.return_value.close.call_count == 2
+    assert worker.rolled_up_total == 6